@@ -0,0 +1,883 @@
+"""Benchmarks for Secret Santa double-blind mailer.
+
+This module times the various functions used in secret_santa_mailer.py for
+different numbers of Secret Santas, so that new versions can be compared with
+old ones. Every benchmark returns its results, so they can be saved as JSON,
+and compared with the results saved from another version.
+
+As the original secret_santa_randomiser function slows down sharply with the
+number of Secret Santas, it is only timed up to a limit, which can be raised
+with an optional argument. GIFs are fetched from a local GIPHY stub, so no
+GIPHY API token is needed.
+
+Example:
+    To run this script execute:
+
+        $ python benchmarks_secret_santa_mailer.py <<<LEGACY LIMIT>>>
+            --json <<<RESULTS FILENAME>>> --compare <<<OLD RESULTS FILENAME>>>
+
+    where <<<LEGACY LIMIT>>> is optional, and is the largest number of Secret
+    Santas to time the original secret_santa_randomiser function with. It
+    defaults to 1,000. <<<RESULTS FILENAME>>> is optional, and is a JSON file
+    to save the results to. <<<OLD RESULTS FILENAME>>> is optional, and is a
+    JSON file of results saved from another version, to compare with.
+
+Attributes:
+    roster_sizes (list): Numbers of Secret Santas to time each function with.
+    letter_sizes (list): Numbers of letters to time writing letters with.
+
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import random
+import re
+import sys
+import secret_santa_mailer
+import stand_ins_secret_santa_mailer
+import tempfile
+import time
+import timeit
+from email.mime.image import MIMEImage
+
+roster_sizes = [10, 1000, 100000, 1000000]
+letter_sizes = [10, 1000]
+
+
+def fake_sleighs(n):
+    """Generate a dictionary of fake Secret Santas
+
+    Args:
+        n (int): Number of Secret Santas.
+
+    Yields:
+        sleighs (dict): Dictionary with names as keys, and email addresses as
+            items.
+    """
+    return {"Santa " + str(i): "santa" + str(i) + "@test.me" for i in range(n)}
+
+
+def time_it(func, *args, repeats=3):
+    """Time a function call, taking the best of several repeats
+
+    Args:
+        func (function): Function to time.
+        *args: Arguments to call "func" with.
+        repeats (int): Number of times to call "func".
+
+    Yields:
+        Fastest time, in seconds, taken by a single call of "func".
+    """
+    return min(timeit.repeat(lambda: func(*args), number=1, repeat=repeats))
+
+
+def bench_randomisers(legacy_limit):
+    """Time the original, and the linear-time Secret Santa randomisers
+
+    Args:
+        legacy_limit (int): Largest number of Secret Santas to time the
+            original secret_santa_randomiser function with.
+
+    Yields:
+        Prints, and returns the time taken by each randomiser for each roster
+        size, in seconds. Skipped timings are None.
+    """
+    results = {}
+    print("Secret Santa draw time [seconds]")
+    print("{:>10} {:>15} {:>15}".format("Santas", "randomiser", "derangement"))
+    for n in roster_sizes:
+        sleighs = fake_sleighs(n)
+
+        # Only time the original randomiser up to the legacy limit, and only
+        # once, as it slows down sharply with more Secret Santas
+        if n <= legacy_limit:
+            legacy = time_it(secret_santa_mailer.secret_santa_randomiser,
+                             sleighs, repeats=1)
+        else:
+            legacy = None
+
+        derangement = time_it(secret_santa_mailer.secret_santa_derangement,
+                              sleighs)
+        results[str(n)] = {"randomiser": legacy, "derangement": derangement}
+        print("{:>10,} {:>15} {:>15.6f}".format(n, "skipped" if legacy is None
+                                                else "{:.6f}".format(legacy),
+                                                derangement))
+    return results
+
+
+def bench_batch_draws(n=25, k=10000):
+    """Time many draws one at a time, and all at once in a batch
+
+    Args:
+        n (int): Number of Secret Santas in each draw.
+        k (int): Number of draws.
+
+    Yields:
+        Prints, and returns the number of draws per second for each approach.
+    """
+    sleighs = fake_sleighs(n)
+
+    # Time "k" draws in a Python loop with each randomiser, and then in a
+    # single batch
+    legacy = time_it(lambda: [secret_santa_mailer.secret_santa_randomiser(
+        sleighs) for _ in range(k)], repeats=1)
+    loop = time_it(lambda: [secret_santa_mailer.secret_santa_derangement(
+        sleighs) for _ in range(k)])
+    batch = time_it(secret_santa_mailer.batch_sleigh_cycles, n, k)
+
+    print("\n{:,} draws of {:,} Secret Santas [draws per second]".format(k, n))
+    print("{:>15} {:>15} {:>15}".format("randomiser", "derangement", "batch"))
+    print("{:>15,.0f} {:>15,.0f} {:>15,.0f}".format(k / legacy, k / loop,
+                                                    k / batch))
+    return {"randomiser": k / legacy, "derangement": k / loop,
+            "batch": k / batch}
+
+
+def bench_sharded(n=10 ** 7):
+    """Time drawing one very large roster in one process, and sharded over
+    more, and more processes
+
+    Args:
+        n (int): Number of Secret Santas.
+
+    Yields:
+        Prints, and returns the seconds taken by "random_sleigh_cycle", and by
+        "sharded_sleigh_cycle" with 1, 2, 4, ... processes up to the number of
+        CPUs, and the speed up over one process.
+    """
+    workers = [1]
+    while workers[-1] * 2 <= (os.cpu_count() or 1):
+        workers.append(workers[-1] * 2)
+    if workers[-1] != (os.cpu_count() or 1):
+        workers.append(os.cpu_count())
+
+    single = time_it(secret_santa_mailer.random_sleigh_cycle, n, True,
+                     repeats=1)
+    results = {"single": single}
+    print("\nSharded draw of {:,} Secret Santas [seconds]".format(n))
+    print("{:>10} {:>15} {:>15}".format("processes", "seconds", "speed up"))
+    print("{:>10} {:>15.6f} {:>15}".format("single", single, "-"))
+    for processes in workers:
+        sharded = time_it(secret_santa_mailer.sharded_sleigh_cycle, n, None,
+                          processes, repeats=1)
+        results[str(processes)] = sharded
+        print("{:>10} {:>15.6f} {:>15.2f}".format(processes, sharded,
+                                                  results["1"] / sharded))
+    return results
+
+
+def bench_fairness(n=25, k=1000000, legacy_k=10000):
+    """Time tallying many draws from each pairing engine, and test if they're
+    fair
+
+    Args:
+        n (int): Number of Secret Santas in each draw.
+        k (int): Number of draws for the faster engines.
+        legacy_k (int): Number of draws for the original
+            "secret_santa_randomiser", which is much slower.
+
+    Yields:
+        Prints, and returns the draws tallied per second, and the p values of
+        the pairs test, and of the cycles test against uniform single cycles,
+        and uniform derangements, for each engine.
+    """
+    results = {}
+    print("\nFairness of {:,} Secret Santas [draws per second, p]".format(n))
+    print("{:>25} {:>10} {:>15} {:>10} {:>10} {:>12}".format(
+        "engine", "draws", "per second", "pairs", "cycle", "derangement"))
+    for engine, draws in [(secret_santa_mailer.batch_sleigh_cycles, k),
+                          (secret_santa_mailer.random_sleigh_cycle, k // 10),
+                          (secret_santa_mailer.secret_santa_derangement,
+                           k // 10),
+                          (secret_santa_mailer.secret_santa_randomiser,
+                           legacy_k)]:
+        started = time.perf_counter()
+        santas_tally = secret_santa_mailer.tally_draws(engine, n, draws)
+        seconds = time.perf_counter() - started
+        pairs = santas_tally.pairs_test()[2]
+        cycle = santas_tally.cycles_test("cycle")[2]
+        derangement = santas_tally.cycles_test("derangement")[2]
+        results[engine.__name__] = {"draws": draws,
+                                    "per second": draws / seconds,
+                                    "pairs": pairs, "cycle": cycle,
+                                    "derangement": derangement}
+        print("{:>25} {:>10,} {:>15,.0f} {:>10.4f} {:>10.4f} {:>12.4f}".format(
+            engine.__name__, draws, draws / seconds, pairs, cycle,
+            derangement))
+    return results
+
+
+def bench_exclusions(n=10000, m=5):
+    """Time the exclusion-aware randomiser
+
+    Args:
+        n (int): Number of Secret Santas.
+        m (int): Number of random exclusions per Secret Santa.
+
+    Yields:
+        Prints, and returns the time taken to draw with, and without
+        exclusions, in seconds.
+    """
+    sleighs = fake_sleighs(n)
+    santas = list(sleighs.keys())
+
+    # Exclude "m" random receivers for every giver, the same ones every run
+    santas_dice = random.Random(n * m)
+    exclusions = {santa: set(santas_dice.sample(santas, m)) for santa in
+                  santas}
+
+    derangement = time_it(secret_santa_mailer.secret_santa_derangement,
+                          sleighs)
+    excluded = time_it(secret_santa_mailer.secret_santa_exclusions, sleighs,
+                       exclusions)
+
+    print("\n{:,} Secret Santas with {:,} exclusions each ".format(n, m) +
+          "[seconds]")
+    print("{:>15} {:>15}".format("derangement", "exclusions"))
+    print("{:>15.6f} {:>15.6f}".format(derangement, excluded))
+    return {"derangement": derangement, "exclusions": excluded}
+
+
+def bench_inspections():
+    """Time checking the Secret Santas separately, and in a single pass
+
+    Time the checks as they were originally done, one walk at a time, with the
+    regular expression looked up for every email address, "inspect_sleighs"
+    on its own, and "find_sleighs", and "check_reindeers" as used when drawing,
+    with their messages hidden.
+
+    Yields:
+        Prints, and returns the time taken to check the Secret Santas each way
+        for each roster size, in seconds.
+    """
+    vet_check = r"(^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$)"
+
+    def check_sleighs(santas, reindeers, sleighs):
+        sleighs_report = secret_santa_mailer.inspect_sleighs(santas, reindeers)
+        with contextlib.redirect_stdout(io.StringIO()):
+            secret_santa_mailer.find_sleighs(santas, reindeers, sleighs,
+                                             sleighs_report)
+            secret_santa_mailer.check_reindeers(sleighs, sleighs_report)
+
+    results = {}
+    print("\nSecret Santa check time [seconds]")
+    print("{:>10} {:>15} {:>15} {:>15}".format("Santas", "separate",
+                                               "single pass", "find + check"))
+    for n in roster_sizes:
+        sleighs = fake_sleighs(n)
+        santas, reindeers = list(sleighs.keys()), list(sleighs.values())
+
+        separate = time_it(lambda: (
+            len(santas) != len(set(santas)),
+            len(reindeers) != len(set(reindeers)),
+            [santa for santa in santas if santa not in sleighs],
+            [santa for santa, reindeer in sleighs.items() if
+             re.search(vet_check, reindeer) is None]))
+        single = time_it(secret_santa_mailer.inspect_sleighs, santas,
+                         reindeers)
+        checks = time_it(check_sleighs, santas, reindeers, sleighs)
+
+        results[str(n)] = {"separate": separate, "single pass": single,
+                           "find + check": checks}
+        print("{:>10,} {:>15.6f} {:>15.6f} {:>15.6f}".format(n, separate,
+                                                             single, checks))
+    return results
+
+
+def bench_groups(g=16, n=50000):
+    """Time drawing many groups in a batch, one process, and all CPUs
+
+    Args:
+        g (int): Number of groups.
+        n (int): Number of Secret Santas in each group.
+
+    Yields:
+        Prints, and returns the number of groups drawn per second for each
+        number of processes.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        # Write a roster for each group
+        for i in range(g):
+            with open(os.path.join(folder, "group" + str(i) + ".csv"),
+                      "w") as f:
+                f.write("Name, Email\n")
+                for santa, reindeer in fake_sleighs(n).items():
+                    f.write(santa + ", " + reindeer + "\n")
+        groups = secret_santa_mailer.find_rosters(folder)
+
+        # Time loading, checking, and drawing every group with each number of
+        # processes
+        print("\n{:,} groups of {:,} Secret Santas [groups per second]".format(
+            g, n))
+        print("{:>10} {:>15}".format("workers", "groups"))
+        for workers in sorted({1, os.cpu_count() or 1}):
+            elapsed = time_it(secret_santa_mailer.draw_groups, groups, workers,
+                              repeats=1)
+            results[str(workers)] = g / elapsed
+            print("{:>10,} {:>15,.1f}".format(workers, g / elapsed))
+    return results
+
+
+def deep_size(*santas_objects):
+    """Add up the bytes taken by Python objects, and everything in them
+
+    Args:
+        *santas_objects: Lists, dictionaries, "SantasRoster", or
+            "SantasPairings" to measure. Objects shared between them are only
+            counted once.
+
+    Yields:
+        Total size, in bytes.
+    """
+    seen, total = set(), 0
+    santas_stack = list(santas_objects)
+    while santas_stack:
+        santas_object = santas_stack.pop()
+        if id(santas_object) in seen:
+            continue
+        seen.add(id(santas_object))
+        total += sys.getsizeof(santas_object)
+        if isinstance(santas_object, dict):
+            santas_stack.extend(santas_object.keys())
+            santas_stack.extend(santas_object.values())
+        elif isinstance(santas_object, list):
+            santas_stack.extend(santas_object)
+        elif hasattr(santas_object, "__slots__"):
+            santas_stack.extend(getattr(santas_object, slot) for slot in
+                                santas_object.__slots__ if
+                                getattr(santas_object, slot) is not None)
+    return total
+
+
+def bench_rosters():
+    """Measure the memory taken by the Secret Santas, and their pairings, as
+    lists, and dictionaries, and as a compact "SantasRoster"
+
+    Yields:
+        Prints, and returns the bytes taken per Secret Santa each way, and the
+        seconds taken to load, and draw them as a "SantasRoster", for each
+        roster size.
+    """
+    results = {}
+    print("\nSecret Santa memory [bytes per Secret Santa], and compact " +
+          "roster time [seconds]")
+    print("{:>10} {:>15} {:>15} {:>15} {:>15}".format(
+        "Santas", "lists + dicts", "roster", "load", "draw"))
+    for n in roster_sizes:
+        # Measure the lists of names, and email addresses, and the
+        # dictionaries of Secret Santas, and pairings
+        sleighs = fake_sleighs(n)
+        santas, reindeers = list(sleighs.keys()), list(sleighs.values())
+        santa_pairings = secret_santa_mailer.secret_santa_derangement(sleighs)
+        dicts = deep_size(santas, reindeers, sleighs, santa_pairings) / n
+        del santas, reindeers, santa_pairings
+
+        # Measure the roster, and its pairings, and time loading, and drawing
+        # them
+        started = time.perf_counter()
+        santas_roster = secret_santa_mailer.SantasRoster(sleighs.items())
+        load = time.perf_counter() - started
+        del sleighs
+        started = time.perf_counter()
+        santa_pairings = secret_santa_mailer.secret_santa_derangement(
+            santas_roster)
+        draw = time.perf_counter() - started
+        roster = deep_size(santas_roster, santa_pairings) / n
+
+        results[str(n)] = {"lists + dicts": dicts, "roster": roster,
+                           "load": load, "draw": draw}
+        print("{:>10,} {:>15,.0f} {:>15,.0f} {:>15.6f} {:>15.6f}".format(
+            n, dicts, roster, load, draw))
+    return results
+
+
+def bench_templates(k=100):
+    """Time importing, and compiling the email templates
+
+    Args:
+        k (int): Number of times to import each template.
+
+    Yields:
+        Prints, and returns the time taken to import, and compile each
+        template once, in seconds.
+    """
+    plain_import = time_it(lambda: [secret_santa_mailer.import_template(
+        ".txt", "./templates") for _ in range(k)]) / k
+    html_import = time_it(lambda: [secret_santa_mailer.import_template(
+        ".html", "./templates", "utf8") for _ in range(k)]) / k
+    html_body = secret_santa_mailer.import_template(".html", "./templates",
+                                                    "utf8")
+    html_compile = time_it(lambda: [secret_santa_mailer.compile_template(
+        html_body) for _ in range(k)]) / k
+
+    print("\nTemplate time [seconds]")
+    print("{:>15} {:>15} {:>15}".format("import .txt", "import .html",
+                                        "compile .html"))
+    print("{:>15.6f} {:>15.6f} {:>15.6f}".format(plain_import, html_import,
+                                                 html_compile))
+    return {"import .txt": plain_import, "import .html": html_import,
+            "compile .html": html_compile}
+
+
+def bench_letters():
+    """Time writing letters from scratch, and from a pre-built skeleton
+
+    The skeleton is also timed with a 500 KB GIF, both as a plain MIME image,
+    and as a "SantasPicture" shared between letters, e.g. from "giphy_pool",
+    which is only turned into text once.
+
+    Yields:
+        Prints, and returns the number of letters written per second for each
+        approach, for each number of letters.
+    """
+    plain_body = secret_santa_mailer.import_template(".txt", "./templates")
+    html_body = secret_santa_mailer.import_template(".html", "./templates",
+                                                    "utf8")
+
+    # Use a tiny GIF, so only writing the letters is timed
+    santas_picture = MIMEImage(stand_ins_secret_santa_mailer.tiny_gif, "gif")
+    santas_picture.add_header("Content-ID", "<tiny>")
+    giphy = (santas_picture, "https://giphy.test/tiny.gif", "tiny")
+
+    # Pad the tiny GIF to a more typical size for the shared pictures
+    big_gif = stand_ins_secret_santa_mailer.tiny_gif.ljust(500 * 2 ** 10,
+                                                           b"\0")
+
+    results = {}
+    print("\nLetters written [letters per second]")
+    print("{:>10} {:>15} {:>15} {:>15} {:>15}".format(
+        "Letters", "write_letter", "skeleton", "500 KB GIF", "shared"))
+    for k in letter_sizes:
+
+        # Time "k" letters built as MIME objects, and then from a skeleton
+        scratch = time_it(lambda: [secret_santa_mailer.write_letter(
+            "santa@test.me", "elf@test.me", "Giver", "Receiver", plain_body,
+            html_body, giphy).as_string() for _ in range(k)])
+        letter_skeleton = secret_santa_mailer.LetterSkeleton(
+            "santa@test.me", plain_body, html_body)
+        skeleton = time_it(lambda: [letter_skeleton.write(
+            "elf@test.me", "Giver", "Receiver", giphy) for _ in range(k)])
+
+        # Time "k" letters with a 500 KB GIF, each with its own MIME image,
+        # and then all sharing the same picture
+        big_picture = MIMEImage(big_gif, "gif")
+        big_picture.add_header("Content-ID", "<big>")
+        big = time_it(lambda: [letter_skeleton.write(
+            "elf@test.me", "Giver", "Receiver", (big_picture, "", "big")) for
+            _ in range(k)], repeats=1)
+        shared_picture = secret_santa_mailer.SantasPicture(big_gif)
+        shared_picture.add_header("Content-ID", "<big>")
+        shared = time_it(lambda: [letter_skeleton.write(
+            "elf@test.me", "Giver", "Receiver", (shared_picture, "", "big"))
+            for _ in range(k)], repeats=1)
+
+        results[str(k)] = {"write_letter": k / scratch,
+                           "skeleton": k / skeleton, "500 KB GIF": k / big,
+                           "shared": k / shared}
+        print("{:>10,} {:>15,.0f} {:>15,.0f} {:>15,.0f} {:>15,.0f}".format(
+            k, k / scratch, k / skeleton, k / big, k / shared))
+    return results
+
+
+def bench_spool(k=10000):
+    """Time spooling letters to disk, and sending them from the spool
+
+    Args:
+        k (int): Number of letters to spool.
+
+    Yields:
+        Prints, and returns the number of letters spooled per second to an
+        mbox file, and to a Maildir folder, and sent per second from the mbox
+        file to a local SMTP sink.
+    """
+    sleighs = fake_sleighs(k)
+    santa_pairings = secret_santa_mailer.secret_santa_derangement(sleighs)
+
+    # Use a tiny GIF, so only writing the letters is timed
+    def tiny_giphy():
+        santas_picture = MIMEImage(stand_ins_secret_santa_mailer.tiny_gif,
+                                   "gif")
+        santas_picture.add_header("Content-ID", "<tiny>")
+        return santas_picture, "https://giphy.test/tiny.gif", "tiny"
+
+    mime_giphy = secret_santa_mailer.mime_giphy
+    secret_santa_mailer.mime_giphy = tiny_giphy
+    smtp_sink = stand_ins_secret_santa_mailer.start_smtp_sink()
+    secret_santa_mailer.santas_key = "Test"
+    try:
+        with tempfile.TemporaryDirectory() as santas_workshop, \
+                contextlib.redirect_stdout(io.StringIO()):
+            mbox = os.path.join(santas_workshop, "letters.mbox")
+            maildir = os.path.join(santas_workshop, "letters")
+            started = time.perf_counter()
+            secret_santa_mailer.spool_letters("santa@test.me", sleighs,
+                                              santa_pairings, mbox, "mbox")
+            mbox_time = time.perf_counter() - started
+            started = time.perf_counter()
+            secret_santa_mailer.spool_letters("santa@test.me", sleighs,
+                                              santa_pairings, maildir,
+                                              "maildir")
+            maildir_time = time.perf_counter() - started
+            started = time.perf_counter()
+            secret_santa_mailer.replay_spool("santa@test.me", mbox,
+                                             "localhost",
+                                             smtp_sink.server_address[1],
+                                             False)
+            replay_time = time.perf_counter() - started
+    finally:
+        secret_santa_mailer.mime_giphy = mime_giphy
+        smtp_sink.shutdown()
+        smtp_sink.server_close()
+
+    print("\n{:,} spooled letters [letters per second]".format(k))
+    print("{:>15} {:>15} {:>15}".format("mbox", "maildir", "replay mbox"))
+    print("{:>15,.0f} {:>15,.0f} {:>15,.0f}".format(k / mbox_time,
+                                                    k / maildir_time,
+                                                    k / replay_time))
+    return {"mbox": k / mbox_time, "maildir": k / maildir_time,
+            "replay mbox": k / replay_time}
+
+
+def bench_giphy(k=100, connect_latency=0.005):
+    """Time fetching GIFs from a local GIPHY stub, opening a new connection
+    for every request, and keeping connections alive
+
+    Args:
+        k (int): Number of GIFs to fetch each way.
+        connect_latency (float): Seconds the stub waits before accepting each
+            new connection, standing in for the TCP, and TLS handshakes.
+
+    Yields:
+        Prints, and returns the number of GIFs fetched per second each way,
+        with, and without the stand-in handshakes.
+    """
+    secret_santa_mailer.giphy_api_token = "Test"
+    giphy_api_url = secret_santa_mailer.giphy_api_url
+    results = {}
+    print("\n{:,} GIFs from a local GIPHY stub [GIFs per second, ".format(k) +
+          "connections opened]")
+    print("{:>15} {:>15} {:>15} {:>15}".format("handshake", "connections",
+                                               "per second", "opened"))
+    for handshake in [0, connect_latency]:
+        for connections in ["new", "keep-alive"]:
+            giphy_stub = stand_ins_secret_santa_mailer.start_giphy_stub(
+                connect_latency=handshake)
+            secret_santa_mailer.giphy_api_url = giphy_stub.api_url
+            if connections == "keep-alive":
+                secret_santa_mailer.giphy_client = \
+                    secret_santa_mailer.GiphyClient()
+            try:
+                fetches = time_it(lambda: [secret_santa_mailer.mime_giphy()
+                                           for _ in range(k)])
+            finally:
+                if secret_santa_mailer.giphy_client is not None:
+                    secret_santa_mailer.giphy_client.close()
+                    secret_santa_mailer.giphy_client = None
+                secret_santa_mailer.giphy_api_url = giphy_api_url
+                giphy_stub.shutdown()
+                giphy_stub.server_close()
+            print("{:>12.0f} ms {:>15} {:>15,.0f} {:>15,}".format(
+                handshake * 1000, connections, k / fetches,
+                giphy_stub.connections))
+            results.setdefault("{:.0f} ms".format(handshake * 1000), {})[
+                connections] = k / fetches
+    return results
+
+
+def bench_gif_budget(k=50):
+    """Measure the size of letters with GIFs from a local GIPHY stub, with
+    and without a byte budget, and only linking to GIFs
+
+    The stub offers renditions of each GIF about as big as GIPHY's.
+
+    Args:
+        k (int): Number of letters to write each way.
+
+    Yields:
+        Prints, and returns the average letter size in KB, and the letters
+        written per second each way.
+    """
+    giphy_stub = stand_ins_secret_santa_mailer.start_giphy_stub(
+        renditions={"fixed_height_downsampled": 450000,
+                    "fixed_width_downsampled": 380000,
+                    "fixed_height_small": 150000,
+                    "fixed_width_small": 120000,
+                    "fixed_height_small_still": 12000})
+    giphy_api_url = secret_santa_mailer.giphy_api_url
+    secret_santa_mailer.giphy_api_url = giphy_stub.api_url
+    secret_santa_mailer.giphy_api_token = "Test"
+    letter_skeleton = secret_santa_mailer.LetterSkeleton(
+        "santa@test.me", secret_santa_mailer.import_template(".txt",
+                                                             "./templates"),
+        secret_santa_mailer.import_template(".html", "./templates", "utf8"))
+    results = {}
+    print("\n{:,} letters with GIFs from a local GIPHY stub ".format(k) +
+          "[KB per letter, letters per second]")
+    print("{:>15} {:>15} {:>15}".format("budget", "KB", "per second"))
+    try:
+        for budget, giphy_budget in [
+                ("none", None),
+                ("200 KB", secret_santa_mailer.GiphyBudget(200 * 1024)),
+                ("50 KB", secret_santa_mailer.GiphyBudget(50 * 1024)),
+                ("link only", secret_santa_mailer.GiphyBudget(
+                    link_only=True))]:
+            secret_santa_mailer.giphy_budget = giphy_budget
+            started = time.perf_counter()
+            letter_bytes = sum(len(letter_skeleton.write(
+                "elf@test.me", "Santa", "Rudolph",
+                secret_santa_mailer.mime_giphy())) for _ in range(k))
+            seconds = time.perf_counter() - started
+            results[budget] = {"KB": letter_bytes / k / 1024,
+                               "per second": k / seconds}
+            print("{:>15} {:>15,.1f} {:>15,.0f}".format(
+                budget, letter_bytes / k / 1024, k / seconds))
+    finally:
+        secret_santa_mailer.giphy_budget = None
+        secret_santa_mailer.giphy_api_url = giphy_api_url
+        giphy_stub.shutdown()
+        giphy_stub.server_close()
+    return results
+
+
+def percentile(values, q):
+    """Find a percentile of some values, using the nearest rank
+
+    Args:
+        values (list): Values to find the percentile of.
+        q (float): Percentile to find, between 0, and 100.
+
+    Yields:
+        The smallest value that at least "q" percent of values are less than,
+        or equal to, or None if there are no values.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(math.ceil(q / 100 * len(values)) - 1, 0)]
+
+
+def bench_load(n, postmen=1, use_asyncio=False, pace=None, gif_pool=None,
+               pipeline=False, **sink_options):
+    """Send letters to many Secret Santas through a local SMTP sink
+
+    Drive the same steps as "secret_santa_mailer", without asking to
+    continue: check, and draw the Secret Santas, then write, and send every
+    letter, with GIFs from a local GIPHY stub, to a local SMTP sink.
+
+    Args:
+        n (int): Number of Secret Santas.
+        postmen (int): Number of connections to send letters over.
+        use_asyncio (bool): If True, send letters with "call_postman_async".
+        pace (float): If given, pace letters with a "SantasPacer", starting at
+            this many letters per second.
+        gif_pool (int): If given, fetch this many GIFs up front, and share
+            them between the letters, including the time taken to fetch them.
+        pipeline (bool): If True, send letters with a "LetterPipeline".
+        **sink_options: Any SmtpSink options, e.g. "latency", "throttle", or
+            "failure_rate".
+
+    Yields:
+        Prints, and returns the number of letters sent per second, the
+        percentiles of the seconds taken to write, and send each letter, the
+        number of letters sent, lost, and turned away by the sink, and the
+        total seconds spent in each stage, from "SantasStopwatch".
+    """
+    sleighs = fake_sleighs(n)
+    smtp_sink = stand_ins_secret_santa_mailer.start_smtp_sink(**sink_options)
+    giphy_stub = stand_ins_secret_santa_mailer.start_giphy_stub()
+    giphy_api_url = secret_santa_mailer.giphy_api_url
+    secret_santa_mailer.giphy_api_url = giphy_stub.api_url
+    secret_santa_mailer.santas_key = "Test"
+    secret_santa_mailer.giphy_api_token = "Test"
+    post_office = ("localhost", smtp_sink.server_address[1], False)
+    santas_stopwatch = secret_santa_mailer.SantasStopwatch()
+    secret_santa_mailer.santas_stopwatch = santas_stopwatch
+    santas_pacer = secret_santa_mailer.SantasPacer(rate=pace) if pace else None
+
+    try:
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            if gif_pool:
+                secret_santa_mailer.giphy_pool = (
+                    secret_santa_mailer.GiphyPool(gif_pool))
+                secret_santa_mailer.giphy_pool.fill()
+            sleighs, santa_pairings = secret_santa_mailer.draw_sleighs(
+                list(sleighs.keys()), list(sleighs.values()))
+            if pipeline:
+                deliveries = secret_santa_mailer.LetterPipeline(
+                    "santa@test.me", {giver: (sleighs[giver], giver,
+                                              santa_pairings[giver])
+                                      for giver in santa_pairings},
+                    postmen=postmen, host=post_office[0],
+                    port=post_office[1], tls=post_office[2],
+                    pacer=santas_pacer).run()
+            elif use_asyncio:
+                deliveries = asyncio.run(
+                    secret_santa_mailer.call_postman_async(
+                        "santa@test.me", sleighs, santa_pairings, postmen,
+                        8, *post_office, pacer=santas_pacer))
+            elif postmen > 1:
+                deliveries = secret_santa_mailer.call_postmen(
+                    "santa@test.me", sleighs, santa_pairings, postmen,
+                    *post_office, pacer=santas_pacer)
+            else:
+                deliveries = secret_santa_mailer.call_postman(
+                    "santa@test.me", sleighs, santa_pairings, *post_office,
+                    pacer=santas_pacer)
+        seconds = time.perf_counter() - started
+    finally:
+        secret_santa_mailer.giphy_api_url = giphy_api_url
+        secret_santa_mailer.santas_stopwatch = None
+        secret_santa_mailer.giphy_pool = None
+        for server in [smtp_sink, giphy_stub]:
+            server.shutdown()
+            server.server_close()
+
+    # Summarise the deliveries
+    latencies = [posted for delivery, posted in deliveries.values()]
+    sent = sum(delivery == "sent" for delivery, _ in deliveries.values())
+    results = {"letters per second": sent / seconds,
+               "p50": percentile(latencies, 50),
+               "p90": percentile(latencies, 90),
+               "p99": percentile(latencies, 99),
+               "max": max(latencies),
+               "sent": sent,
+               "lost": len(deliveries) - sent,
+               "refusals": dict(smtp_sink.refusals),
+               "stages": {name: histogram["sum"] for name, histogram in
+                          santas_stopwatch.report()["histograms"].items()}}
+
+    print("\n{:,} Secret Santas, {:,} postmen{} [letters per second, ".format(
+        n, postmen, " with asyncio" if use_asyncio else " in a pipeline" if
+        pipeline else "") +
+        "and seconds per letter]")
+    print("{:>15} {:>10} {:>10} {:>10} {:>10} {:>8} {:>8}".format(
+        "letters/s", "p50", "p90", "p99", "max", "sent", "lost"))
+    print("{:>15,.0f} {:>10.4f} {:>10.4f} {:>10.4f} {:>10.4f} {:>8,} {:>8,}"
+          .format(results["letters per second"], results["p50"],
+                  results["p90"], results["p99"], results["max"], sent,
+                  results["lost"]))
+    print(("Turned away by the sink: {throttled:,} throttled, and " +
+           "{failed:,} failed").format(**smtp_sink.refusals))
+    print("Seconds in each stage: " + ", ".join(
+        name + " " + "{:.3f}".format(seconds) for name, seconds in
+        sorted(results["stages"].items())))
+    if santas_stopwatch.gauges:
+        results["queue peaks"] = dict(santas_stopwatch.gauges)
+        print("Most letters waiting: " + ", ".join(
+            name + " " + str(value) for name, value in
+            sorted(santas_stopwatch.gauges.items())))
+    return results
+
+
+def compare_results(old_results, new_results, path=""):
+    """Print how much faster, or slower new results are than old ones
+
+    Args:
+        old_results (dict): Results saved from another version.
+        new_results (dict): Results from this version.
+        path (str): Names of the benchmarks leading to these results.
+
+    Yields:
+        Prints each timing in both results, with the ratio of the new timing to
+        the old one. Timings in seconds are better below 1, and timings per
+        second are better above 1.
+    """
+    for name, new_result in new_results.items():
+        old_result = old_results.get(name)
+        if isinstance(new_result, dict) and isinstance(old_result, dict):
+            compare_results(old_result, new_result, path + name + " / ")
+        elif (isinstance(new_result, (int, float)) and
+              isinstance(old_result, (int, float)) and old_result):
+            print("{:<60} {:>15.6g} {:>15.6g} {:>8.2f}x".format(
+                path + name, old_result, new_result, new_result / old_result))
+
+
+# Standalone program execution
+if __name__ == '__main__':
+
+    # Parse the command line arguments
+    santas_parser = argparse.ArgumentParser(description="Benchmarks for " +
+                                            "Secret Santa double-blind mailer")
+    santas_parser.add_argument("legacy_limit", nargs="?", type=int,
+                               default=1000, help="Largest number of Secret " +
+                               "Santas to time the original randomiser with")
+    santas_parser.add_argument("--json", help="JSON file to save the " +
+                               "results to")
+    santas_parser.add_argument("--compare", help="JSON file of results saved " +
+                               "from another version, to compare with")
+    santas_parser.add_argument("--load", type=int, help="Only send letters " +
+                               "to this many Secret Santas through a local " +
+                               "SMTP sink")
+    santas_parser.add_argument("--postmen", type=int, default=1,
+                               help="Number of connections to send letters " +
+                               "over in the load test")
+    santas_parser.add_argument("--asyncio", action="store_true",
+                               help="Send letters using asyncio in the load " +
+                               "test")
+    santas_parser.add_argument("--pipeline", action="store_true",
+                               help="Send letters in a pipeline of stages " +
+                               "in the load test")
+    santas_parser.add_argument("--pace", type=float, help="Pace letters in " +
+                               "the load test, starting at this many " +
+                               "letters per second")
+    santas_parser.add_argument("--gif-pool", type=int, help="Share this " +
+                               "many GIFs between the letters in the load " +
+                               "test")
+    santas_parser.add_argument("--latency", type=float, default=0,
+                               help="Seconds the SMTP sink waits before " +
+                               "answering each command")
+    santas_parser.add_argument("--throttle", type=float, help="Most letters " +
+                               "the SMTP sink accepts per second")
+    santas_parser.add_argument("--failure-rate", type=float, default=0,
+                               help="Share of letters the SMTP sink turns " +
+                               "away at random")
+    santas_args = santas_parser.parse_args()
+    if santas_args.asyncio and santas_args.pipeline:
+        santas_parser.error("--asyncio can't be used with --pipeline")
+
+    # Only run the load test if asked, otherwise run every benchmark
+    if santas_args.load:
+        santas_results = {"load": bench_load(
+            santas_args.load, santas_args.postmen, santas_args.asyncio,
+            santas_args.pace, santas_args.gif_pool, santas_args.pipeline,
+            latency=santas_args.latency, throttle=santas_args.throttle,
+            failure_rate=santas_args.failure_rate)}
+    else:
+        santas_results = {
+            "randomisers": bench_randomisers(santas_args.legacy_limit),
+            "batch_draws": bench_batch_draws(),
+            "exclusions": bench_exclusions(),
+            "inspections": bench_inspections(),
+            "fairness": bench_fairness(),
+            "sharded": bench_sharded(),
+            "groups": bench_groups(),
+            "rosters": bench_rosters(),
+            "templates": bench_templates(),
+            "letters": bench_letters(),
+            "spool": bench_spool(),
+            "giphy": bench_giphy(),
+            "gif_budget": bench_gif_budget()}
+
+    # Save the results, with details of where they were run
+    if santas_args.json:
+        with open(santas_args.json, "w") as f:
+            json.dump({"python": platform.python_version(),
+                       "machine": platform.platform(),
+                       "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "results": santas_results}, f, indent=2)
+
+    # Compare the results with those from another version
+    if santas_args.compare:
+        with open(santas_args.compare, "r") as f:
+            old_santas_results = json.load(f)["results"]
+        print("\nComparison with " + santas_args.compare + " [old, new, " +
+              "new / old, in seconds, or per second for draws, letters, and " +
+              "GIFs]")
+        compare_results(old_santas_results, santas_results)
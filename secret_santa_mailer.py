@@ -19,30 +19,363 @@ Example:
     To run this script execute:
 
         $ python secret_santa_mailer.py <<<EMAIL ADDRESS>>> <<<CSV FILENAME>>>
-            <<<KEEP GIFS VALUE>>>
+            <<<KEEP GIFS VALUE>>> --exclusions <<<EXCLUSIONS FILENAME>>>
 
     where <<<EMAIL ADDRESS>>> is the outgoing Secret Santa Gmail mailbox, and
     <<<CSV FILENAME>>> is a CSV containing the Secret Santa names, and their
     email addresses. <<<KEEP GIFS VALUE>>> is optional; if it's set to 1, all
-    GIFs that are embedded into the emails are saved locally, otherwise they are
-    only temporarily stored until the emails have been generated.
+    GIFs that are embedded into the emails are saved locally in a cache, which
+    is kept between runs, and limited to --gif-cache-mb <<<MB>>>, otherwise they
+    are only temporarily stored until the emails have been generated. If it's
+    set to 2, cached GIFs are also used when GIPHY is slow, or unavailable.
+    <<<EXCLUSIONS FILENAME>>> is optional, and is a CSV containing givers, and
+    receivers they must not be paired with. Add --postmen <<<POSTMEN>>> to
+    send letters over <<<POSTMEN>>> connections in parallel, and --asyncio to
+    download GIFs, and send letters at the same time using asyncio. Add
+    --host <<<HOST>>>, --port <<<PORT>>>, and --no-tls to send letters through
+    another email server, e.g. a local SMTP sink. Add --spool <<<SPOOL>>> to
+    write letters to an mbox file, or, with --spool-format maildir, a Maildir
+    folder, instead of sending them. Send them later with:
+
+        $ python secret_santa_mailer.py <<<EMAIL ADDRESS>>> --replay <<<SPOOL>>>
 
 Attributes:
+    giphy_api_url (str): GIPHY API endpoint for random GIFs. Point this at a
+        local stand-in to test without GIPHY.
+    giphy_cache (GiphyCache): Cache of downloaded GIFs, or None to delete
+        GIFs once they've been embedded.
+    giphy_pool (GiphyPool): Pool of GIFs fetched up front to share between
+        letters, or None to fetch a GIF for each letter.
+    giphy_budget (GiphyBudget): Byte budget for the GIF in each letter, and
+        whether to only link to GIFs, or None to always embed the
+        "fixed_height_downsampled" rendition.
+    giphy_client (GiphyClient): Kept-alive connections to GIPHY, and its GIF
+        hosts, or None to open new connections for every request.
+    santas_stopwatch (SantasStopwatch): Timings, and counts for the run, or
+        None to not measure anything.
+    VET_CHECK (re.Pattern): Compiled email address validation regular
+        expression.
+    FROM_LINE (re.Pattern): Compiled regular expression for lines that need
+        escaping in mbox spools.
+    THROTTLE_REPLY (re.Pattern): Compiled regular expression for enhanced
+        status codes of email servers asking to slow down.
+    GIPHY_RENDITIONS (tuple): Names of the GIPHY renditions to pick from,
+        best first.
 
 """
+import argparse
+import array
+import asyncio
+import atexit
+import base64
+import bisect
+import collections
+import collections.abc
+import concurrent.futures
+import contextlib
+import csv
+import email.parser
+import email.quoprimime
 import getpass
+import http.client
+import itertools
 import json
+import mailbox
+import math
 import os
-import pandas as pd
+import queue
+import random
 import re
 import secrets
 import smtplib
+import socket
+import ssl
+import string
 import sys
+import threading
+import time
+import types
+import urllib.error
+import urllib.parse
 import urllib.request
+from multiprocessing import shared_memory
 from email.mime.image import MIMEImage
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
+giphy_api_url = "http://api.giphy.com/v1/gifs/random"
+giphy_cache = None
+giphy_pool = None
+giphy_budget = None
+giphy_client = None
+santas_stopwatch = None
+
+# GIPHY renditions to pick from, best first, with the still images last
+GIPHY_RENDITIONS = ("fixed_height_downsampled", "fixed_width_downsampled",
+                    "fixed_height_small", "fixed_width_small",
+                    "fixed_height_still", "fixed_height_small_still",
+                    "fixed_width_small_still")
+
+# Email validation regular expression
+VET_CHECK = re.compile(r"(^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$)")
+
+# Lines that need escaping in mbox spools, i.e. "From " after any ">"s
+FROM_LINE = re.compile(r"^(>*From )", re.MULTILINE)
+
+# Enhanced status codes for email servers asking to slow down
+THROTTLE_REPLY = re.compile(rb"4\.(7\.[0-9]+|2\.1)\b")
+
+
+def read_sleighs(filename):
+    """Stream Secret Santa names, and email addresses from a CSV file
+
+    Read a CSV file, with a header row, where the first column has Secret Santa
+    names, and the second column has their email addresses, one row at a time,
+    so any number of Secret Santas can be read without holding the file in
+    memory. Blank rows, and any columns after the second are ignored.
+
+    Args:
+        filename (str): Path to the CSV file of Secret Santas.
+
+    Yields:
+        santa (str): Name of a Secret Santa, stripped of any whitespace.
+        reindeer (str): Email address of the Secret Santa, stripped of any
+            whitespace.
+    """
+    with open(filename, "r", encoding="utf8", newline="") as f:
+        chimneys = csv.reader(f, skipinitialspace=True)
+
+        # Skip the header row, whatever it's called
+        next(chimneys, None)
+
+        # Yield the first two columns of every row that isn't blank
+        for row in chimneys:
+            if not any(column.strip() for column in row):
+                continue
+            if len(row) < 2:
+                sys.exit("Santa's lost a reindeer! [Row " +
+                         str(chimneys.line_num) + " needs a name, and an " +
+                         "email address]")
+            yield row[0].strip(" "), row[1].strip(" ")
+
+
+class SantasRoster(collections.abc.Mapping):
+    """Compact roster of Secret Santas, and their email addresses
+
+    A drop-in replacement for the "sleighs" dictionary, with names as keys, and
+    email addresses as items, that stores everyone in a few flat arrays rather
+    than a Python string for every name, and email address. Names, and email
+    addresses are each kept as one block of UTF-8 bytes, with an array of where
+    each one ends, and names are found with an open-addressing hash table of
+    indices, so each Secret Santa takes tens of bytes, rather than hundreds.
+    Strings are only built when a name, or email address is asked for.
+
+    Names should be unique, which "inspect_sleighs" checks; only the first
+    Secret Santa with a name can be looked up by it.
+
+    Attributes:
+        santas (RosterColumn): Sequence of the Secret Santa names, in order,
+            like the "santas" list.
+        reindeers (RosterColumn): Sequence of the email addresses, in order,
+            like the "reindeers" list.
+    """
+
+    __slots__ = ("name_bytes", "name_ends", "email_bytes", "email_ends",
+                 "name_table", "santas", "reindeers")
+
+    def __init__(self, sleighs=()):
+        self.name_bytes = bytearray()
+        self.name_ends = array.array("Q")
+        self.email_bytes = bytearray()
+        self.email_ends = array.array("Q")
+        self.name_table = None
+        self.santas = RosterColumn(self, 0)
+        self.reindeers = RosterColumn(self, 1)
+        for santa, reindeer in sleighs:
+            self.append(santa, reindeer)
+
+    @classmethod
+    def from_csv(cls, filename):
+        """Stream a roster from a CSV file with "read_sleighs"
+
+        Args:
+            filename (str): Path to the CSV file of Secret Santas.
+
+        Yields:
+            santas_roster (SantasRoster): Roster of every Secret Santa in the
+                file, in order.
+        """
+        return cls(read_sleighs(filename))
+
+    def append(self, santa, reindeer):
+        """Add a Secret Santa, and their email address to the end"""
+        self.name_bytes += santa.encode("utf8")
+        self.name_ends.append(len(self.name_bytes))
+        self.email_bytes += reindeer.encode("utf8")
+        self.email_ends.append(len(self.email_bytes))
+        self.name_table = None
+
+    def name(self, i):
+        """Name of the "i"th Secret Santa"""
+        return self.name_bytes[self.name_ends[i - 1] if i else 0:
+                               self.name_ends[i]].decode("utf8")
+
+    def email(self, i):
+        """Email address of the "i"th Secret Santa"""
+        return self.email_bytes[self.email_ends[i - 1] if i else 0:
+                                self.email_ends[i]].decode("utf8")
+
+    def name_key(self, i):
+        """UTF-8 bytes of the "i"th Secret Santa's name"""
+        return bytes(self.name_bytes[self.name_ends[i - 1] if i else 0:
+                                     self.name_ends[i]])
+
+    def build_name_table(self):
+        """Build the hash table of indices that names are found with, at most
+        two-thirds full, probing the next slot along after a collision"""
+        mask = (1 << max(3, (3 * len(self) // 2).bit_length())) - 1
+        name_table = array.array("q", [-1]) * (mask + 1)
+        names = memoryview(self.name_bytes)
+        start = 0
+        for i, end in enumerate(self.name_ends):
+            name_key = bytes(names[start:end])
+            slot = hash(name_key) & mask
+            while name_table[slot] != -1:
+                if self.name_key(name_table[slot]) == name_key:
+                    break
+                slot = (slot + 1) & mask
+            else:
+                name_table[slot] = i
+            start = end
+        self.name_table = name_table
+
+    def index(self, santa):
+        """Find a Secret Santa's index by their name
+
+        Args:
+            santa (str): Name of the Secret Santa.
+
+        Yields:
+            Index of the first Secret Santa with the name.
+
+        Raises:
+            KeyError: If there's no Secret Santa with the name.
+        """
+        if self.name_table is None:
+            self.build_name_table()
+        name_table = self.name_table
+        mask = len(name_table) - 1
+        name_key = santa.encode("utf8")
+        slot = hash(name_key) & mask
+        while name_table[slot] != -1:
+            if self.name_key(name_table[slot]) == name_key:
+                return name_table[slot]
+            slot = (slot + 1) & mask
+        raise KeyError(santa)
+
+    def __getitem__(self, santa):
+        return self.email(self.index(santa))
+
+    def __iter__(self):
+        return iter(self.santas)
+
+    def __len__(self):
+        return len(self.name_ends)
+
+    def __contains__(self, santa):
+        try:
+            self.index(santa)
+        except KeyError:
+            return False
+        return True
+
+    def values(self):
+        """Email addresses, in the roster's order"""
+        return self.reindeers
+
+    def items(self):
+        """Names, and email addresses, in the roster's order, without looking
+        up each name"""
+        return zip(self.santas, self.reindeers)
+
+
+class RosterColumn(collections.abc.Sequence):
+    """Read-only sequence view of the names, or email addresses in a
+    "SantasRoster", so it can be used as the "santas", or "reindeers" list
+
+    Args:
+        santas_roster (SantasRoster): The roster to view.
+        column (int): 0 for names, or 1 for email addresses.
+    """
+
+    __slots__ = ("santas_roster", "column")
+
+    def __init__(self, santas_roster, column):
+        self.santas_roster = santas_roster
+        self.column = column
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("roster index out of range")
+        if self.column == 0:
+            return self.santas_roster.name(i)
+        return self.santas_roster.email(i)
+
+    def __iter__(self):
+        # Decode each entry in turn, without looking up the ends twice
+        column_bytes, ends = ((self.santas_roster.name_bytes,
+                               self.santas_roster.name_ends) if
+                              self.column == 0 else
+                              (self.santas_roster.email_bytes,
+                               self.santas_roster.email_ends))
+        start = 0
+        for end in ends:
+            yield column_bytes[start:end].decode("utf8")
+            start = end
+
+    def __len__(self):
+        return len(self.santas_roster)
+
+
+class SantasPairings(collections.abc.Mapping):
+    """Compact pairings of the Secret Santas in a "SantasRoster"
+
+    A drop-in replacement for the "santa_pairings" dictionary, with giver names
+    as keys, and receiver names as items, that stores each giver's receiver as
+    an index into the roster, in an array of integers.
+
+    Args:
+        santas_roster (SantasRoster): The roster of Secret Santas.
+        sleigh_cycle (array.array): Array where the item at index "i" is the
+            index of the Secret Santa receiving a gift from Secret Santa "i".
+    """
+
+    __slots__ = ("santas_roster", "sleigh_cycle")
+
+    def __init__(self, santas_roster, sleigh_cycle):
+        self.santas_roster = santas_roster
+        self.sleigh_cycle = sleigh_cycle
+
+    def __getitem__(self, giver):
+        return self.santas_roster.name(self.sleigh_cycle[
+            self.santas_roster.index(giver)])
+
+    def __iter__(self):
+        return iter(self.santas_roster.santas)
+
+    def __len__(self):
+        return len(self.sleigh_cycle)
+
+    def items(self):
+        """Giver, and receiver names, in the roster's order, without looking
+        up each giver by name"""
+        return zip(self.santas_roster.santas, (self.santas_roster.name(i) for
+                                               i in self.sleigh_cycle))
+
 
 def continue_checker(message, exit_message):
     """Check that the code should continue to the next step
@@ -71,7 +404,61 @@ def continue_checker(message, exit_message):
         sys.exit(exit_message)
 
 
-def find_sleighs(santas, reindeers, sleighs):
+def inspect_sleighs(santas, reindeers):
+    """Inspect all the Secret Santas, and reindeers in a single pass
+
+    Check for duplicate names, duplicate email addresses, names missing email
+    addresses, email addresses missing names, and invalid email addresses, all
+    at once, and report every problem found rather than stopping at the first.
+
+    Args:
+        santas (list): List of Secret Santa names.
+        reindeers (list): List of email addresses, in the same order as
+            "santas".
+
+    Yields:
+        sleighs_report (dict): Dictionary of problems found, with keys:
+            "santas" (int), the number of Secret Santas; "impostors" (list),
+            names given more than once; "twins" (list), email addresses given
+            more than once; "resting_santas" (int), the number of email
+            addresses without names; "resting_reindeers" (list), names without
+            email addresses; and "poorly_reindeers" (list), names with invalid
+            email addresses. Lists are in the order found.
+    """
+    # Initialise storage for names, and email addresses seen so far, and for
+    # any problems found
+    seen_santas, seen_reindeers = set(), set()
+    impostors, twins, poorly_reindeers = [], [], []
+    vet_check = VET_CHECK.match
+
+    # Check each name, and its email address together
+    for santa, reindeer in zip(santas, reindeers):
+        if santa in seen_santas:
+            impostors.append(santa)
+        seen_santas.add(santa)
+        if reindeer in seen_reindeers:
+            twins.append(reindeer)
+        seen_reindeers.add(reindeer)
+        if vet_check(reindeer) is None:
+            poorly_reindeers.append(santa)
+
+    # Any names past the end of the email addresses are missing email addresses
+    resting_reindeers = list(santas[len(reindeers):])
+    for santa in resting_reindeers:
+        if santa in seen_santas:
+            impostors.append(santa)
+        seen_santas.add(santa)
+
+    # Return a report of all the problems found
+    return {"santas": len(santas),
+            "impostors": impostors,
+            "twins": twins,
+            "resting_santas": max(len(reindeers) - len(santas), 0),
+            "resting_reindeers": resting_reindeers,
+            "poorly_reindeers": poorly_reindeers}
+
+
+def find_sleighs(santas, reindeers, sleighs, sleighs_report=None):
     """Check enough Secret Santas, and reindeers were supplied
 
     Check that the number of Secret Santas [names] matches the number of
@@ -83,6 +470,8 @@ def find_sleighs(santas, reindeers, sleighs):
         reindeers (list): List of email addresses.
         sleighs (dict): Dictionary with names as keys, and email addresses as
             items. If everything is correct, items should match "reindeers".
+        sleighs_report (dict): Report from "inspect_sleighs". If not given,
+            the Secret Santas are inspected first.
 
     Yields:
         If there are duplicate Secret Santas, throw an error message. Give a
@@ -93,47 +482,37 @@ def find_sleighs(santas, reindeers, sleighs):
         message. If there are less than two Secret Santas, throw an error
         message. Otherwise, print statements that everything is okay.
     """
+    # Inspect the Secret Santas, unless they already have been
+    if sleighs_report is None:
+        sleighs_report = inspect_sleighs(santas, reindeers)
+
     # Check for duplicate names, and throw an error if there any duplicates
-    if len(santas) != len(set(santas)):
+    if sleighs_report["impostors"]:
         sys.exit("There's an impostor! [All Secret Santas must be unique]")
 
     # Check for duplicate messages, and ask the user if they want to continue
-    if len(reindeers) != len(set(reindeers)):
+    if sleighs_report["twins"]:
         continue_checker("Some reindeers are twins! [Duplicate email " +
                          "addresses]", "Unexpectedly found twin reindeers! " +
                          "[Duplicate email addresses found]")
 
-    # Difference calculation to see if there are missing names
-    resting_santas = len(sleighs.keys()) - len(reindeers)
-
     # If there are missing names, or less than two names, throw an error message
-    if resting_santas < 0:
+    if sleighs_report["resting_santas"] > 0:
         sys.exit("Mrs Claus says some Secret Santas is resting by the " +
-                 "fireplace... [Missing " + str(abs(resting_santas)) +
-                 " santa(s)]")
+                 "fireplace... [Missing " +
+                 str(sleighs_report["resting_santas"]) + " santa(s)]")
     elif len(sleighs.keys()) < 2:
         sys.exit("Not enough Secret Santas for the delivery! [Minimum of two " +
                  "Secret Santas required]")
     else:
         print("All Secret Santas present!")
 
-    # Initialise a storage list to save names with missing email addresses
-    resting_reindeers = []
-
-    # Iterate through all names, and print any with missing email addresses
-    for santa in santas:
-        if santa not in sleighs:
-
-            # Add names with missing email addresses to the storage list
-            resting_reindeers.append(santa)
-
-            # Print the names missing email addresses
-            if re.search("[s]$", santa):
-                print("The elves say " + santa + "' reindeer is resting in " +
-                      "the barn... [Missing email address]")
-            else:
-                print("The elves say " + santa + "'s reindeer is resting in " +
-                      "the barn... [Missing email address]")
+    # Print the names missing email addresses
+    resting_reindeers = sleighs_report["resting_reindeers"]
+    for santa in resting_reindeers:
+        print("The elves say " + santa + ("'" if santa.endswith("s") else
+                                          "'s") +
+              " reindeer is resting in the barn... [Missing email address]")
 
     # If there are missing email address, throw an error message
     if len(resting_reindeers) != 0:
@@ -143,7 +522,7 @@ def find_sleighs(santas, reindeers, sleighs):
         print("All reindeers present!")
 
 
-def check_reindeers(sleighs):
+def check_reindeers(sleighs, sleighs_report=None):
     """Check that the reindeers are all healthy
 
     Check that each of the reindeer are healthy, i.e. check valid email
@@ -152,32 +531,24 @@ def check_reindeers(sleighs):
     Args:
         sleighs (dict): Dictionary with names as keys, and email addresses as
             items.
+        sleighs_report (dict): Report from "inspect_sleighs". If not given,
+            the Secret Santas are inspected first.
 
     Yields:
         If there are invalid email address, the corresponding name, then exit
         the system, and throw an error message. Otherwise, print a statement
         that everything is okay.
     """
-    # Email validation regular expression
-    vet_check = r"(^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$)"
-
-    # Initialise a storage list for names with invalid email addresses
-    poorly_reindeers = []
-
-    # Iterate throw all names, and validate their email addresses
-    for santa, reindeer in sleighs.items():
-        if re.search(vet_check, reindeer) is None:
-
-            # Add names with invalid email addresses to the storage list
-            poorly_reindeers.append(santa)
+    # Inspect the Secret Santas, unless they already have been
+    if sleighs_report is None:
+        sleighs_report = inspect_sleighs(list(sleighs.keys()),
+                                         list(sleighs.values()))
 
-            # Print a message for any names with invalid email addresses
-            if re.search("[s]$", santa):
-                print("The vet says " + santa + "' reindeer isn't feeling " +
-                      "well... [Invalid email address]")
-            else:
-                print("The vet says " + santa + "'s reindeer isn't feeling " +
-                      "well... [Invalid email address]")
+    # Print a message for any names with invalid email addresses
+    poorly_reindeers = sleighs_report["poorly_reindeers"]
+    for santa in poorly_reindeers:
+        print("The vet says " + santa + ("'" if santa.endswith("s") else "'s") +
+              " reindeer isn't feeling well... [Invalid email address]")
 
     # Throw an error message if there are any invalid email addresses
     if len(poorly_reindeers) != 0:
@@ -187,47 +558,808 @@ def check_reindeers(sleighs):
         print("All sleighs are ready to go!")
 
 
+class SantasStopwatch:
+    """Timings, and counts of each stage of sending letters
+
+    Each stage's timings are kept in a histogram, so the time spent on GIPHY,
+    writing letters, and the email server can be told apart. Counts are kept
+    for letters sent, and lost, bytes sent, retries, and GIFs fetched, or
+    taken from the cache. Only set as "santas_stopwatch" if asked for, so
+    nothing is measured otherwise.
+
+    Args:
+        buckets (tuple): Upper bounds of the histogram buckets, in seconds.
+
+    Attributes:
+        counters (collections.Counter): Count of each event by name.
+        gauges (dict): Latest value of each measurement by name, e.g. the
+            most letters waiting in a pipeline's queue.
+        histograms (dict): Dictionary with stage names as keys, and lists of
+            the number of timings in each bucket, the total seconds, and the
+            number of timings as items.
+    """
+
+    def __init__(self, buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                                0.5, 1, 2.5, 5, 10)):
+        self.buckets = buckets
+        self.counters = collections.Counter()
+        self.gauges = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def count(self, name, n=1):
+        """Add "n" to the count of the "name" event"""
+        with self.lock:
+            self.counters[name] += n
+
+    def gauge(self, name, value):
+        """Set the latest value of the "name" measurement"""
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        """Add a timing of "seconds" to the histogram of the "name" stage"""
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = [
+                    [0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][bisect.bisect_left(self.buckets, seconds)] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def report(self):
+        """Report the counts, and timings
+
+        Yields:
+            santas_report (dict): Dictionary with "counters", a dictionary of
+                counts, "gauges", a dictionary of measurements, and
+                "histograms", a dictionary with stage names as
+                keys, and dictionaries of the cumulative "buckets", keyed by
+                their upper bounds, the "sum" of the seconds, and the "count"
+                of timings as items.
+        """
+        with self.lock:
+            santas_report = {"counters": dict(self.counters),
+                             "gauges": dict(self.gauges), "histograms": {}}
+            for name, (counts, total, n) in self.histograms.items():
+                cumulative = 0
+                buckets = {}
+                for le, bucket_count in zip(
+                        [str(le) for le in self.buckets] + ["+Inf"], counts):
+                    cumulative += bucket_count
+                    buckets[le] = cumulative
+                santas_report["histograms"][name] = {"buckets": buckets,
+                                                     "sum": total, "count": n}
+        return santas_report
+
+    def write_json(self, filename):
+        """Write the report to a JSON file"""
+        with open(filename, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def write_prometheus(self, filename):
+        """Write the report to a file in Prometheus' text format, e.g. for the
+        node exporter's textfile collector"""
+        santas_report = self.report()
+        lines = []
+        for name, value in sorted(santas_report["counters"].items()):
+            lines.append("# TYPE secret_santa_" + name + "_total counter")
+            lines.append("secret_santa_" + name + "_total " + str(value))
+        for name, value in sorted(santas_report["gauges"].items()):
+            lines.append("# TYPE secret_santa_" + name + " gauge")
+            lines.append("secret_santa_" + name + " " + str(value))
+        for name, histogram in sorted(santas_report["histograms"].items()):
+            metric = "secret_santa_" + name + "_seconds"
+            lines.append("# TYPE " + metric + " histogram")
+            for le, value in histogram["buckets"].items():
+                lines.append(metric + "_bucket{le=\"" + le + "\"} " +
+                             str(value))
+            lines.append(metric + "_sum " + repr(histogram["sum"]))
+            lines.append(metric + "_count " + str(histogram["count"]))
+        with open(filename, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+class GiphyCache:
+    """Size-limited cache of GIFs downloaded from GIPHY, kept between runs
+
+    GIFs are saved in a folder, named by their GIPHY ID, and an index of the
+    cached GIFs, from least to most recently used, is saved alongside them. If
+    the cached GIFs add up to more than the byte budget, the least recently
+    used GIFs are deleted first. The index is only saved in batches, so call
+    "flush" once done; if the run crashes, GIFs added since the last save are
+    left out of the index.
+
+    The cache can also stand in for GIPHY: if "fallback" is True, and the GIPHY
+    API is slow, rate-limited, or unavailable, a random cached GIF is used
+    instead.
+
+    Args:
+        path (str): Folder to cache GIFs in.
+        budget (int): Maximum total size of the cached GIFs in bytes.
+        fallback (bool): If True, use cached GIFs when the GIPHY API fails.
+        timeout (float): Seconds to wait for the GIPHY API when "fallback" is
+            True.
+        save_every (int): Most GIFs to add before saving the index.
+        save_seconds (float): Most seconds to wait before saving the index
+            after adding a GIF.
+
+    Attributes:
+        index_filename (str): Path to the index of cached GIFs.
+        unsaved (int): Number of GIFs added since the index was last saved.
+    """
+
+    def __init__(self, path="./images", budget=50 * 2 ** 20, fallback=False,
+                 timeout=5.0, save_every=100, save_seconds=5.0):
+        self.path = path
+        self.budget = budget
+        self.fallback = fallback
+        self.timeout = timeout
+        self.save_every = save_every
+        self.save_seconds = save_seconds
+        self.index_filename = os.path.join(path, "giphy_cache.json")
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.unsaved = 0
+        self.saved = time.monotonic()
+
+        # Load the index from any previous runs, forgetting any GIFs that have
+        # since been deleted
+        self.gifs = collections.OrderedDict()
+        try:
+            with open(self.index_filename, "r") as f:
+                for giphy_id, giphy_link, size in json.load(f)["gifs"]:
+                    if os.path.exists(self.gif_filename(giphy_id)):
+                        self.gifs[giphy_id] = (giphy_link, size)
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+
+    def gif_filename(self, giphy_id):
+        """Get the filename of a cached GIF
+
+        Args:
+            giphy_id (str): GIPHY ID of the GIF.
+
+        Yields:
+            Path to where the GIF is cached.
+        """
+        return os.path.join(self.path, giphy_id + ".gif")
+
+    def get(self, giphy_id):
+        """Get a GIF from the cache, marking it as the most recently used
+
+        Args:
+            giphy_id (str): GIPHY ID of the GIF.
+
+        Yields:
+            The GIF in bytes, or None if it isn't cached.
+        """
+        with self.lock:
+            if giphy_id not in self.gifs:
+                return None
+            self.gifs.move_to_end(giphy_id)
+
+        # Read the GIF, unless another thread has just evicted it
+        try:
+            with open(self.gif_filename(giphy_id), "rb") as gif:
+                return gif.read()
+        except FileNotFoundError:
+            return None
+
+    def add(self, giphy_id, giphy_link, gif_filename):
+        """Add a downloaded GIF to the cache, and evict the least recently
+        used GIFs if the cache is over its budget. The index is only saved
+        once a batch of GIFs has been added
+
+        Args:
+            giphy_id (str): GIPHY ID of the GIF.
+            giphy_link (str): GIPHY URL of the GIF.
+            gif_filename (str): Path to the downloaded GIF. It's moved into
+                the cache folder if it isn't there already.
+        """
+        if os.path.abspath(gif_filename) != os.path.abspath(
+                self.gif_filename(giphy_id)):
+            os.replace(gif_filename, self.gif_filename(giphy_id))
+        with self.lock:
+            self.gifs[giphy_id] = (giphy_link, os.path.getsize(
+                self.gif_filename(giphy_id)))
+            self.gifs.move_to_end(giphy_id)
+
+            # Evict the least recently used GIFs until the cache fits
+            cache_size = sum(size for _, size in self.gifs.values())
+            while cache_size > self.budget and len(self.gifs) > 1:
+                old_id, (_, old_size) = self.gifs.popitem(last=False)
+                os.remove(self.gif_filename(old_id))
+                cache_size -= old_size
+
+            # Only save the index once a batch of GIFs has built up
+            self.unsaved += 1
+            save = (self.unsaved >= self.save_every or
+                    time.monotonic() - self.saved >= self.save_seconds)
+        if save:
+            self.save()
+
+    def keep(self, giphy_id, giphy_link, gif):
+        """Save a GIF downloaded into memory, and add it to the cache
+
+        Args:
+            giphy_id (str): GIPHY ID of the GIF.
+            giphy_link (str): GIPHY URL of the GIF.
+            gif (bytes): The GIF.
+        """
+        with open(self.gif_filename(giphy_id), "wb") as f:
+            f.write(gif)
+        self.add(giphy_id, giphy_link, self.gif_filename(giphy_id))
+
+    def random_gif(self):
+        """Get a random cached GIF, e.g. when the GIPHY API is unavailable
+
+        Yields:
+            The GIF's GIPHY ID, its GIPHY URL, and the GIF in bytes, or None if
+            the cache is empty.
+        """
+        with self.lock:
+            if len(self.gifs) == 0:
+                return None
+            giphy_id = secrets.choice(list(self.gifs.keys()))
+            giphy_link, _ = self.gifs[giphy_id]
+        gif = self.get(giphy_id)
+        return (giphy_id, giphy_link, gif) if gif is not None else None
+
+    def serves_fallback(self, error):
+        """Check whether a cached GIF should be used after a GIPHY API error
+
+        Args:
+            error (Exception): Error from the GIPHY API request.
+
+        Yields:
+            True if fallback is turned on, and the error means GIPHY is slow,
+            rate-limited, or unavailable, rather than e.g. a bad API token.
+        """
+        if isinstance(error, urllib.error.HTTPError):
+            return self.fallback and (error.code == 429 or error.code >= 500)
+        return self.fallback
+
+    def save(self):
+        """Save the index of cached GIFs, replacing the old one in one go"""
+        with self.save_lock:
+            with self.lock:
+                giphy_index = {"gifs": [
+                    [giphy_id, giphy_link, size] for giphy_id,
+                    (giphy_link, size) in self.gifs.items()]}
+                self.unsaved = 0
+                self.saved = time.monotonic()
+            with open(self.index_filename + ".tmp", "w") as f:
+                json.dump(giphy_index, f)
+            os.replace(self.index_filename + ".tmp", self.index_filename)
+
+    def flush(self):
+        """Save the index of cached GIFs, if any have been added since it was
+        last saved"""
+        if self.unsaved > 0:
+            self.save()
+
+
+class SantasPicture(MIMEImage):
+    """MIME image of a GIF that's only turned into text once
+
+    The GIF is base64 encoded once, when it's created, like any MIME image,
+    and the first "as_string" call keeps the text of the whole part, so every
+    letter sharing the picture, e.g. from "giphy_pool", gets the same string,
+    rather than it being generated again for each letter. Add any headers
+    before the first "as_string" call.
+
+    Args:
+        gif (bytes): The GIF.
+    """
+
+    def __init__(self, gif):
+        super().__init__(gif)
+        self.picture_string = None
+
+    def as_string(self, *args, **kwargs):
+        """Return the whole part as text, only generating it the first time it's
+        asked for with the default arguments"""
+        if args or kwargs:
+            return super().as_string(*args, **kwargs)
+        if self.picture_string is None:
+            self.picture_string = super().as_string()
+        return self.picture_string
+
+
+class GiphyPool:
+    """Pool of GIFs fetched from GIPHY once, and shared between letters
+
+    Rather than a round trip to GIPHY for every letter, "size" different GIFs
+    are fetched up front, several at once, and each letter is given one of
+    them, so only "size" GIFs are fetched however many letters there are.
+    Each GIF's MIME image is built once, and reused.
+
+    Args:
+        size (int): Number of different GIFs to fetch.
+        order (str): How GIFs are given to letters: "random", or
+            "round-robin", which uses every GIF equally.
+        fetchers (int): Most GIFs to fetch at once.
+
+    Attributes:
+        gifs (list): MIME images, GIPHY URLs, and GIPHY IDs of the pooled
+            GIFs, as given by "mime_giphy".
+    """
+
+    def __init__(self, size, order="random", fetchers=8):
+        self.size = size
+        self.order = order
+        self.fetchers = fetchers
+        self.gifs = []
+        self.turns = itertools.count()
+
+    def fill(self):
+        """Fetch the pool's GIFs, skipping any repeats, and any that fail,
+        and trying up to twice as many times as the pool's size
+
+        Yields:
+            Number of GIFs in the pool.
+        """
+        gifs = {}
+        attempts = 0
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.fetchers) as pool:
+            while len(gifs) < self.size and attempts < 2 * self.size:
+                fetches = [pool.submit(mime_giphy) for _ in
+                           range(min(self.size - len(gifs),
+                                     2 * self.size - attempts))]
+                attempts += len(fetches)
+                for fetch in fetches:
+                    try:
+                        giphy = fetch.result()
+                    except Exception as e:
+                        print("Santa couldn't fetch a GIF for the pool... [" +
+                              repr(e) + "]")
+                        continue
+                    gifs.setdefault(giphy[2], giphy)
+
+        # Only share the GIFs once they've all been fetched, so the fetches
+        # above aren't answered from the pool
+        self.gifs = list(gifs.values())[:self.size]
+        return len(self.gifs)
+
+    def pick(self):
+        """Pick a GIF from the pool for the next letter
+
+        Yields:
+            A MIME image of the GIF, its GIPHY URL, and its GIPHY ID.
+        """
+        if self.order == "round-robin":
+            return self.gifs[next(self.turns) % len(self.gifs)]
+        return random.choice(self.gifs)
+
+
+def giphy_renditions(giphy_data):
+    """List the renditions of a GIF in a GIPHY API response
+
+    Both the "images" object of the current API, which has each rendition's
+    size, and the flat "<rendition>_url" fields of the random GIF endpoint are
+    understood.
+
+    Args:
+        giphy_data (dict): Decoded JSON from the GIPHY API.
+
+    Yields:
+        renditions (list): List of tuples of the name, URL, and size in bytes,
+            or None if not known, of each rendition in "GIPHY_RENDITIONS" that
+            the GIF has, best first.
+    """
+    giphy_images = giphy_data["data"].get("images") or {}
+    renditions = []
+    for rendition in GIPHY_RENDITIONS:
+        giphy_image = giphy_images.get(rendition) or {}
+        giphy_link = (giphy_image.get("url") or
+                      giphy_data["data"].get(rendition + "_url"))
+        if giphy_link:
+            size = giphy_image.get("size")
+            renditions.append((rendition, giphy_link,
+                               int(size) if size else None))
+    return renditions
+
+
+class GiphyBudget:
+    """Byte budget for the GIF in each letter, and a tally of the bytes saved
+
+    Rather than always embedding the "fixed_height_downsampled" rendition,
+    whatever its size, the first rendition in "GIPHY_RENDITIONS" that fits in
+    the budget is embedded, falling back to still images. Renditions GIPHY
+    says are too big are never downloaded. Alternatively, GIFs can be linked to
+    from the HTML, rather than embedded, so letters carry no GIF at all.
+
+    Args:
+        budget (int): Most bytes the GIF may add to each letter, once encoded,
+            or None for no limit.
+        link_only (bool): If True, don't embed GIFs, but link to the
+            "fixed_height_downsampled" rendition from the HTML instead.
+
+    Attributes:
+        gifs (int): Number of GIFs the savings are known for.
+        bytes_saved (int): Bytes taken off letters by the budget, or by
+            linking, compared with embedding "fixed_height_downsampled".
+    """
+
+    def __init__(self, budget=None, link_only=False):
+        self.budget = budget
+        self.link_only = link_only
+        self.gifs = 0
+        self.bytes_saved = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def letter_bytes(size):
+        """Bytes a GIF adds to a letter, once base64 encoded in lines of 76
+        characters
+
+        Args:
+            size (int): Size of the GIF in bytes.
+
+        Yields:
+            Size of the encoded GIF in bytes.
+        """
+        encoded = 4 * math.ceil(size / 3)
+        return encoded + math.ceil(encoded / 76)
+
+    def fits(self, size):
+        """Check a GIF fits in the budget
+
+        Args:
+            size (int): Size of the GIF in bytes.
+
+        Yields:
+            True if the GIF fits, otherwise False.
+        """
+        return self.budget is None or self.letter_bytes(size) <= self.budget
+
+    def shortlist(self, renditions):
+        """Pick the renditions worth downloading, best first
+
+        Args:
+            renditions (list): Renditions, as given by "giphy_renditions".
+
+        Yields:
+            renditions (list): Renditions that fit in the budget, or whose
+                size isn't known, or the smallest rendition if none of them
+                fit.
+        """
+        shortlist = [giphy_rendition for giphy_rendition in renditions if
+                     giphy_rendition[2] is None or
+                     self.fits(giphy_rendition[2])]
+        return shortlist or [min(renditions, key=lambda giphy_rendition:
+                                 giphy_rendition[2])]
+
+    def record(self, full_size, size):
+        """Add a GIF's savings to the tally
+
+        Args:
+            full_size (int): Size of the "fixed_height_downsampled" rendition,
+                or None if it's not known, in which case nothing is added.
+            size (int): Size of the GIF in the letter, or 0 if it's linked to.
+        """
+        if full_size is None:
+            return
+        bytes_saved = (self.letter_bytes(full_size) -
+                       (self.letter_bytes(size) if size else 0))
+        with self.lock:
+            self.gifs += 1
+            self.bytes_saved += bytes_saved
+        if santas_stopwatch is not None:
+            santas_stopwatch.count("gif_bytes_saved", bytes_saved)
+
+    def report(self):
+        """Print the average bytes saved per GIF
+
+        Yields:
+            Average bytes saved per GIF, or None if no savings are known.
+        """
+        if not self.gifs:
+            return None
+        average = self.bytes_saved / self.gifs
+        print("Santa's letters were {:,.1f} KB lighter on average ".format(
+            average / 1024) + "[{:,} GIFs, {:,.1f} KB saved]".format(
+            self.gifs, self.bytes_saved / 1024))
+        return average
+
+
+class GiphyClient:
+    """Keep-alive HTTP client for the GIPHY API, and its GIF hosts
+
+    Rather than opening a new connection, with a new TLS handshake, for every
+    request, connections to each host are kept open, and reused by later
+    requests, from any thread. Connections the host has since closed are
+    replaced straight away, and dropped connections, timeouts, and GIPHY being
+    rate-limited, or unavailable are tried again, waiting longer each time.
+
+    Args:
+        timeout (float): Seconds to wait for each connection, and response.
+        retries (int): Most times to try a request again after a temporary
+            failure.
+        backoff (float): Seconds to wait before the first retry, on average.
+        connections (int): Most idle connections to keep open per host.
+
+    Attributes:
+        opened (int): Number of connections opened.
+    """
+
+    def __init__(self, timeout=30, retries=2, backoff=0.1, connections=8):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.connections = connections
+        self.opened = 0
+        self.idle = collections.defaultdict(list)
+        self.lock = threading.Lock()
+
+    def checkout(self, host, timeout):
+        """Take an idle connection to a host, or open a new one
+
+        Args:
+            host (tuple): Scheme, host name, and port.
+            timeout (float): Seconds to wait for the connection, and response.
+
+        Yields:
+            santas_connection (http.client.HTTPConnection): Connection to the
+                host.
+            reused (bool): True if the connection was kept alive from an
+                earlier request.
+        """
+        with self.lock:
+            if self.idle[host]:
+                santas_connection = self.idle[host].pop()
+                santas_connection.timeout = timeout
+                return santas_connection, True
+            self.opened += 1
+        if santas_stopwatch is not None:
+            santas_stopwatch.count("giphy_connections")
+        scheme, hostname, port = host
+        if scheme == "https":
+            return http.client.HTTPSConnection(
+                hostname, port, timeout=timeout,
+                context=ssl.create_default_context()), False
+        return http.client.HTTPConnection(hostname, port,
+                                          timeout=timeout), False
+
+    def checkin(self, host, santas_connection):
+        """Keep a connection open for the next request to its host, unless
+        enough are already kept
+
+        Args:
+            host (tuple): Scheme, host name, and port.
+            santas_connection (http.client.HTTPConnection): Connection to keep.
+        """
+        with self.lock:
+            if len(self.idle[host]) < self.connections:
+                self.idle[host].append(santas_connection)
+                return
+        santas_connection.close()
+
+    def get(self, url, timeout=None, retries=None, redirects=3):
+        """Download a URL over a kept-alive connection
+
+        Args:
+            url (str): HTTP or HTTPS URL to download.
+            timeout (float): Seconds to wait, if not the client's timeout.
+            retries (int): Most times to try again, if not the client's
+                retries.
+            redirects (int): Most redirects to follow.
+
+        Yields:
+            Body of the response in bytes. Like "urllib.request.urlopen",
+            throws a HTTPError if the response is an error, and a URLError if
+            the host can't be reached.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+        attempt = 0
+        while True:
+            url_parts = urllib.parse.urlsplit(url)
+            host = (url_parts.scheme, url_parts.hostname, url_parts.port or
+                    (443 if url_parts.scheme == "https" else 80))
+            target = (url_parts.path or "/") + ("?" + url_parts.query if
+                                                url_parts.query else "")
+            santas_connection, reused = self.checkout(host, timeout)
+
+            # Send the request, and read the whole response, so the
+            # connection is ready for the next request
+            try:
+                if santas_connection.sock is not None:
+                    santas_connection.sock.settimeout(timeout)
+                santas_connection.request("GET", target, headers={
+                    "User-Agent": "secret-santa-mailer"})
+                giphy_response = santas_connection.getresponse()
+                body = giphy_response.read()
+            except (OSError, http.client.HTTPException) as e:
+                santas_connection.close()
+
+                # The host may have closed a kept-alive connection since it
+                # was last used, so try again on another connection straight
+                # away
+                if reused and not isinstance(e, TimeoutError):
+                    continue
+                if not isinstance(e, TimeoutError):
+                    e = urllib.error.URLError(e)
+                delay = retry_delay(e, attempt, retries, self.backoff)
+                if delay is None:
+                    raise e
+                attempt += 1
+                time.sleep(delay)
+                continue
+
+            # Keep the connection, unless the host is closing it
+            if giphy_response.will_close:
+                santas_connection.close()
+            else:
+                self.checkin(host, santas_connection)
+
+            # Follow any redirects, try again if GIPHY is rate-limited, or
+            # unavailable, and throw an error for any other error responses
+            status = giphy_response.status
+            if status in (301, 302, 303, 307, 308) and redirects > 0:
+                url = urllib.parse.urljoin(url, giphy_response.getheader(
+                    "Location"))
+                redirects -= 1
+                continue
+            if status >= 400:
+                error = urllib.error.HTTPError(url, status,
+                                               giphy_response.reason,
+                                               giphy_response.headers, None)
+                delay = retry_delay(error, attempt, retries, self.backoff)
+                if delay is None:
+                    raise error
+                attempt += 1
+                time.sleep(delay)
+                continue
+
+            # Return the body of the response
+            return body
+
+    def close(self):
+        """Close every idle connection"""
+        with self.lock:
+            santas_connections = [santas_connection for host in self.idle for
+                                  santas_connection in self.idle[host]]
+            self.idle.clear()
+        for santas_connection in santas_connections:
+            santas_connection.close()
+
+
+def fetch_url(url, timeout=None, retries=None):
+    """Download a URL, over a kept-alive connection if there's a
+    "giphy_client"
+
+    Args:
+        url (str): HTTP or HTTPS URL to download.
+        timeout (float): Seconds to wait, or None to wait for as long as the
+            client, or "urllib.request.urlopen" does.
+        retries (int): Most times to try again, if not the client's retries.
+            Without a client, nothing is tried again.
+
+    Yields:
+        Body of the response in bytes. If the response is an error, throws a
+        HTTPError.
+    """
+    if giphy_client is not None:
+        return giphy_client.get(url, timeout, retries)
+    with urllib.request.urlopen(url, **({} if timeout is None else {
+            "timeout": timeout})) as giphy_response:
+        return giphy_response.read()
+
+
 def mime_giphy():
     """Generate a MIME image from a random festive GIF from GIPHY
 
-    Randomly download a festive GIF from GIPHY, create a corresponding MIME
-    image with a unique content ID, and then delete the downloaded GIF.
+    Randomly download a festive GIF from GIPHY straight into memory, and
+    create a corresponding MIME image with a unique content ID.
+
+    If "giphy_cache" is set, GIFs already in the cache aren't downloaded
+    again, and downloaded GIFs are saved in the cache. If the cache has
+    fallback turned on, a cached GIF is used when the GIPHY API is slow,
+    rate-limited, or unavailable.
+
+    If "giphy_pool" is set, and has been filled, a GIF from the pool is used
+    instead.
+
+    If "giphy_budget" is set, the first rendition that fits in its budget is
+    used, rather than "fixed_height_downsampled", or with link only turned on,
+    the GIF isn't downloaded at all, and no MIME image is made.
 
     GIF is rated PG or below only, and GIPHY API use requires a token.
 
     Yields:
-        Filename of the downloaded GIF that is stored in the working directory,
-        and its GIPHY URL.
+        A MIME image of the GIF, or None if it's only linked to, its GIPHY URL,
+        and its GIPHY ID.
     """
-    # Invoke the GIPHY API to get JSON for a random festive GIF
-    giphy_url = ("http://api.giphy.com/v1/gifs/random?api_key=" +
-                 giphy_api_token + "&tag=Merry+Christmas&rating=PG-13")
+    # Share a GIF from the pool, if there is one
+    if giphy_pool is not None and giphy_pool.gifs:
+        if santas_stopwatch is not None:
+            santas_stopwatch.count("gifs_pooled")
+        return giphy_pool.pick()
 
-    # Open the URL, and decode the JSON return
-    with urllib.request.urlopen(giphy_url) as giphy_request:
-        giphy_data = json.loads(giphy_request.read())
+    # Invoke the GIPHY API to get JSON for a random festive GIF
+    giphy_url = (giphy_api_url + "?api_key=" + giphy_api_token +
+                 "&tag=Merry+Christmas&rating=PG-13")
+    fetched = time.perf_counter()
 
-    # Get the GIPHY URL
-    giphy_link = giphy_data["data"]["fixed_height_downsampled_url"]
+    # Open the URL, and decode the JSON return. If the cache has fallback
+    # turned on, don't wait too long, or try again, and use a cached GIF if
+    # GIPHY fails
+    fallback = bool(giphy_cache and giphy_cache.fallback)
+    try:
+        giphy_data = json.loads(fetch_url(
+            giphy_url, giphy_cache.timeout if fallback else None,
+            0 if fallback else None))
+    except (urllib.error.URLError, TimeoutError) as e:
+        cached_gif = giphy_cache.random_gif() if (
+            giphy_cache and giphy_cache.serves_fallback(e)) else None
+        if cached_gif is None:
+            raise
+        giphy_id, giphy_link, gif = cached_gif
+        if santas_stopwatch is not None:
+            santas_stopwatch.count("gifs_fallback")
+        if giphy_budget is not None and giphy_budget.link_only:
+            return None, giphy_link, giphy_id
+        santas_picture = SantasPicture(gif)
+        santas_picture.add_header("Content-ID", ("<" + giphy_id + ">"))
+        return santas_picture, giphy_link, giphy_id
 
-    # Get the GIPHY ID for the GIF
+    # Get the GIPHY ID for the GIF, and its renditions, best first
     giphy_id = giphy_data["data"]["id"]
+    renditions = giphy_renditions(giphy_data)
+    full_size = (renditions[0][2] if renditions[0][0] == GIPHY_RENDITIONS[0]
+                 else None)
 
-    # Download the GIF to the local directory
-    giphy_filename, _ = urllib.request.urlretrieve(giphy_link, "./images/" +
-                                                   giphy_id + ".gif")
+    # Only link to the GIF, without downloading it, if asked
+    if giphy_budget is not None and giphy_budget.link_only:
+        giphy_budget.record(full_size, 0)
+        if santas_stopwatch is not None:
+            santas_stopwatch.count("gifs_linked")
+            santas_stopwatch.observe("giphy", time.perf_counter() - fetched)
+        return None, renditions[0][1], giphy_id
 
-    # Open the GIF, and create a MIME image
-    with open(giphy_filename, "rb") as gif:
-        santas_picture = MIMEImage(gif.read())
+    # Try each rendition that might fit in the budget, if there is one,
+    # otherwise only the best rendition
+    if giphy_budget is not None:
+        renditions = giphy_budget.shortlist(renditions)
+    else:
+        renditions = renditions[:1]
+    for rendition, giphy_link, _ in renditions:
 
-    # Add a Content ID to santas_picture
-    santas_picture.add_header("Content-ID", ("<" + giphy_id + ">"))
+        # Use the cached GIF if there is one, otherwise download the GIF
+        # straight into memory
+        giphy_key = (giphy_id if rendition == GIPHY_RENDITIONS[0] else
+                     giphy_id + "_" + rendition)
+        gif = giphy_cache.get(giphy_key) if giphy_cache else None
+        if gif is None:
+            gif = fetch_url(giphy_link)
+
+            # Only save the GIF if it's being added to the cache
+            if giphy_cache:
+                giphy_cache.keep(giphy_key, giphy_link, gif)
+            if santas_stopwatch is not None:
+                santas_stopwatch.count("gifs_downloaded")
+        elif santas_stopwatch is not None:
+            santas_stopwatch.count("gifs_cached")
+
+        # Stop at the first rendition that fits
+        if rendition == GIPHY_RENDITIONS[0] and full_size is None:
+            full_size = len(gif)
+        if giphy_budget is None or giphy_budget.fits(len(gif)):
+            break
+    if giphy_budget is not None:
+        giphy_budget.record(full_size, len(gif))
+    if santas_stopwatch is not None:
+        santas_stopwatch.observe("giphy", time.perf_counter() - fetched)
 
-    # Delete the downloaded GIF - prevent storage of lots of GIFs at the end
-    os.remove(giphy_filename) if not keep_gifs else None
+    # Create a MIME image, and add a Content ID to santas_picture
+    santas_picture = SantasPicture(gif)
+    santas_picture.add_header("Content-ID", ("<" + giphy_id + ">"))
 
-    # Return both the downloaded filename, and the GIPHY URL
+    # Return the MIME image, the GIPHY URL, and the GIPHY ID
     return santas_picture, giphy_link, giphy_id
 
 
@@ -284,130 +1416,3309 @@ def secret_santa_randomiser(sleighs):
     return santa_pairings
 
 
-def import_template(ext, path=".", enc=None):
-    """Import the first files with a specific file extension in a given folder
+def random_sleigh_cycle(n, compact=False):
+    """Randomly arrange Secret Santa indices into a single gift-giving cycle
 
-    Find all the files in a folder with a specific file extension, e.g. ".txt",
-    in a specific folder, return the first file found, and load it into the
-    script.
+    Use Sattolo's algorithm to shuffle an index array of "n" Secret Santas into
+    one random cycle, so that nobody is ever their own receiver. Random numbers
+    are drawn in bulk from the operating system's secure random source, so the
+    shuffle is a single pass in O(n) time and memory.
 
     Args:
-        ext (str): Extension of the filename required, e.g. ".txt" or ".html".
-        path (str): Path to the folder where the file(s) are located, e.g.
-            "./templates".
-        enc (str): Encoding format used in the Python "open" built-in function.
+        n (int): Number of Secret Santas.
+        compact (bool): If True, return an array of 4-byte integers, rather
+            than a list of Python integers, e.g. for "SantasPairings".
 
     Yields:
-        template_body (str): Imported file as desired.
+        sleigh_cycle (list): List where the item at index "i" is the index of
+            the Secret Santa receiving a gift from Secret Santa "i".
     """
-    # Get the first file with extension "ext" in the "path"
-    template_filename = [template for template in os.listdir(path) if
-                         template.endswith(ext)][0]
+    # Initialise the index array to shuffle
+    if compact:
+        sleigh_cycle = array.array("I" if n < 2 ** 32 else "Q", range(n))
+    else:
+        sleigh_cycle = list(range(n))
 
-    # Import the template
-    with open(path + "/" + template_filename, "r", encoding=enc) as f:
-        template_body = f.read()
+    # Draw 64 random bits per swap in one go from the secure random source
+    santas_dice = memoryview(os.urandom(8 * max(n - 1, 0))).cast("Q")
 
-    # Return the imported file
-    return template_body
+    # Swap each position with a random position strictly before it - never
+    # itself - which always leaves one single cycle through everyone. The
+    # random bits are scaled into [0, i) with a multiply-shift
+    for i in range(n - 1, 0, -1):
+        j = (santas_dice[i - 1] * i) >> 64
+        sleigh_cycle[i], sleigh_cycle[j] = sleigh_cycle[j], sleigh_cycle[i]
 
+    # Return the index array of receivers
+    return sleigh_cycle
 
-def call_postman(santas_mailbox, sleighs, santa_pairings):
-    """Call the postman, and post Santa's instructions to all Secret Santas
 
-    Generate an email message based on the plain text, and HTML templates.
-    Populate this message with the randomly-assigned receiver's name, the
-    random, festive GIF and its link.
+def secret_santa_derangement(sleighs):
+    """Randomly assign givers and receivers in linear time
 
-    Then email this to the randomly selected Secret Santa using a Gmail account.
-    Requires Gmail account, and password. Account must be set to allow less
-    secure apps, or, if using two-step verification, an app password must be
-    used instead.
+    Drop-in replacement for "secret_santa_randomiser", returning the same
+    dictionary of pairings. Secret Santas are placed into a single random
+    gift-giving cycle by "random_sleigh_cycle", so nobody is their own receiver,
+    and nobody can be left on their own at the end of the draw.
 
     Args:
-        santas_mailbox (str): A valid email address corresponding to the Gmail
-            account.
         sleighs (dict): Dictionary with names as keys, and email addresses as
             items.
-        santa_pairings (dict): Dictionary with giver names as keys, and email
-            addresses as items.
+
+    Yields:
+        santa_pairings (dict): Dictionary with giver names as keys, and
+            receiver names as items, or "SantasPairings" if "sleighs" is a
+            "SantasRoster".
+    """
+    # Keep a compact roster's pairings compact, as indices into the roster
+    if isinstance(sleighs, SantasRoster):
+        return SantasPairings(sleighs, random_sleigh_cycle(len(sleighs),
+                                                           compact=True))
+
+    # Get the Secret Santa names, and randomly arrange them into a cycle
+    santas = list(sleighs.keys())
+    sleigh_cycle = random_sleigh_cycle(len(santas))
+
+    # Generate a dictionary of givers as keys, and receivers as items
+    santa_pairings = dict(zip(santas, [santas[i] for i in sleigh_cycle]))
+
+    # Return a dictionary of givers as keys, and receivers as items
+    return santa_pairings
+
+
+def batch_sleigh_cycles(n, k=1):
+    """Randomly arrange many rosters into gift-giving cycles at once
+
+    Vectorised version of "random_sleigh_cycle" for running thousands of draws,
+    e.g. for many independent groups, or for fairness audits. Each draw shuffles
+    the Secret Santas into a random order, and each Secret Santa gives a gift to
+    the next one along, which is a uniformly random single cycle. All "k"
+    shuffles are done together using NumPy, with a generator seeded from the
+    operating system's secure random source.
+
+    Args:
+        n (int or list): Number of Secret Santas, or a list of numbers of Secret
+            Santas to draw for several roster sizes.
+        k (int): Number of draws per roster size.
+
+    Yields:
+        sleigh_cycles (numpy.ndarray or list): Array with "k" rows and "n"
+            columns, where the item at column "i" of each row is the index of
+            the Secret Santa receiving a gift from Secret Santa "i". If "n" is a
+            list, a list of arrays, one per roster size, is returned instead.
+    """
+    # Only import NumPy when it's needed, as it's slow to import
+    import numpy as np
+
+    # Draw for each roster size separately if several sizes are given
+    if not isinstance(n, (int, np.integer)):
+        return [batch_sleigh_cycles(size, k) for size in n]
+
+    # Seed a NumPy generator from the secure random source
+    santas_dice = np.random.default_rng(secrets.randbits(128))
+
+    # Shuffle each row into a random order of Secret Santas
+    sleigh_orders = santas_dice.permuted(np.tile(np.arange(n), (k, 1)), axis=1)
+
+    # Each Secret Santa in the order gives to the next one along, and the last
+    # Secret Santa gives to the first one
+    sleigh_cycles = np.empty_like(sleigh_orders)
+    sleigh_cycles[np.arange(k)[:, np.newaxis], sleigh_orders] = np.roll(
+        sleigh_orders, -1, axis=1)
+
+    # Return the array of receivers for every draw
+    return sleigh_cycles
+
+
+def sleigh_cycle_pairings(sleighs, sleigh_cycles):
+    """Map index-based draws back to dictionaries of Secret Santa names
+
+    Args:
+        sleighs (dict): Dictionary with names as keys, and email addresses as
+            items, in the same order as the indices used in "sleigh_cycles".
+        sleigh_cycles (list or numpy.ndarray): A single draw, as given by
+            "random_sleigh_cycle", or a two-dimensional array of draws, as
+            given by "batch_sleigh_cycles".
+
+    Yields:
+        santa_pairings (dict or list): Dictionary with giver names as keys, and
+            receiver names as items, or a list of these dictionaries, one per
+            row, if several draws were given.
+    """
+    # Only import NumPy when it's needed, as it's slow to import
+    import numpy as np
+
+    # Map each row separately if several draws are given
+    if np.ndim(sleigh_cycles) == 2:
+        return [sleigh_cycle_pairings(sleighs, row) for row in sleigh_cycles]
+
+    # Generate a dictionary of givers as keys, and receivers as items
+    santas = list(sleighs.keys())
+    santa_pairings = dict(zip(santas, [santas[i] for i in sleigh_cycles]))
+
+    # Return a dictionary of givers as keys, and receivers as items
+    return santa_pairings
+
+
+def attach_sleigh_array(name, n):
+    """Attach to an index array of "n" Secret Santas in shared memory
+
+    Args:
+        name (str): Name of the shared memory block.
+        n (int): Number of Secret Santas.
+
+    Yields:
+        santas_memory (shared_memory.SharedMemory): Shared memory block. Close
+            it once the array is finished with.
+        sleigh_array (numpy.ndarray): Array of indices in the block.
+    """
+    import numpy as np
+    santas_memory = shared_memory.SharedMemory(name=name)
+    sleigh_array = np.ndarray((n,), dtype=np.uint32 if n < 2 ** 32 else
+                              np.uint64, buffer=santas_memory.buf)
+    return santas_memory, sleigh_array
+
+
+def deal_shards(n, start, stop, shards, seed):
+    """Deal a block of Secret Santas out to random shards
+
+    Args:
+        n (int): Number of Secret Santas.
+        start (int): Index of the first Secret Santa in the block.
+        stop (int): Index after the last Secret Santa in the block.
+        shards (int): Number of shards.
+        seed (int): Seed for the block, so the same deal can be made again.
+
+    Yields:
+        santas_shards (numpy.ndarray): Shard of each Secret Santa in the
+            block.
+    """
+    import numpy as np
+    santas_dice = np.random.default_rng(seed)
+    return santas_dice.integers(0, shards, stop - start, dtype=np.uint16)
+
+
+def count_shard(n, start, stop, shards, seed):
+    """Count the Secret Santas in a block dealt out to each shard
+
+    Args:
+        As "deal_shards".
+
+    Yields:
+        counts (list): Number of Secret Santas in the block dealt to each
+            shard.
+    """
+    import numpy as np
+    return np.bincount(deal_shards(n, start, stop, shards, seed),
+                       minlength=shards).tolist()
+
+
+def scatter_shard(order_name, n, start, stop, shards, seed, offsets):
+    """Copy a block of Secret Santas to their shards in the shared order
+
+    Args:
+        order_name (str): Name of the shared memory block of the order.
+        n, start, stop, shards, seed: As "deal_shards".
+        offsets (list): Position in the order to copy the block's Secret
+            Santas in each shard to.
+    """
+    import numpy as np
+
+    # Deal the block out again, and sort its Secret Santas by shard, keeping
+    # them in order within each shard
+    santas_shards = deal_shards(n, start, stop, shards, seed)
+    sorted_santas = np.argsort(santas_shards, kind="stable") + start
+    ends = np.cumsum(np.bincount(santas_shards, minlength=shards))
+
+    # Copy each shard's Secret Santas to their place in the order
+    santas_memory, sleigh_order = attach_sleigh_array(order_name, n)
+    for shard, offset in enumerate(offsets):
+        begin = ends[shard - 1] if shard else 0
+        sleigh_order[offset:offset + ends[shard] - begin] = \
+            sorted_santas[begin:ends[shard]]
+    del sleigh_order
+    santas_memory.close()
+
+
+def shuffle_shard(order_name, n, start, stop, seed):
+    """Shuffle one shard of the shared order in place
+
+    Args:
+        order_name (str): Name of the shared memory block of the order.
+        n (int): Number of Secret Santas.
+        start (int): Position of the shard's first Secret Santa in the order.
+        stop (int): Position after the shard's last Secret Santa.
+        seed (int): Seed for the shuffle.
+    """
+    import numpy as np
+    santas_memory, sleigh_order = attach_sleigh_array(order_name, n)
+    np.random.default_rng(seed).shuffle(sleigh_order[start:stop])
+    del sleigh_order
+    santas_memory.close()
+
+
+def stitch_shard(order_name, cycle_name, n, start, stop):
+    """Pair each Secret Santa in one shard of the order with the next one
+
+    The last Secret Santa in the shard gives to the first Secret Santa in the
+    next shard, so the shards are stitched together into one single cycle.
+
+    Args:
+        order_name (str): Name of the shared memory block of the order.
+        cycle_name (str): Name of the shared memory block of receivers.
+        n, start, stop: As "shuffle_shard".
+    """
+    order_memory, sleigh_order = attach_sleigh_array(order_name, n)
+    cycle_memory, sleigh_cycle = attach_sleigh_array(cycle_name, n)
+    if stop > start:
+        sleigh_cycle[sleigh_order[start:stop - 1]] = \
+            sleigh_order[start + 1:stop]
+        sleigh_cycle[sleigh_order[stop - 1]] = sleigh_order[stop % n]
+    del sleigh_order, sleigh_cycle
+    order_memory.close()
+    cycle_memory.close()
+
+
+def sharded_sleigh_cycle(n, shards=None, workers=None):
+    """Randomly arrange Secret Santa indices into a single gift-giving cycle,
+    over several processes
+
+    Sharded version of "random_sleigh_cycle" for very large rosters. The
+    order of Secret Santas, and the receivers are index arrays in shared
+    memory, so only names of memory blocks, and a few numbers are sent to
+    each process, and never the roster itself. The draw works in four steps,
+    each split between the processes:
+
+    1. Each block of Secret Santas is dealt out to random shards, and counted;
+    2. Each block copies its Secret Santas to their shard's place in the order;
+    3. Each shard is shuffled; and
+    4. Each Secret Santa in the order gives to the next one, with the last one
+       in each shard giving to the first one in the next shard.
+
+    Dealing each Secret Santa to a random shard, and then shuffling each shard
+    gives a uniformly random order, so the single cycle is uniformly random,
+    just like "random_sleigh_cycle", and pairings between shards happen as
+    often as within them.
+
+    Args:
+        n (int): Number of Secret Santas.
+        shards (int): Number of shards, at most 65,535. Defaults to the number
+            of processes.
+        workers (int): Number of processes to draw with. Defaults to the number
+            of CPUs. If 1, everything is done in this process.
+
+    Yields:
+        sleigh_cycle (array.array): Array of 4-byte integers, or 8-byte
+            integers for over 4 billion Secret Santas, where the item at index
+            "i" is the index of the Secret Santa receiving a gift from Secret
+            Santa "i".
+    """
+    workers = workers or os.cpu_count() or 1
+    shards = max(min(shards or workers, n, 2 ** 16 - 1), 1)
+    typecode = "I" if n < 2 ** 32 else "Q"
+    if n < 2:
+        return array.array(typecode, range(n))
+
+    # Split the Secret Santas into equal blocks, and seed each block's deal,
+    # and each shard's shuffle from the secure random source
+    bounds = [n * block // shards for block in range(shards + 1)]
+    deal_seeds = [secrets.randbits(128) for _ in range(shards)]
+    shuffle_seeds = [secrets.randbits(128) for _ in range(shards)]
+
+    # Make the shared order, and receivers, closing, and unlinking each block
+    # that was made however the draw ends, even if making the next one fails
+    size = n * array.array(typecode).itemsize
+    with contextlib.ExitStack() as santas_stack:
+        santas_memories = []
+        for _ in range(2):
+            santas_memory = shared_memory.SharedMemory(create=True, size=size)
+            santas_stack.callback(santas_memory.unlink)
+            santas_stack.callback(santas_memory.close)
+            santas_memories.append(santas_memory)
+        order_memory, cycle_memory = santas_memories
+
+        # Draw in shards over the processes, or in this process for one worker
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) if \
+                workers > 1 else contextlib.nullcontext() as pool:
+            santas_map = pool.map if pool is not None else map
+
+            # Count each block's Secret Santas in each shard, and work out
+            # where each block's share of each shard goes in the order
+            counts = list(santas_map(count_shard, [n] * shards, bounds[:-1],
+                                     bounds[1:], [shards] * shards,
+                                     deal_seeds))
+            offsets, shard_bounds, position = [[0] * shards for _ in
+                                               range(shards)], [], 0
+            for shard in range(shards):
+                shard_bounds.append(position)
+                for block in range(shards):
+                    offsets[block][shard] = position
+                    position += counts[block][shard]
+            shard_bounds.append(position)
+
+            # Copy the blocks into the order, then shuffle, and stitch each
+            # shard, waiting for every process to finish each step
+            list(santas_map(scatter_shard, [order_memory.name] * shards,
+                            [n] * shards, bounds[:-1], bounds[1:],
+                            [shards] * shards, deal_seeds, offsets))
+            list(santas_map(shuffle_shard, [order_memory.name] * shards,
+                            [n] * shards, shard_bounds[:-1],
+                            shard_bounds[1:], shuffle_seeds))
+            list(santas_map(stitch_shard, [order_memory.name] * shards,
+                            [cycle_memory.name] * shards, [n] * shards,
+                            shard_bounds[:-1], shard_bounds[1:]))
+
+        # Copy the receivers out of shared memory
+        sleigh_cycle = array.array(typecode)
+        sleigh_cycle.frombytes(cycle_memory.buf[:size])
+
+    # Return the index array of receivers
+    return sleigh_cycle
+
+
+def secret_santa_sharded(sleighs, shards=None, workers=None):
+    """Randomly assign givers and receivers over several processes
+
+    Drop-in replacement for "secret_santa_derangement", for very large
+    rosters, drawing with "sharded_sleigh_cycle".
+
+    Args:
+        sleighs (dict): Dictionary with names as keys, and email addresses as
+            items, or a "SantasRoster".
+        shards (int): Number of shards. Defaults to the number of processes.
+        workers (int): Number of processes to draw with. Defaults to the number
+            of CPUs.
+
+    Yields:
+        santa_pairings (dict): Dictionary with giver names as keys, and
+            receiver names as items, or "SantasPairings" if "sleighs" is a
+            "SantasRoster".
+    """
+    sleigh_cycle = sharded_sleigh_cycle(len(sleighs), shards, workers)
+
+    # Keep a compact roster's pairings compact, as indices into the roster
+    if isinstance(sleighs, SantasRoster):
+        return SantasPairings(sleighs, sleigh_cycle)
+
+    # Generate a dictionary of givers as keys, and receivers as items
+    santas = list(sleighs.keys())
+    return dict(zip(santas, [santas[i] for i in sleigh_cycle]))
+
+
+def engine_sleigh_cycles(engine, n, k):
+    """Run a pairing engine "k" times, and collect its draws as indices
+
+    Args:
+        engine (function): "batch_sleigh_cycles", "random_sleigh_cycle", or
+            any function taking a "sleighs" dictionary, and returning a
+            dictionary of pairings, e.g. "secret_santa_randomiser".
+        n (int): Number of Secret Santas in each draw.
+        k (int): Number of draws.
+
+    Yields:
+        sleigh_cycles (numpy.ndarray): Array with "k" rows and "n" columns,
+            where the item at column "i" of each row is the index of the Secret
+            Santa receiving a gift from Secret Santa "i".
+    """
+    # Only import NumPy when it's needed, as it's slow to import
+    import numpy as np
+
+    # Draw the whole batch at once if the engine can
+    if engine is batch_sleigh_cycles:
+        return batch_sleigh_cycles(n, k)
+
+    # Join compact index arrays straight into one array
+    if engine is random_sleigh_cycle:
+        return np.frombuffer(b"".join(random_sleigh_cycle(n, compact=True)
+                                      .tobytes() for _ in range(k)),
+                             dtype=np.uint32).astype(np.int64).reshape(k, n)
+
+    # Otherwise, name each Secret Santa by their index, so the pairings are
+    # already indices
+    sleighs = {i: "" for i in range(n)}
+    sleigh_cycles = np.empty((k, n), dtype=np.int64)
+    for row in range(k):
+        santa_pairings = engine(sleighs)
+        sleigh_cycles[row] = [santa_pairings[i] for i in range(n)]
+
+    # Return the array of receivers for every draw
+    return sleigh_cycles
+
+
+def chi_square_p(statistic, dof):
+    """Approximate the chance of a chi-square statistic at least this large
+
+    Use the Wilson-Hilferty cube root approximation, which is close enough to
+    judge fairness without needing SciPy.
+
+    Args:
+        statistic (float): Pearson's chi-square statistic.
+        dof (int): Degrees of freedom.
+
+    Yields:
+        p (float): Upper tail probability, between 0 and 1.
+    """
+    # Nothing can be unlikely with no degrees of freedom, and nothing is
+    # likely if something impossible happened
+    if dof <= 0:
+        return 1.0 if statistic == 0 else 0.0
+    if math.isinf(statistic):
+        return 0.0
+
+    # Transform to a near-normal variable, and take its upper tail
+    spread = 2 / (9 * dof)
+    z = ((statistic / dof) ** (1 / 3) - (1 - spread)) / math.sqrt(spread)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def derangement_cycles(n):
+    """Share of derangements of "n" Secret Santas with each number of cycles
+
+    Count the derangements with "c" cycles with the recurrence
+    d(n, c) = (n - 1) * (d(n - 1, c) + d(n - 2, c - 1)), where everyone is in a
+    cycle of at least two Secret Santas.
+
+    Args:
+        n (int): Number of Secret Santas.
+
+    Yields:
+        shares (list): List where the item at index "c" is the share of
+            derangements with "c" gift-giving cycles.
+    """
+    # Count the derangements exactly, keeping the counts for the last two
+    # roster sizes, starting from no Secret Santas, and one Secret Santa
+    two_back, one_back = [1] + [0] * n, [0] * (n + 1)
+    for m in range(2, n + 1):
+        two_back, one_back = one_back, [
+            (m - 1) * (one_back[c] + (two_back[c - 1] if c else 0))
+            for c in range(n + 1)]
+    counts = two_back if n == 0 else one_back
+
+    # Return each count as a share of all the derangements
+    total = sum(counts)
+    return [count / total for count in counts] if total else counts
+
+
+class SantasTally:
+    """Tally of many draws, to check a pairing engine is fair
+
+    Count how often each Secret Santa gives to each other Secret Santa, and
+    how many gift-giving cycles each draw has, without keeping the draws, so
+    millions of draws take no more memory than one batch.
+
+    Args:
+        n (int): Number of Secret Santas in each draw.
+
+    Attributes:
+        draws (int): Number of valid draws tallied.
+        invalid (int): Number of draws where someone doesn't receive exactly
+            one gift, which aren't tallied.
+        self_gifts (int): Number of draws where someone gives to themselves.
+        pairs (numpy.ndarray): Array with "n" rows, and "n" columns, where the
+            item at row "i", and column "j" is the number of draws where
+            Secret Santa "i" gives to Secret Santa "j".
+        cycles (numpy.ndarray): Array where the item at index "c" is the
+            number of draws with "c" gift-giving cycles.
+    """
+
+    def __init__(self, n):
+        # Only import NumPy when it's needed, as it's slow to import
+        import numpy as np
+        self.n = n
+        self.draws = 0
+        self.invalid = 0
+        self.self_gifts = 0
+        self.pairs = np.zeros((n, n), dtype=np.int64)
+        self.cycles = np.zeros(n + 1, dtype=np.int64)
+
+    def add(self, sleigh_cycles):
+        """Tally a batch of draws
+
+        Args:
+            sleigh_cycles (numpy.ndarray): Array of draws, as given by
+                "engine_sleigh_cycles".
+        """
+        import numpy as np
+        santas = np.arange(self.n)
+
+        # Set aside draws that aren't a permutation of the Secret Santas
+        valid = (np.sort(sleigh_cycles, axis=1) == santas).all(axis=1)
+        self.invalid += int(valid.size - valid.sum())
+        sleigh_cycles = sleigh_cycles[valid]
+        self.draws += len(sleigh_cycles)
+        self.self_gifts += int((sleigh_cycles == santas).any(axis=1).sum())
+
+        # Count every giver, and receiver pair at once
+        self.pairs += np.bincount((santas * self.n + sleigh_cycles).ravel(),
+                                  minlength=self.n ** 2).reshape(self.n,
+                                                                 self.n)
+
+        # Label each Secret Santa with the smallest index in their cycle, by
+        # repeatedly jumping twice as far along the cycle, then count the
+        # Secret Santas labelled with their own index, one per cycle
+        labels = np.broadcast_to(santas, sleigh_cycles.shape)
+        jumps = sleigh_cycles
+        for _ in range(max(self.n - 1, 0).bit_length()):
+            labels = np.minimum(labels, np.take_along_axis(labels, jumps, 1))
+            jumps = np.take_along_axis(jumps, jumps, 1)
+        self.cycles += np.bincount((labels == santas).sum(axis=1),
+                                   minlength=self.n + 1)
+
+    def merge(self, santas_tally):
+        """Add another tally of the same roster size to this one
+
+        Args:
+            santas_tally (SantasTally): Tally to add, e.g. from another process.
+        """
+        self.draws += santas_tally.draws
+        self.invalid += santas_tally.invalid
+        self.self_gifts += santas_tally.self_gifts
+        self.pairs += santas_tally.pairs
+        self.cycles += santas_tally.cycles
+
+    def pairs_test(self):
+        """Test if every Secret Santa is as likely to give to everyone else
+
+        Compare the count of every giver, and receiver pair with the draws
+        shared equally between the other "n - 1" Secret Santas, using Pearson's
+        chi-square test. Each draw is a permutation, so the counts aren't
+        independent, but the statistic for a fair engine has the mean, and for
+        more than a handful of Secret Santas the spread, of a chi-square with
+        "n(n - 2)" degrees of freedom.
+
+        Yields:
+            statistic (float): Chi-square statistic, or infinity if anyone
+                ever gives to themselves.
+            dof (int): Degrees of freedom.
+            p (float): Chance of a statistic at least this large if the engine
+                is fair. Very small values mean the engine is biased.
+        """
+        import numpy as np
+
+        # Nobody should ever give to themselves, and there's nothing to test
+        # without enough Secret Santas, or draws
+        dof = max(self.n * (self.n - 2), 0)
+        if self.self_gifts:
+            return math.inf, dof, 0.0
+        if self.n < 3 or not self.draws:
+            return 0.0, 0, 1.0
+
+        # Compare every pair but the Secret Santas giving to themselves
+        expected = self.draws / (self.n - 1)
+        others = ~np.eye(self.n, dtype=bool)
+        statistic = float(((self.pairs[others] - expected) ** 2).sum() /
+                          expected)
+        return statistic, dof, chi_square_p(statistic, dof)
+
+    def cycles_test(self, target="cycle"):
+        """Test if draws have the expected number of gift-giving cycles
+
+        Compare the number of draws with each number of cycles against the
+        expected shares, using Pearson's chi-square test. Numbers of cycles
+        with fewer than 5 expected draws are grouped together.
+
+        Args:
+            target (str): Expected distribution; "cycle" if every draw should
+                be a single cycle through everyone, like
+                "secret_santa_derangement", or "derangement" if every way of
+                pairing without anyone giving to themselves should be equally
+                likely.
+
+        Yields:
+            statistic (float): Chi-square statistic, or infinity if a number of
+                cycles that should never happen did.
+            dof (int): Degrees of freedom.
+            p (float): Chance of a statistic at least this large if the engine
+                draws from "target". Very small values mean it doesn't.
+        """
+        # Get the expected share of draws with each number of cycles
+        if target == "cycle":
+            shares = [0.0] * (self.n + 1)
+            shares[min(self.n, 1)] = 1.0
+        elif target == "derangement":
+            shares = derangement_cycles(self.n)
+        else:
+            raise ValueError("Santa doesn't know that target! [" + target +
+                             "]")
+
+        # Numbers of cycles that should never happen mustn't happen at all
+        observed = [int(count) for count in self.cycles]
+        if any(count and not share for count, share in zip(observed, shares)):
+            return math.inf, 0, 0.0
+
+        # Group together numbers of cycles with too few expected draws, from
+        # the least likely up
+        bins = sorted((share * self.draws, count) for share, count in
+                      zip(shares, observed) if share)
+        while len(bins) > 1 and bins[0][0] < 5:
+            (expected, count), (next_expected, next_count) = bins[:2]
+            bins = sorted([(expected + next_expected, count + next_count)] +
+                          bins[2:])
+
+        # Compare the observed, and expected draws
+        if not self.draws:
+            return 0.0, 0, 1.0
+        statistic = sum((count - expected) ** 2 / expected
+                        for expected, count in bins)
+        dof = len(bins) - 1
+        return statistic, dof, chi_square_p(statistic, dof)
+
+    def report(self, target="cycle"):
+        """Summarise the tally, and both fairness tests
+
+        Args:
+            target (str): Expected distribution of cycles, as in
+                "cycles_test".
+
+        Yields:
+            santas_report (dict): Dictionary of the number of draws, invalid
+                draws, draws with self gifts, and the statistic, degrees of
+                freedom, and p value of the "pairs", and "cycles" tests.
+        """
+        santas_report = {"draws": self.draws, "invalid": self.invalid,
+                         "self_gifts": self.self_gifts}
+        for test, results in [("pairs", self.pairs_test()),
+                              ("cycles", self.cycles_test(target))]:
+            santas_report[test] = dict(zip(["statistic", "dof", "p"],
+                                           results))
+        return santas_report
+
+
+def tally_batches(engine, n, k, batch=10000):
+    """Draw, and tally "k" draws from a pairing engine, one batch at a time
+
+    Args:
+        engine (function): Pairing engine, as in "engine_sleigh_cycles".
+        n (int): Number of Secret Santas in each draw.
+        k (int): Number of draws.
+        batch (int): Number of draws to hold in memory at once.
+
+    Yields:
+        santas_tally (SantasTally): Tally of the draws.
+    """
+    santas_tally = SantasTally(n)
+    for start in range(0, k, batch):
+        santas_tally.add(engine_sleigh_cycles(engine, n, min(batch,
+                                                             k - start)))
+    return santas_tally
+
+
+def tally_draws(engine, n, k, batch=10000, workers=1):
+    """Draw, and tally many draws from a pairing engine, to check it's fair
+
+    Args:
+        engine (function): Pairing engine, as in "engine_sleigh_cycles". Must
+            be a module-level function, or a "functools.partial" of one, to
+            be sent to other processes.
+        n (int): Number of Secret Santas in each draw.
+        k (int): Number of draws.
+        batch (int): Number of draws to hold in memory at once, per process.
+        workers (int): Number of processes to draw with, or None for the
+            number of CPUs.
+
+    Yields:
+        santas_tally (SantasTally): Tally of all the draws, e.g. to call
+            "report" on.
+    """
+    # Draw in this process if only one worker is needed
+    if workers == 1:
+        return tally_batches(engine, n, k, batch)
+
+    # Share the draws out between the processes as evenly as possible
+    workers = workers or os.cpu_count() or 1
+    shares = [k // workers + (worker < k % workers)
+              for worker in range(workers)]
+
+    # Tally each share in its own process, and add the tallies together
+    santas_tally = SantasTally(n)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        for worker_tally in pool.map(tally_batches, [engine] * workers,
+                                     [n] * workers, shares,
+                                     [batch] * workers):
+            santas_tally.merge(worker_tally)
+    return santas_tally
+
+
+def load_exclusions(filename):
+    """Load Secret Santa pairings that aren't allowed from a CSV file
+
+    Load a two-column CSV file, with a header row, where the first column has
+    the giver's name, and the second column has the name of a Secret Santa they
+    must not give a gift to, e.g. partners, or last year's receivers. Each row
+    excludes one direction only, so add both directions for partners.
+
+    Args:
+        filename (str): Path to the CSV file of exclusions.
+
+    Yields:
+        exclusions (dict): Dictionary with giver names as keys, and sets of
+            excluded receiver names as items.
+    """
+    # Initialise a storage dictionary for the exclusions
+    exclusions = {}
+
+    # Read each row after the header, stripping any whitespace
+    with open(filename, "r", newline="") as f:
+        chimneys = csv.reader(f, skipinitialspace=True)
+        next(chimneys, None)
+        for row in chimneys:
+            if len(row) >= 2 and row[0].strip() and row[1].strip():
+                exclusions.setdefault(row[0].strip(), set()).add(
+                    row[1].strip())
+
+    # Return a dictionary of givers, and their excluded receivers
+    return exclusions
+
+
+def secret_santa_exclusions(sleighs, exclusions, mixing=1.0, attempts=10000,
+                            fair=True):
+    """Randomly assign givers and receivers, avoiding excluded pairings
+
+    Randomly pair Secret Santas so nobody gives to themselves, or to anyone
+    they're excluded from giving to, in three steps:
+
+    1. Check a valid pairing exists, with a bipartite matching: randomly
+       shuffle all receivers, and repair any excluded pairings by swapping
+       receivers with other random givers. Any givers still without an
+       allowed receiver are found one using augmenting paths. If there are
+       none, Hall's condition fails - a group of givers has fewer allowed
+       receivers than people - so no valid pairing exists, and an error is
+       thrown straight away;
+    2. Draw random pairings until one avoids every exclusion, so every valid
+       pairing is equally likely. Each draw is given up as soon as anyone gets
+       an excluded receiver, so with "m" exclusions each, a valid pairing
+       takes about "e ** (m + 1)" short draws; and
+    3. If no valid pairing turns up after "attempts" draws, e.g. as exclusions
+       are too dense, throw an error, unless "fair" is False. Then fall back
+       to the matching from step 1, and randomly swap the receivers of two
+       givers many times, if both givers are still allowed their new
+       receivers. This random walk smooths out some of the bias left by the
+       repairs, but with exclusions it can't reach every valid pairing from
+       every other, so the fallback is NOT uniform - some valid pairings are
+       more likely than others.
+
+    Each augmenting path search only looks at the receivers each giver is
+    allowed, and the receivers it hasn't visited yet, so with few exclusions
+    the whole draw takes near-linear time.
+
+    Unlike "secret_santa_derangement", the pairings may form several separate
+    cycles.
+
+    Args:
+        sleighs (dict): Dictionary with names as keys, and email addresses as
+            items.
+        exclusions (dict): Dictionary with giver names as keys, and collections
+            of excluded receiver names as items, as given by "load_exclusions".
+        mixing (float): Number of random swaps, in multiples of "n log n", to
+            make in step 3, where "n" is the number of Secret Santas.
+        attempts (int): Most random pairings to draw in step 2 before falling
+            back to the bipartite matching.
+        fair (bool): If True, throw an error rather than fall back to a draw
+            where some valid pairings are more likely than others.
+
+    Yields:
+        santa_pairings (dict): Dictionary with giver names as keys, and
+            receiver names as items. If there is no valid pairing, or no fair
+            one was found with "fair" turned on, throw an error message
+            instead.
+    """
+    # Get the Secret Santa names, and their positions in the roster
+    santas = list(sleighs.keys())
+    n = len(santas)
+    sleigh_numbers = {santa: i for i, santa in enumerate(santas)}
+
+    # Generate a set of excluded receiver positions for each giver, always
+    # including themselves
+    chimneys = [{i} for i in range(n)]
+    for giver, receivers in exclusions.items():
+        for receiver in receivers:
+            if giver in sleigh_numbers and receiver in sleigh_numbers:
+                chimneys[sleigh_numbers[giver]].add(sleigh_numbers[receiver])
+            else:
+                stranger = giver if giver not in sleigh_numbers else receiver
+                print("The elves can't find " + stranger + " on the list... " +
+                      "[Exclusion ignored]")
+
+    # Seed a random number generator from the secure random source
+    santas_dice = random.Random(secrets.randbits(128))
+
+    # Step 1: randomly shuffle the receivers, and then try to swap away any
+    # excluded receivers with a limited number of random givers
+    sleigh_order = list(range(n))
+    santas_dice.shuffle(sleigh_order)
+    lost_sleighs = set()
+    for i in range(n):
+        if sleigh_order[i] in chimneys[i]:
+            for _ in range(32):
+                j = santas_dice.randrange(n)
+                if (sleigh_order[j] not in chimneys[i] and
+                        sleigh_order[i] not in chimneys[j]):
+                    sleigh_order[i], sleigh_order[j] = (sleigh_order[j],
+                                                        sleigh_order[i])
+                    break
+            else:
+                lost_sleighs.add(i)
+
+    # Unassign the receivers of any givers who still have an excluded
+    # receiver, and find them an allowed receiver using augmenting paths
+    sleigh_givers = [-1] * n
+    for i in range(n):
+        if i not in lost_sleighs:
+            sleigh_givers[sleigh_order[i]] = i
+    free_receivers = {sleigh_order[i] for i in lost_sleighs}
+    for lost_giver in lost_sleighs:
+        sleigh_order[lost_giver] = -1
+
+        # Breadth-first search for a free receiver. The receivers not visited
+        # yet are only gathered if the free receivers aren't enough, and each
+        # is taken out once visited, so every receiver, and exclusion is only
+        # looked at once per search
+        last_giver = {}
+        searched_givers = []
+        unvisited_receivers = None
+        sleigh_queue = collections.deque([lost_giver])
+        free_receiver = -1
+        while sleigh_queue and free_receiver < 0:
+            giver = sleigh_queue.popleft()
+            searched_givers.append(giver)
+
+            # Try the free receivers first, as there are only as many as
+            # there are givers still lost
+            for receiver in free_receivers:
+                if receiver not in chimneys[giver]:
+                    last_giver[receiver] = giver
+                    free_receiver = receiver
+                    break
+            else:
+                # Otherwise, queue up the givers of every receiver this giver
+                # may give to, that the search hasn't visited yet
+                if unvisited_receivers is None:
+                    unvisited_receivers = set(range(n)) - free_receivers
+                allowed_receivers = unvisited_receivers - chimneys[giver]
+                unvisited_receivers -= allowed_receivers
+                for receiver in allowed_receivers:
+                    last_giver[receiver] = giver
+                    sleigh_queue.append(sleigh_givers[receiver])
+
+        # If there is no free receiver, the givers searched have fewer allowed
+        # receivers between them than there are givers, so throw an error
+        # naming them
+        if free_receiver < 0:
+            sys.exit("The elves can't untangle the sleighs! [No valid " +
+                     "pairing for " + str(len(searched_givers)) +
+                     " Secret Santa(s) with these exclusions: " +
+                     ", ".join(sorted(str(santas[giver]) for giver in
+                                      searched_givers)) + "]")
+
+        # Shift receivers along the path back to the lost giver
+        free_receivers.discard(free_receiver)
+        receiver = free_receiver
+        while receiver >= 0:
+            giver = last_giver[receiver]
+            receiver, sleigh_order[giver] = sleigh_order[giver], receiver
+            sleigh_givers[sleigh_order[giver]] = giver
+
+    # Step 2: shuffle the receivers one giver at a time, and start again as
+    # soon as a giver draws an excluded receiver. Every shuffle is uniform,
+    # whatever order the last one stopped in, so the first that gets through
+    # is a uniform valid pairing
+    santas_draw = list(range(n))
+    for _ in range(attempts):
+        for i in range(n):
+            j = santas_dice.randrange(i, n)
+            santas_draw[i], santas_draw[j] = santas_draw[j], santas_draw[i]
+            if santas_draw[i] in chimneys[i]:
+                break
+        else:
+            return dict(zip(santas, [santas[i] for i in santas_draw]))
+
+    # Step 3: throw an error if the draw has to be fair, otherwise randomly
+    # swap pairs of receivers, if both givers are allowed their new
+    # receivers, and warn the draw isn't fair
+    if fair:
+        sys.exit("The elves can't draw fairly with these exclusions! [No " +
+                 "valid pairing in " + str(attempts) + " random draws, " +
+                 "allow an unfair draw, where some pairings are more likely " +
+                 "than others, or remove some exclusions]")
+    print("The elves struggled with these exclusions... [Some pairings are " +
+          "more likely than others]")
+    for _ in range(int(mixing * n * math.log(max(n, 2))) + n):
+        i = santas_dice.randrange(n)
+        j = santas_dice.randrange(n)
+        if (sleigh_order[j] not in chimneys[i] and
+                sleigh_order[i] not in chimneys[j]):
+            sleigh_order[i], sleigh_order[j] = sleigh_order[j], sleigh_order[i]
+
+    # Generate a dictionary of givers as keys, and receivers as items
+    santa_pairings = dict(zip(santas, [santas[i] for i in sleigh_order]))
+
+    # Return a dictionary of givers as keys, and receivers as items
+    return santa_pairings
+
+
+def repair_pairings(santa_pairings, leavers=(), joiners=(), exclusions=None):
+    """Repair a draw after Secret Santas leave, or join, changing as few
+    pairings as possible
+
+    Each Secret Santa leaving is spliced out of their gift-giving cycle, so
+    whoever gave to them gives to their receiver instead. Each Secret Santa
+    joining is spliced into a cycle after a random giver, who gives to them
+    instead, while they give to that giver's old receiver. Splicing out of, or
+    into a random single cycle leaves a random single cycle, and only changes
+    one, or two pairings, however many Secret Santas there are.
+
+    Anyone who'd be left giving to themselves, e.g. if the other Secret Santa
+    in their cycle of two leaves, or giving to someone they're excluded from,
+    is spliced out too, and back in like someone joining.
+
+    Args:
+        santa_pairings (dict): Dictionary with giver names as keys, and
+            receiver names as items, from the earlier draw.
+        leavers (list): Names of Secret Santas leaving.
+        joiners (list): Names of Secret Santas joining.
+        exclusions (dict): Dictionary with giver names as keys, and collections
+            of excluded receiver names as items.
+
+    Yields:
+        santa_pairings (dict): Dictionary with giver names as keys, and
+            receiver names as items, for everyone left, and everyone joining.
+            If someone can't be fitted in without breaking the exclusions,
+            exit the system, and throw an error message.
+    """
+    exclusions = exclusions or {}
+    leavers = set(leavers)
+
+    def allowed(giver, receiver):
+        """Check a giver may give to a receiver"""
+        return giver != receiver and receiver not in exclusions.get(giver, ())
+
+    # Copy the pairings, and find who gives to each receiver
+    santa_pairings = dict(santa_pairings)
+    givers = {receiver: giver for giver, receiver in santa_pairings.items()}
+    santas_waiting = collections.deque()
+
+    def splice_out(santa):
+        """Take a Secret Santa out of their cycle, and close the gap"""
+        giver, receiver = givers.pop(santa), santa_pairings.pop(santa)
+
+        # Keep taking out whoever gives to the gap until someone may give to
+        # the receiver, or the whole cycle is taken out
+        while giver != santa and not allowed(giver, receiver):
+            santas_waiting.append(giver)
+            giver = givers.pop(giver)
+            santa_pairings.pop(santas_waiting[-1])
+        if giver != santa:
+            santa_pairings[giver], givers[receiver] = receiver, giver
+
+    # Splice out everyone leaving, and then anyone giving to someone they're
+    # now excluded from
+    for leaver in leavers:
+        if leaver in santa_pairings:
+            splice_out(leaver)
+    if exclusions:
+        for giver in list(santa_pairings):
+            if (giver in santa_pairings and
+                    not allowed(giver, santa_pairings[giver])):
+                splice_out(giver)
+                santas_waiting.append(giver)
+
+    # Splice everyone waiting, or joining, in after a random giver who may
+    # give to them, and whose receiver they may give to. Try a few random
+    # givers first, then everyone in a random order
+    santas_waiting.extend(joiners)
+    santas_sleigh = list(santa_pairings)
+    while santas_waiting:
+        joiner = santas_waiting.popleft()
+        if joiner in leavers or joiner in santa_pairings:
+            continue
+
+        # Start a new cycle of two if nobody else is left
+        if not santa_pairings:
+            if santas_waiting and allowed(joiner, santas_waiting[0]) and \
+                    allowed(santas_waiting[0], joiner):
+                partner = santas_waiting.popleft()
+                santa_pairings.update({joiner: partner, partner: joiner})
+                givers.update({partner: joiner, joiner: partner})
+                santas_sleigh.extend([joiner, partner])
+                continue
+            sys.exit("Santa can't fit everyone in! [No room for " + joiner +
+                     ", draw again instead]")
+
+        giver = None
+        for attempt in range(100):
+            candidate = santas_sleigh[secrets.randbelow(len(santas_sleigh))]
+            if candidate in santa_pairings and allowed(candidate, joiner) and \
+                    allowed(joiner, santa_pairings[candidate]):
+                giver = candidate
+                break
+        else:
+            candidates = [candidate for candidate in santa_pairings if
+                          allowed(candidate, joiner) and
+                          allowed(joiner, santa_pairings[candidate])]
+            if not candidates:
+                sys.exit("Santa can't fit everyone in! [No room for " +
+                         joiner + ", draw again instead]")
+            giver = secrets.choice(candidates)
+
+        # Splice them in between the giver, and the giver's old receiver
+        receiver = santa_pairings[giver]
+        santa_pairings[giver], santa_pairings[joiner] = joiner, receiver
+        givers[joiner], givers[receiver] = giver, joiner
+        santas_sleigh.append(joiner)
+
+    # Return a dictionary of givers as keys, and receivers as items
+    return santa_pairings
+
+
+def import_template(ext, path=".", enc=None):
+    """Import the first files with a specific file extension in a given folder
+
+    Find all the files in a folder with a specific file extension, e.g. ".txt",
+    in a specific folder, return the first file found, and load it into the
+    script.
+
+    Args:
+        ext (str): Extension of the filename required, e.g. ".txt" or ".html".
+        path (str): Path to the folder where the file(s) are located, e.g.
+            "./templates".
+        enc (str): Encoding format used in the Python "open" built-in function.
+
+    Yields:
+        template_body (str): Imported file as desired.
+    """
+    # Get the first file with extension "ext" in the "path"
+    template_filename = [template for template in os.listdir(path) if
+                         template.endswith(ext)][0]
+
+    # Import the template
+    with open(path + "/" + template_filename, "r", encoding=enc) as f:
+        template_body = f.read()
+
+    # Return the imported file
+    return template_body
+
+
+def open_post_office(santas_mailbox, host="smtp.gmail.com", port=587,
+                     tls=True):
+    """Open an authenticated connection to the email server
+
+    Args:
+        santas_mailbox (str): A valid email address corresponding to the Gmail
+            account.
+        host (str): Email server to connect to.
+        port (int): Port of the email server.
+        tls (bool): If True, upgrade the connection with STARTTLS before
+            logging in.
+
+    Yields:
+        santas_server (smtplib.SMTP): Logged-in connection to the email server.
+    """
+    # Open a connection to the email server, and log in
+    santas_server = smtplib.SMTP(host, port)
+    santas_server.ehlo()
+    if tls:
+        santas_server.starttls()
+    santas_server.login(santas_mailbox, santas_key)
+
+    # Return the connection
+    return santas_server
+
+
+def write_letter(santas_mailbox, giver_mailbox, giver, receiver, plain_body,
+                 html_body, giphy=None):
+    """Write Santa's letter to a single Secret Santa
+
+    Populate the plain text, and HTML templates with the giver's name, their
+    receiver's name, and a random, festive GIF and its link.
+
+    Args:
+        santas_mailbox (str): A valid email address corresponding to the Gmail
+            account.
+        giver_mailbox (str): Email address of the giver.
+        giver (str): Name of the giver.
+        receiver (str): Name of the giver's randomly assigned receiver.
+        plain_body (str): Plain text email template.
+        html_body (str): HTML email template.
+        giphy (tuple): MIME image, GIPHY URL, and GIPHY ID of the GIF to
+            embed, as given by "mime_giphy". If not given, "mime_giphy" is
+            called to get one. If the MIME image is None, the GIF is linked
+            to instead.
+
+    Yields:
+        santas_letter (MIMEMultipart): Email message for the giver.
+    """
+    # Get a random festive GIF using the GIPHY API in a MIME image format
+    santas_picture, giphy_link, giphy_id = giphy if giphy else mime_giphy()
+
+    # To ensure the HTML version is preferential, first setup a mixed MIME
+    # message to contain the essentials, e.g. "From", "To", "Subject".
+    # Then generate an alternative MIME subpart to hold plain text, and HTML
+    # versions of the email. The plain text comes first to ensure HTML is
+    # preferential.
+    # As there is an embedded image in the HTML version, a related MIME
+    # section is added that is a subpart of the alternative MIME subpart.
+    # This ensures the HTML version is still preferential, and the embedded
+    # image is displayed.
+
+    # Initialise a mixed MIME message
+    santas_letter = MIMEMultipart("mixed")
+
+    # Attach required parts to the mixed part
+    santas_letter["From"] = santas_mailbox
+    santas_letter["To"] = giver_mailbox
+    santas_letter["Subject"] = "Secret Santa"
+
+    # Initialise an alternative subpart of the MIME message, and attach it
+    santas_letter_alt = MIMEMultipart("alternative")
+    santas_letter.attach(santas_letter_alt)
+
+    # Attach plain text body to the alternative part
+    santas_letter_alt.attach(MIMEText(plain_body.format(giver=giver,
+                                                        receiver=receiver,
+                                                        link=giphy_link),
+                                      "plain"))
+
+    # Initialise an related subpart of the alternative subpart of the MIME
+    # message, and attach it
+    santas_letter_rel = MIMEMultipart("related")
+    santas_letter_alt.attach(santas_letter_rel)
+
+    # Attach the HTML body, and santas_picture to the relative part. If the
+    # GIF is only linked to, the HTML shows it straight from GIPHY instead
+    santas_letter_rel.attach(MIMEText(html_body.format(
+        giver=giver, receiver=receiver, link=giphy_link, id=giphy_id,
+        src=giphy_link if santas_picture is None else "cid:" + giphy_id),
+        "html"))
+    if santas_picture is not None:
+        santas_letter_rel.attach(santas_picture)
+
+    # Return the email message
+    return santas_letter
+
+
+def compile_template(template_body):
+    """Split a template into its static text, and placeholders once
+
+    Parse a template, e.g. from "import_template", so it can be filled in
+    many times without parsing it again.
+
+    Args:
+        template_body (str): Template with "str.format" style placeholders,
+            e.g. "{giver}".
+
+    Yields:
+        template_segments (list): List of tuples of static text, and the name
+            of the placeholder following it, or None after the last static
+            text.
+    """
+    return [(static_text, field_name) for static_text, field_name, _, _ in
+            string.Formatter().parse(template_body)]
+
+
+class LetterSkeleton:
+    """Reusable skeleton of Santa's letters, built once per run
+
+    Pre-build everything in Santa's letters that's the same for every Secret
+    Santa, so only the giver's email address, the names, and the GIF are
+    spliced in for each letter. The MIME structure is the same as
+    "write_letter": a mixed message, containing an alternative part with the
+    plain text, and a related part with the HTML, and the embedded GIF.
+
+    Both text parts are encoded as quoted-printable. As quoted-printable
+    encoding is local, the static text of each template is encoded once here,
+    and joined with the encoded placeholders for each letter using soft line
+    breaks, which decode to nothing.
+
+    Args:
+        santas_mailbox (str): A valid email address corresponding to the Gmail
+            account.
+        plain_body (str): Plain text email template.
+        html_body (str): HTML email template.
+    """
+
+    # Headers of each quoted-printable text part
+    text_headers = ('Content-Type: text/{}; charset="utf-8"\n' +
+                    'MIME-Version: 1.0\n' +
+                    'Content-Transfer-Encoding: quoted-printable\n\n')
+
+    def __init__(self, santas_mailbox, plain_body, html_body):
+        # Compile both templates, and encode their static text once
+        self.plain_segments = [(self.encode_text(static_text), field_name)
+                               for static_text, field_name in
+                               compile_template(plain_body)]
+        self.html_segments = [(self.encode_text(static_text), field_name)
+                              for static_text, field_name in
+                              compile_template(html_body)]
+
+        # Generate the MIME structure around the text parts, and the image,
+        # with random boundaries. Quoted-printable, and base64 encoded parts
+        # can never contain a boundary line, as they never have "--=" at the
+        # start of a line
+        mixed, alternative, related = ["===============" +
+                                       secrets.token_hex(16) + "=="
+                                       for _ in range(3)]
+        self.letter_head = ('Content-Type: multipart/mixed; boundary="' +
+                            mixed + '"\nMIME-Version: 1.0\nFrom: ' +
+                            santas_mailbox + '\nTo: ')
+        self.letter_plain = ('\nSubject: Secret Santa\n\n--' + mixed +
+                             '\nContent-Type: multipart/alternative; ' +
+                             'boundary="' + alternative + '"\nMIME-Version: ' +
+                             '1.0\n\n--' + alternative + '\n' +
+                             self.text_headers.format("plain"))
+        self.letter_html = ('\n--' + alternative + '\nContent-Type: ' +
+                            'multipart/related; boundary="' + related +
+                            '"\nMIME-Version: 1.0\n\n--' + related + '\n' +
+                            self.text_headers.format("html"))
+        self.letter_picture = '\n--' + related + '\n'
+        self.letter_tail = ('\n--' + related + '--\n\n--' + alternative +
+                            '--\n\n--' + mixed + '--\n')
+
+    @staticmethod
+    def encode_text(text):
+        """Encode text as UTF-8 quoted-printable
+
+        Args:
+            text (str): Text to encode.
+
+        Yields:
+            Quoted-printable encoded text.
+        """
+        return email.quoprimime.body_encode(text.encode("utf8").decode(
+            "latin-1"))
+
+    def fill_template(self, template_segments, fields):
+        """Fill in a compiled, and encoded template
+
+        Args:
+            template_segments (list): Encoded static text, and placeholder
+                names of a template.
+            fields (dict): Dictionary with placeholder names as keys, and
+                their values as items.
+
+        Yields:
+            Quoted-printable encoded text, with placeholders filled in.
+        """
+        return "=\n".join([static_text if field_name is None else
+                           static_text + "=\n" +
+                           self.encode_text(str(fields[field_name]))
+                           for static_text, field_name in template_segments])
+
+    def write(self, giver_mailbox, giver, receiver, giphy):
+        """Write Santa's letter to a single Secret Santa
+
+        Args:
+            giver_mailbox (str): Email address of the giver.
+            giver (str): Name of the giver.
+            receiver (str): Name of the giver's randomly assigned receiver.
+            giphy (tuple): MIME image, GIPHY URL, and GIPHY ID of the GIF to
+                embed, as given by "mime_giphy". If the MIME image is None,
+                the GIF is linked to instead.
+
+        Yields:
+            santas_letter (str): Complete email message for the giver, ready
+                to send.
+        """
+        santas_picture, giphy_link, giphy_id = giphy
+        fields = {"giver": giver, "receiver": receiver, "link": giphy_link,
+                  "id": giphy_id, "src": giphy_link if santas_picture is None
+                  else "cid:" + giphy_id}
+        santas_letter = [self.letter_head, giver_mailbox, self.letter_plain,
+                         self.fill_template(self.plain_segments, fields),
+                         self.letter_html,
+                         self.fill_template(self.html_segments, fields)]
+        if santas_picture is not None:
+            santas_letter += [self.letter_picture, santas_picture.as_string()]
+        return "".join(santas_letter + [self.letter_tail])
+
+
+class SantasJournal:
+    """Append-only journal of the draw, and every letter's delivery
+
+    Keep a record of the Secret Santa pairings, and the delivery of each
+    letter, in a JSON lines file, so an interrupted run can be resumed without
+    drawing again, or resending letters that were already sent. The draw is
+    written to disk straight away, but deliveries are only forced to disk in
+    batches, so if the computer crashes, up to a batch of letters may be sent
+    again when resuming.
+
+    Note the journal reveals who's giving to who, so delete it once all the
+    letters have been sent!
+
+    Args:
+        path (str): Path to the journal file, which is added to if it exists.
+        fsync_every (int): Most deliveries to record before forcing them to
+            disk.
+        fsync_seconds (float): Most seconds to wait before forcing recorded
+            deliveries to disk.
+    """
+
+    def __init__(self, path, fsync_every=100, fsync_seconds=1.0):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_seconds = fsync_seconds
+        self.lock = threading.Lock()
+        self.unsynced = 0
+        self.synced = time.monotonic()
+
+        # Start on a new line, in case the last entry was cut off by a crash
+        self.journal_file = open(path, "a+", encoding="utf8")
+        if self.journal_file.tell() > 0:
+            self.journal_file.seek(self.journal_file.tell() - 1)
+            if self.journal_file.read(1) != "\n":
+                self.journal_file.write("\n")
+
+    def record(self, entry, sync=False):
+        """Add an entry to the end of the journal
+
+        Args:
+            entry (dict): Entry to add.
+            sync (bool): If True, force the entry to disk straight away,
+                otherwise only once a batch of entries has built up.
+        """
+        with self.lock:
+            self.journal_file.write(json.dumps(entry) + "\n")
+            self.unsynced += 1
+            if (sync or self.unsynced >= self.fsync_every or
+                    time.monotonic() - self.synced >= self.fsync_seconds):
+                self.sync()
+
+    def record_draw(self, sleighs, santa_pairings, delivered=()):
+        """Record the Secret Santas, and their pairings
+
+        Args:
+            sleighs (dict): Dictionary with names as keys, and email addresses
+                as items.
+            santa_pairings (dict): Dictionary with giver names as keys, and
+                receiver names as items.
+            delivered (set): Names of givers who already have the letter for
+                their receiver, e.g. from before a redraw.
+        """
+        self.record({"sleighs": dict(sleighs.items()),
+                     "pairings": dict(santa_pairings.items()),
+                     "delivered": sorted(delivered)}, sync=True)
+
+    def record_delivery(self, giver, delivery):
+        """Record the delivery of a giver's letter
+
+        Args:
+            giver (str): Name of the giver.
+            delivery (str): Delivery status, i.e. "sent" or the error message.
+        """
+        self.record({"giver": giver, "delivery": delivery})
+
+    def sync(self):
+        """Force all recorded entries to disk. Call with the lock held"""
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+        self.unsynced = 0
+        self.synced = time.monotonic()
+
+    def close(self):
+        """Force all recorded entries to disk, and close the journal"""
+        with self.lock:
+            self.sync()
+            self.journal_file.close()
+
+    @staticmethod
+    def load_deliveries(path):
+        """Load the keys of letters already sent, ignoring any draw, e.g. to
+        replay a spool
+
+        Args:
+            path (str): Path to the journal file, which may not exist yet.
+
+        Yields:
+            delivered (set): Keys of letters whose delivery was "sent".
+        """
+        delivered = set()
+        if not os.path.exists(path):
+            return delivered
+
+        # Read each entry in order, skipping any cut off by a crash
+        with open(path, "r", encoding="utf8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("delivery") == "sent":
+                    delivered.add(entry["giver"])
+
+        # Return the keys of letters already sent
+        return delivered
+
+    @staticmethod
+    def load(path):
+        """Load the latest draw, and the givers already sent letters
+
+        Args:
+            path (str): Path to the journal file.
+
+        Yields:
+            sleighs (dict): Dictionary with names as keys, and email addresses
+                as items.
+            santa_pairings (dict): Dictionary with giver names as keys, and
+                receiver names as items.
+            delivered (set): Names of givers whose letters were sent.
+        """
+        sleighs, santa_pairings, delivered = None, None, set()
+
+        # Read each entry in order, skipping any cut off by a crash
+        with open(path, "r", encoding="utf8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if "pairings" in entry:
+                    sleighs = entry["sleighs"]
+                    santa_pairings = entry["pairings"]
+                    delivered = set(entry.get("delivered", ()))
+                elif entry.get("delivery") == "sent":
+                    delivered.add(entry["giver"])
+
+        if santa_pairings is None:
+            sys.exit("Santa's journal is blank! [No draw found in " + path +
+                     "]")
+
+        # Return the draw, and the givers already sent letters
+        return sleighs, santa_pairings, delivered
+
+
+def resume_sleighs(journal):
+    """Pick up an interrupted run from where it left off
+
+    Args:
+        journal (str): Path to the journal of the interrupted run.
+
+    Yields:
+        sleighs (dict): Dictionary with names as keys, and email addresses as
+            items.
+        santa_pairings (dict): Dictionary with giver names as keys, and
+            receiver names as items, for givers who haven't been sent their
+            letter yet.
+    """
+    sleighs, santa_pairings, delivered = SantasJournal.load(journal)
+    print("Resuming! [" + str(len(delivered)) + " of " +
+          str(len(santa_pairings)) + " letter(s) already sent]")
+    return sleighs, {giver: receiver for giver, receiver in
+                     santa_pairings.items() if giver not in delivered}
+
+
+def retry_delay(error, attempt, retries=2, backoff=0.5):
+    """Decide whether, and when to try sending a letter again
+
+    Only temporary failures are tried again, i.e. dropped connections, SMTP
+    4xx replies, and GIPHY being rate-limited, or unavailable. The wait doubles
+    after each attempt, with some randomness, so postmen don't all try again at
+    once.
+
+    Args:
+        error (Exception): Error from the failed attempt.
+        attempt (int): Number of attempts already failed, less one.
+        retries (int): Most times to try again.
+        backoff (float): Seconds to wait before the first retry, on average.
+
+    Yields:
+        Seconds to wait before trying again, or None to give up.
+    """
+    if attempt >= retries:
+        return None
+    if isinstance(error, smtplib.SMTPResponseException):
+        transient = 400 <= error.smtp_code < 500
+    elif isinstance(error, smtplib.SMTPRecipientsRefused):
+        transient = all(400 <= code < 500 for code, _ in
+                        error.recipients.values())
+    elif isinstance(error, urllib.error.HTTPError):
+        transient = error.code == 429 or error.code >= 500
+    else:
+        transient = isinstance(error, (smtplib.SMTPServerDisconnected,
+                                       ConnectionError, TimeoutError,
+                                       urllib.error.URLError))
+    if not transient:
+        return None
+    return backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+
+
+def throttle_reply(error):
+    """Check if an error is the email server asking to slow down
+
+    Email servers ask senders to slow down with temporary 4xx replies, with
+    an enhanced status code of 4.7.x, e.g. Gmail's "421 4.7.0 Try again
+    later", or 4.2.1, e.g. "450 4.2.1 receiving mail too quickly", or with a
+    421 reply, closing the connection.
+
+    Args:
+        error (Exception): Error from a failed letter.
+
+    Yields:
+        True if the email server asked to slow down, otherwise False.
+    """
+    if isinstance(error, smtplib.SMTPResponseException):
+        replies = [(error.smtp_code, error.smtp_error)]
+    elif isinstance(error, smtplib.SMTPRecipientsRefused):
+        replies = list(error.recipients.values())
+    else:
+        return False
+    return any(code == 421 or (400 <= code < 500 and
+                               THROTTLE_REPLY.match(reply) is not None)
+               for code, reply in replies)
+
+
+class SantasPacer:
+    """Token bucket that paces letters to the email server's limits
+
+    Letters are paced at up to "per_minute" letters per minute, with a short
+    burst allowed, and no more than "per_day" letters are sent in any 24 hours.
+    When the email server asks to slow down, the rate is halved, and while
+    letters are sent without complaint, the rate creeps back up again, so
+    letters are sent at close to the fastest rate the email server will accept.
+
+    Each letter reserves a slot with "reserve", or "acquire", and once it's
+    sent, is stamped with "stamp", or if it fails, gives its slot back with
+    "release", so failed, and retried letters don't use up the daily limit.
+    The time of every letter stamped is appended to the "ledger" file, so the
+    daily limit holds across runs, e.g. a second run on the same day only sends
+    what's left of the limit. Times more than 24 hours old are dropped when the
+    ledger is loaded.
+
+    Args:
+        per_minute (float): Most letters to send per minute, or None for no
+            limit, other than what the email server will accept.
+        per_day (int): Most letters to send in any 24 hours, or None for no
+            limit.
+        ledger (str): If given, path to a file of the times letters were
+            sent, kept between runs. Otherwise, the daily limit only counts
+            letters sent in this run.
+        rate (float): Letters per second to start at if there's no
+            "per_minute" limit.
+        burst (float): Most letters to send at once after a quiet spell.
+        floor (float): Slowest rate, in letters per second.
+        cooldown (float): Seconds after slowing down before slowing down again,
+            so a flurry of replies from letters already sent only counts once.
+
+    Attributes:
+        ceiling (float): Fastest rate, in letters per second.
+        posted (int): Number of letters paced so far in this run.
+        stamps (collections.deque): Times, in seconds since the epoch, of the
+            letters sent, or still being sent in the last 24 hours, oldest
+            first.
+    """
+
+    def __init__(self, per_minute=None, per_day=None, rate=10.0, burst=1.0,
+                 floor=0.1, cooldown=1.0, ledger=None):
+        self.per_day = per_day
+        self.ledger = ledger
+        self.stamps = collections.deque()
+        self.ceiling = per_minute / 60 if per_minute else math.inf
+        self.rate = self.ceiling if per_minute else rate
+        self.burst = burst
+        self.floor = floor
+        self.cooldown = cooldown
+        self.posted = 0
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.slowed = -math.inf
+        self.lock = threading.Lock()
+
+        # Load the times of letters sent in the last 24 hours, and rewrite
+        # the ledger without any older ones, in one go
+        if ledger is not None and os.path.exists(ledger):
+            since = time.time() - 86400
+            with open(ledger, "r") as f:
+                self.stamps.extend(sorted(float(line) for line in f if
+                                          line.strip() and
+                                          float(line) > since))
+            with open(ledger + ".tmp", "w") as f:
+                f.writelines(repr(stamp) + "\n" for stamp in self.stamps)
+            os.replace(ledger + ".tmp", ledger)
+
+    def reserve(self):
+        """Reserve the next letter's slot, which must then be stamped, or
+        released
+
+        Yields:
+            Seconds to wait before sending the letter.
+
+        Raises:
+            RuntimeError: If the letter would go over the daily limit.
+        """
+        with self.lock:
+            # Forget letters sent more than 24 hours ago, and refuse the
+            # letter if the limit is reached, counting letters still being
+            # sent, saying when the next is allowed
+            now = time.time()
+            self.forget_stamps(now)
+            if self.per_day is not None and len(self.stamps) >= self.per_day:
+                raise RuntimeError(
+                    "Santa's out of stamps for today! [Limit of " +
+                    str(self.per_day) + " letters a day reached, next " +
+                    "letter at " + time.strftime(
+                        "%Y-%m-%d %H:%M", time.localtime(
+                            self.stamps[-self.per_day] + 86400)) + "]")
+            self.posted += 1
+
+            # Hold the letter's stamp, if there's a daily limit, until it's
+            # sent, or released
+            if self.per_day is not None:
+                self.stamps.append(now)
+
+            # Top up the token bucket for the time passed, and take a token.
+            # If there aren't any left, wait until there would be
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) *
+                              self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self):
+        """Wait for the next letter's slot"""
+        time.sleep(self.reserve())
+
+    def stamp(self):
+        """Stamp a letter once it's been sent, keeping the stamp in the
+        ledger, if there is one"""
+        if self.ledger is not None:
+            with self.lock:
+                with open(self.ledger, "a") as f:
+                    f.write(repr(time.time()) + "\n")
+
+    def release(self):
+        """Give back a letter's slot if it couldn't be sent, so it doesn't
+        count towards the daily limit"""
+        with self.lock:
+            if self.per_day is not None and self.stamps:
+                self.stamps.pop()
+
+    def out_of_stamps(self):
+        """Check if the daily limit has been reached
+
+        Yields:
+            True if no more letters can be sent in the next 24 hours, e.g. to
+            stop sending, rather than have every letter left refused.
+        """
+        with self.lock:
+            self.forget_stamps(time.time())
+            return self.per_day is not None and len(self.stamps) >= self.per_day
+
+    def forget_stamps(self, now):
+        """Forget letters sent more than 24 hours before "now". Call with the
+        lock held"""
+        while self.stamps and self.stamps[0] <= now - 86400:
+            self.stamps.popleft()
+
+    def slow_down(self):
+        """Halve the rate, after the email server asks to slow down"""
+        with self.lock:
+            now = time.monotonic()
+            if now - self.slowed < self.cooldown:
+                return
+            self.slowed = now
+            self.rate = max(self.floor, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+            if santas_stopwatch is not None:
+                santas_stopwatch.count("slow_downs")
+
+    def speed_up(self):
+        """Creep the rate back up, by about one letter per second every second,
+        after a letter is sent without complaint"""
+        with self.lock:
+            self.rate = min(self.ceiling, self.rate + 1 / self.rate)
+
+
+def write_timed_letter(letter_skeleton, giver_mailbox, giver, receiver):
+    """Write a letter with a random festive GIF, timing it if
+    "santas_stopwatch" is set
+
+    Args:
+        letter_skeleton (LetterSkeleton): Skeleton to write the letter from.
+        giver_mailbox (str): The giver's email address.
+        giver (str): The giver's name.
+        receiver (str): The receiver's name.
+
+    Yields:
+        santas_letter (str): The letter, ready to send.
+    """
+    santas_picture = mime_giphy()
+    if santas_stopwatch is None:
+        return letter_skeleton.write(giver_mailbox, giver, receiver,
+                                     santas_picture)
+    written = time.perf_counter()
+    santas_letter = letter_skeleton.write(giver_mailbox, giver, receiver,
+                                          santas_picture)
+    santas_stopwatch.observe("letter", time.perf_counter() - written)
+    return santas_letter
+
+
+def send_timed_letter(santas_server, santas_mailbox, giver_mailbox,
+                      santas_letter):
+    """Send a letter, timing it, and counting it if "santas_stopwatch" is set
+
+    Args:
+        santas_server (smtplib.SMTP): Connection to the email server.
+        santas_mailbox (str): The outgoing email address.
+        giver_mailbox (str): The giver's email address.
+        santas_letter (str): The letter to send.
+    """
+    if santas_stopwatch is None:
+        santas_server.sendmail(santas_mailbox, giver_mailbox, santas_letter)
+        return
+    sent = time.perf_counter()
+    santas_server.sendmail(santas_mailbox, giver_mailbox, santas_letter)
+    santas_stopwatch.observe("smtp", time.perf_counter() - sent)
+    santas_stopwatch.count("letters_sent")
+    santas_stopwatch.count("bytes_sent", len(santas_letter))
+
+
+def call_postman(santas_mailbox, sleighs, santa_pairings,
+                 host="smtp.gmail.com", port=587, tls=True, journal=None,
+                 retries=2, backoff=0.5, pacer=None):
+    """Call the postman, and post Santa's instructions to all Secret Santas
+
+    Generate an email message based on the plain text, and HTML templates.
+    Populate this message with the randomly-assigned receiver's name, the
+    random, festive GIF and its link.
+
+    Then email this to the randomly selected Secret Santa using a Gmail account.
+    Requires Gmail account, and password. Account must be set to allow less
+    secure apps, or, if using two-step verification, an app password must be
+    used instead.
+
+    Args:
+        santas_mailbox (str): A valid email address corresponding to the Gmail
+            account.
+        sleighs (dict): Dictionary with names as keys, and email addresses as
+            items.
+        santa_pairings (dict): Dictionary with giver names as keys, and email
+            addresses as items.
+        host (str): Email server to connect to, e.g. a local SMTP sink.
+        port (int): Port of the email server.
+        tls (bool): If True, upgrade the connection with STARTTLS before
+            logging in.
+        journal (SantasJournal): If given, record each letter sent here.
+        retries (int): Most times to try a letter again after a temporary
+            failure, reconnecting if the connection has dropped.
+        backoff (float): Seconds to wait before the first retry, on average.
+        pacer (SantasPacer): If given, pace letters to the email server's
+            limits.
 
     Yields:
         A sent email message for each Secret Santa, notifying them of their
         randomly assigned gift receiver.
+        deliveries (dict): Dictionary with giver names as keys, and tuples of
+            the delivery status, i.e. "sent" or the error message, and the
+            seconds taken to write, and send their letter as items, like
+            "call_postmen". If the daily limit of "pacer" is reached, the
+            letters left aren't sent, or included.
+    """
+    # Get the plain text, and HTML email templates
+    plain_body = import_template(".txt", "./templates")
+    html_body = import_template(".html", "./templates", "utf8")
+
+    # Build the parts of the letters that are the same for everyone once
+    letter_skeleton = LetterSkeleton(santas_mailbox, plain_body, html_body)
+
+    # Open a connection to the email server, kept in a postbag, so it can be
+    # reopened if it drops
+    postbag = types.SimpleNamespace(
+        santas_server=open_post_office(santas_mailbox, host, port, tls))
+
+    # Initialise a storage dictionary for the delivery of each letter
+    deliveries = {}
+
+    # Iterate through each Secret Santa giver, and send them an email with
+    # their selected receiver
+    for giver in santa_pairings:
+        posted = time.perf_counter()
+
+        # Extract the giver's email address, and their receiver
+        giver_mailbox = sleighs[giver]
+        receiver = santa_pairings[giver]
+
+        print("Sending letter to a Secret Santa...")
+
+        # Write the giver's letter once, with a random festive GIF, and send
+        # it, trying again after any temporary failures, and recording any
+        # letter that couldn't be sent, rather than stopping
+        delivery = deliver_letter(
+            postbag, santas_mailbox, giver_mailbox,
+            lambda: write_timed_letter(letter_skeleton, giver_mailbox, giver,
+                                       receiver), host, port, tls, retries,
+            backoff, pacer)
+        deliveries[giver] = (delivery, time.perf_counter() - posted)
+        if journal is not None:
+            journal.record_delivery(giver, delivery)
+
+        # Stop once the daily limit is reached, as every letter left would be
+        # refused too
+        if pacer is not None and delivery != "sent" and pacer.out_of_stamps():
+            print("Santa's out of stamps for today... [" +
+                  str(len(santa_pairings) - len(deliveries)) + " letter(s) " +
+                  "left for another day]")
+            break
+
+    # Exit the server, ignoring a connection that has already dropped
+    if postbag.santas_server is not None:
+        try:
+            postbag.santas_server.quit()
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            pass
+
+    # Return the delivery status of each letter
+    return deliveries
+
+
+def call_postmen(santas_mailbox, sleighs, santa_pairings, postmen=4,
+                 host="smtp.gmail.com", port=587, tls=True, journal=None,
+                 retries=2, backoff=0.5, pacer=None):
+    """Call several postmen to post Santa's instructions in parallel
+
+    Parallel version of "call_postman". A pool of "postmen" threads each keep
+    their own authenticated connection to the email server, so letters are
+    written, and sent over several connections at once. If a postman's
+    connection drops, e.g. the server limits the number of letters per
+    connection, they reconnect, and try the letter again once.
+
+    Args:
+        santas_mailbox (str): A valid email address corresponding to the Gmail
+            account.
+        sleighs (dict): Dictionary with names as keys, and email addresses as
+            items.
+        santa_pairings (dict): Dictionary with giver names as keys, and
+            receiver names as items.
+        postmen (int): Number of connections, and threads, to send with.
+        host (str): Email server to connect to.
+        port (int): Port of the email server.
+        tls (bool): If True, upgrade each connection with STARTTLS before
+            logging in.
+        journal (SantasJournal): If given, record each letter's delivery here.
+        retries (int): Most times to try a letter again after a temporary
+            failure.
+        backoff (float): Seconds to wait before the first retry, on average.
+        pacer (SantasPacer): If given, pace letters to the email server's
+            limits.
+
+    Yields:
+        deliveries (dict): Dictionary with giver names as keys, and tuples of
+            the delivery status, i.e. "sent" or the error message, and the
+            seconds taken to write, and send their letter as items.
+    """
+    # Address each letter, and send them all using the pool of postmen
+    return post_letters(santas_mailbox, {giver: (sleighs[giver], giver,
+                                                 santa_pairings[giver])
+                                         for giver in santa_pairings},
+                        postmen, host, port, tls, journal, retries, backoff,
+                        pacer)
+
+
+def deliver_letter(postbag, santas_mailbox, giver_mailbox, write,
+                   host="smtp.gmail.com", port=587, tls=True, retries=2,
+                   backoff=0.5, pacer=None, opened=None):
+    """Send a single letter over a postman's connection, reconnecting once if
+    the connection has dropped, and trying again after any temporary failures
+
+    Shared by "call_postman", "post_letters", "LetterPipeline", and
+    "replay_spool". The letter
+    is only written once, so trying it again doesn't download another GIF.
+
+    Args:
+        postbag (object): Holder of the postman's connection, as its
+            "santas_server" attribute, or None to connect when first needed.
+            Any new connection is left there for the postman's next letter.
+        santas_mailbox (str): A valid email address corresponding to the Gmail
+            account.
+        giver_mailbox (str): The giver's email address.
+        write (function): Function returning the letter to send.
+        host (str): Email server to connect to.
+        port (int): Port of the email server.
+        tls (bool): If True, upgrade each connection with STARTTLS before
+            logging in.
+        retries (int): Most times to try the letter again after a temporary
+            failure.
+        backoff (float): Seconds to wait before the first retry, on average.
+        pacer (SantasPacer): If given, pace letters to the email server's
+            limits.
+        opened (function): If given, called with each new connection, e.g. to
+            close them all at the end.
+
+    Yields:
+        delivery (str): Delivery status, i.e. "sent" or the error message.
+    """
+    santas_letter = None
+    for retry in range(retries + 1):
+        try:
+            if santas_letter is None:
+                santas_letter = write()
+            for attempt in range(2):
+                try:
+                    if getattr(postbag, "santas_server", None) is None:
+                        postbag.santas_server = open_post_office(
+                            santas_mailbox, host, port, tls)
+                        if opened is not None:
+                            opened(postbag.santas_server)
+                    if pacer is not None:
+                        pacer.acquire()
+                    try:
+                        send_timed_letter(postbag.santas_server,
+                                          santas_mailbox, giver_mailbox,
+                                          santas_letter)
+                    except Exception:
+                        if pacer is not None:
+                            pacer.release()
+                        raise
+                    if pacer is not None:
+                        pacer.stamp()
+                        pacer.speed_up()
+                    break
+                except (smtplib.SMTPServerDisconnected, ConnectionError):
+                    postbag.santas_server = None
+                    if attempt == 1:
+                        raise
+            delivery = "sent"
+            break
+        except Exception as e:
+            delivery = repr(e)
+            if pacer is not None and throttle_reply(e):
+                pacer.slow_down()
+            delay = retry_delay(e, retry, retries, backoff)
+            if delay is None:
+                break
+            if santas_stopwatch is not None:
+                santas_stopwatch.count("retries")
+            time.sleep(delay)
+    if santas_stopwatch is not None and delivery != "sent":
+        santas_stopwatch.count("letters_lost")
+
+    # Return the delivery status of the letter
+    return delivery
+
+
+def post_letters(santas_mailbox, santas_letters, postmen=4,
+                 host="smtp.gmail.com", port=587, tls=True, journal=None,
+                 retries=2, backoff=0.5, pacer=None):
+    """Write, and send addressed letters over a pool of postmen
+
+    Shared by "call_postmen", and "secret_santa_batch", so letters for several
+    groups of Secret Santas can be sent over the same connections.
+
+    Args:
+        santas_mailbox (str): A valid email address corresponding to the Gmail
+            account.
+        santas_letters (dict): Dictionary with a unique key for each letter,
+            e.g. the giver's name, as keys, and tuples of the giver's email
+            address, the giver's name, and their receiver's name as items.
+        postmen (int): Number of connections, and threads, to send with.
+        host (str): Email server to connect to.
+        port (int): Port of the email server.
+        tls (bool): If True, upgrade each connection with STARTTLS before
+            logging in.
+        journal (SantasJournal): If given, record each letter's delivery here,
+            by its key.
+        retries (int): Most times to try a letter again after a temporary
+            failure.
+        backoff (float): Seconds to wait before the first retry, on average.
+        pacer (SantasPacer): If given, pace letters to the email server's
+            limits.
+
+    Yields:
+        deliveries (dict): Dictionary with the keys of "santas_letters" as
+            keys, and tuples of the delivery status, i.e. "sent" or the error
+            message, and the seconds taken to write, and send the letter as
+            items.
+    """
+    # Get the plain text, and HTML email templates
+    plain_body = import_template(".txt", "./templates")
+    html_body = import_template(".html", "./templates", "utf8")
+
+    # Build the parts of the letters that are the same for everyone once
+    letter_skeleton = LetterSkeleton(santas_mailbox, plain_body, html_body)
+
+    # Each postman thread keeps its own connection. Keep track of all of
+    # them, so they can be closed at the end
+    postbags = threading.local()
+    post_offices = []
+    post_offices_lock = threading.Lock()
+
+    def keep_post_office(santas_server):
+        """Keep track of a new connection, to close it at the end"""
+        with post_offices_lock:
+            post_offices.append(santas_server)
+
+    def post_letter(letter_key):
+        """Write, and send a single letter using this thread's connection"""
+        posted = time.perf_counter()
+        giver_mailbox, giver, receiver = santas_letters[letter_key]
+        delivery = deliver_letter(
+            postbags, santas_mailbox, giver_mailbox,
+            lambda: write_timed_letter(letter_skeleton, giver_mailbox, giver,
+                                       receiver), host, port, tls, retries,
+            backoff, pacer, keep_post_office)
+        if journal is not None:
+            journal.record_delivery(letter_key, delivery)
+        return delivery, time.perf_counter() - posted
+
+    # Send all letters using the pool of postmen
+    print("Sending letters to " + str(len(santas_letters)) + " Secret " +
+          "Santas with " + str(postmen) + " postmen...")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=postmen) as pool:
+        deliveries = dict(zip(santas_letters, pool.map(post_letter,
+                                                       santas_letters)))
+
+    # Exit all servers, ignoring any connections that have already dropped
+    for santas_server in post_offices:
+        try:
+            santas_server.quit()
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            pass
+
+    # Return the delivery status of each letter
+    return deliveries
+
+
+class LetterPipeline:
+    """Pipeline of stages to fetch GIFs for, write, and send letters
+
+    Rather than each letter being fetched, written, and sent in turn, each
+    stage has its own workers, "fetchers", "writers", and "postmen", joined by
+    queues holding at most "depth" letters. So GIPHY, writing letters, and the
+    email server are all kept busy at once, a slow stage holds back the stages
+    before it, rather than letters piling up, and only a few queues' worth of
+    letters are ever in memory, however many Secret Santas there are.
+
+    How many letters are waiting in each queue shows which stage is holding
+    the others back, so the most each queue has held is kept, and set as
+    "queue_peak_<<<STAGE>>>" gauges in "santas_stopwatch".
+
+    Args:
+        santas_mailbox (str): A valid email address corresponding to the Gmail
+            account.
+        santas_letters (dict): Dictionary with a unique key for each letter as
+            keys, and tuples of the giver's email address, the giver's name,
+            and their receiver's name as items, like "post_letters".
+        fetchers (int): Number of threads fetching GIFs.
+        writers (int): Number of threads writing letters.
+        postmen (int): Number of connections, and threads, to send with.
+        depth (int): Most letters waiting in each queue.
+        host (str): Email server to connect to.
+        port (int): Port of the email server.
+        tls (bool): If True, upgrade each connection with STARTTLS before
+            logging in.
+        journal (SantasJournal): If given, record each letter's delivery here,
+            by its key.
+        retries (int): Most times to try a GIF, or a letter again after a
+            temporary failure.
+        backoff (float): Seconds to wait before the first retry, on average.
+        pacer (SantasPacer): If given, pace letters to the email server's
+            limits.
+
+    Attributes:
+        queues (dict): Dictionary with stage names, i.e. "fetch", "write", and
+            "send", as keys, and the queue of letters waiting for that stage
+            as items.
+        peaks (dict): Dictionary with stage names as keys, and the most
+            letters waiting in their queue as items.
+        deliveries (dict): Dictionary with the keys of "santas_letters" as
+            keys, and tuples of the delivery status, and the seconds taken as
+            items, like "post_letters".
+    """
+
+    stages = ("fetch", "write", "send")
+
+    def __init__(self, santas_mailbox, santas_letters, fetchers=8, writers=1,
+                 postmen=4, depth=64, host="smtp.gmail.com", port=587,
+                 tls=True, journal=None, retries=2, backoff=0.5, pacer=None):
+        self.santas_mailbox = santas_mailbox
+        self.santas_letters = santas_letters
+        self.workers = {"fetch": fetchers, "write": writers, "send": postmen}
+        self.post_office = (host, port, tls)
+        self.journal = journal
+        self.retries = retries
+        self.backoff = backoff
+        self.pacer = pacer
+        self.queues = {stage: queue.Queue(maxsize=depth) for stage in
+                       self.stages}
+        self.peaks = dict.fromkeys(self.stages, 0)
+        self.deliveries = {}
+        self.lock = threading.Lock()
+
+        # Build the parts of the letters that are the same for everyone once
+        self.letter_skeleton = LetterSkeleton(
+            santas_mailbox, import_template(".txt", "./templates"),
+            import_template(".html", "./templates", "utf8"))
+
+    def depths(self):
+        """Number of letters waiting in each stage's queue right now
+
+        Yields:
+            Dictionary with stage names as keys, and the number of letters
+            waiting as items.
+        """
+        return {stage: letters.qsize() for stage, letters in
+                self.queues.items()}
+
+    def put(self, stage, letter):
+        """Queue a letter for a stage, waiting if the queue is full, and keep
+        track of the most letters waiting"""
+        self.queues[stage].put(letter)
+        depth = self.queues[stage].qsize()
+        with self.lock:
+            if depth > self.peaks[stage]:
+                self.peaks[stage] = depth
+
+    def deliver(self, letter_key, delivery, posted):
+        """Record a letter's delivery, i.e. "sent" or the error message"""
+        with self.lock:
+            self.deliveries[letter_key] = (delivery,
+                                           time.perf_counter() - posted)
+        if self.journal is not None:
+            self.journal.record_delivery(letter_key, delivery)
+
+    def lose(self, letter_key, error, posted):
+        """Record a letter lost before it could be sent, counting it if
+        "santas_stopwatch" is set"""
+        if santas_stopwatch is not None:
+            santas_stopwatch.count("letters_lost")
+        self.deliver(letter_key, repr(error), posted)
+
+    def fetch(self):
+        """Fetch a GIF for each letter, trying again after any temporary
+        failures"""
+        for letter_key, posted in iter(self.queues["fetch"].get, None):
+            for retry in range(self.retries + 1):
+                try:
+                    self.put("write", (letter_key, posted, mime_giphy()))
+                    break
+                except Exception as e:
+                    delay = retry_delay(e, retry, self.retries, self.backoff)
+                    if delay is None:
+                        self.lose(letter_key, e, posted)
+                        break
+                    if santas_stopwatch is not None:
+                        santas_stopwatch.count("retries")
+                    time.sleep(delay)
+
+    def write(self):
+        """Write each letter with its GIF"""
+        for letter_key, posted, giphy in iter(self.queues["write"].get, None):
+            try:
+                written = time.perf_counter()
+                santas_letter = self.letter_skeleton.write(
+                    *self.santas_letters[letter_key], giphy)
+                if santas_stopwatch is not None:
+                    santas_stopwatch.observe("letter", time.perf_counter() -
+                                             written)
+            except Exception as e:
+                self.lose(letter_key, e, posted)
+                continue
+            self.put("send", (letter_key, posted, santas_letter))
+
+    def send(self):
+        """Send each letter over this postman's own connection with
+        "deliver_letter", reconnecting once if the connection has dropped, and
+        trying again after any temporary failures"""
+        postbag = types.SimpleNamespace(santas_server=None)
+        for letter_key, posted, santas_letter in iter(self.queues["send"].get,
+                                                      None):
+            giver_mailbox = self.santas_letters[letter_key][0]
+            delivery = deliver_letter(
+                postbag, self.santas_mailbox, giver_mailbox,
+                lambda: santas_letter, *self.post_office, self.retries,
+                self.backoff, self.pacer)
+            self.deliver(letter_key, delivery, posted)
+
+        # Exit the server, ignoring a connection that has already dropped
+        if postbag.santas_server is not None:
+            try:
+                postbag.santas_server.quit()
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                pass
+
+    def run(self):
+        """Fetch GIFs for, write, and send every letter through the pipeline
+
+        Yields:
+            deliveries (dict): Dictionary with the keys of "santas_letters" as
+                keys, and tuples of the delivery status, i.e. "sent" or the
+                error message, and the seconds taken from joining the
+                pipeline to being sent as items.
+        """
+        print("Sending letters to " + str(len(self.santas_letters)) +
+              " Secret Santas with " + str(self.workers["fetch"]) +
+              " fetchers, " + str(self.workers["write"]) + " writers, and " +
+              str(self.workers["send"]) + " postmen...")
+
+        # Start each stage's workers
+        workers = {stage: [threading.Thread(target=getattr(self, stage),
+                                            daemon=True) for _ in
+                           range(self.workers[stage])] for stage in
+                   self.stages}
+        for stage_workers in workers.values():
+            for worker in stage_workers:
+                worker.start()
+
+        # Feed every letter into the pipeline, then, once each stage has
+        # finished, tell the next stage's workers to stop once they're done
+        for letter_key in self.santas_letters:
+            self.put("fetch", (letter_key, time.perf_counter()))
+        for stage in self.stages:
+            for _ in workers[stage]:
+                self.queues[stage].put(None)
+            for worker in workers[stage]:
+                worker.join()
+
+        # Report the most letters waiting for each stage
+        print("Most letters waiting: " + ", ".join(
+            stage + " " + str(self.peaks[stage]) for stage in self.stages))
+        if santas_stopwatch is not None:
+            for stage in self.stages:
+                santas_stopwatch.gauge("queue_peak_" + stage,
+                                       self.peaks[stage])
+
+        # Return the delivery status of each letter, in the same order
+        return {letter_key: self.deliveries[letter_key] for letter_key in
+                self.santas_letters}
+
+
+def spool_letters(santas_mailbox, sleighs, santa_pairings, spool,
+                  spool_format="mbox"):
+    """Write Santa's letters to a spool on disk, instead of sending them
+
+    Write every letter straight into an mbox file, or a Maildir folder, so
+    letters can be written as fast as the disk allows, and sent later by
+    "replay_spool", e.g. when the email server is less busy. mbox spools are
+    written with large buffered writes, and "From " lines in letters are
+    escaped, as in the mboxrd format.
+
+    Args:
+        santas_mailbox (str): A valid email address corresponding to the Gmail
+            account.
+        sleighs (dict): Dictionary with names as keys, and email addresses as
+            items.
+        santa_pairings (dict): Dictionary with giver names as keys, and
+            receiver names as items.
+        spool (str): Path to the mbox file, which is added to if it exists, or
+            the Maildir folder, which is created if needed.
+        spool_format (str): Either "mbox", or "maildir".
+
+    Yields:
+        A letter in the spool for each Secret Santa, notifying them of their
+        randomly assigned gift receiver.
+    """
+    # Check Santa knows how to pack the spool
+    if spool_format not in ["mbox", "maildir"]:
+        sys.exit("Santa doesn't know that sack! [Spool format must be mbox, " +
+                 "or maildir]")
+
+    # Get the plain text, and HTML email templates
+    plain_body = import_template(".txt", "./templates")
+    html_body = import_template(".html", "./templates", "utf8")
+
+    # Build the parts of the letters that are the same for everyone once
+    letter_skeleton = LetterSkeleton(santas_mailbox, plain_body, html_body)
+
+    print("Spooling letters to " + str(len(santa_pairings)) + " Secret " +
+          "Santas...")
+
+    if spool_format == "maildir":
+        # Add each letter as a new file in the Maildir folder
+        santas_sack = mailbox.Maildir(spool, factory=None, create=True)
+        for giver in santa_pairings:
+            santas_sack.add(letter_skeleton.write(sleighs[giver], giver,
+                                                  santa_pairings[giver],
+                                                  mime_giphy()))
+    else:
+        # Add each letter to the end of the mbox file, after a "From " line,
+        # escaping any "From " lines in the letter, and ending with a blank line
+        with open(spool, "a", encoding="utf8", newline="\n",
+                  buffering=2 ** 20) as santas_sack:
+            for giver in santa_pairings:
+                santas_letter = letter_skeleton.write(sleighs[giver], giver,
+                                                      santa_pairings[giver],
+                                                      mime_giphy())
+                santas_sack.write("From " + santas_mailbox + " " +
+                                  time.asctime(time.gmtime()) + "\n" +
+                                  FROM_LINE.sub(r">\1", santas_letter) +
+                                  "\n")
+
+
+def read_spool(spool):
+    """Read Santa's letters from a spool on disk, one at a time
+
+    Args:
+        spool (str): Path to an mbox file, or a Maildir folder, as written by
+            "spool_letters".
+
+    Yields:
+        letter_key (str): Name of the letter in the spool.
+        santas_letter (str): Complete email message, ready to send.
+    """
+    # Read each file in a Maildir folder
+    if os.path.isdir(spool):
+        santas_sack = mailbox.Maildir(spool, factory=None, create=False)
+        for letter_key in santas_sack.iterkeys():
+            yield letter_key, santas_sack.get_bytes(letter_key).decode("utf8")
+        return
+
+    # Read an mbox file line by line, starting a new letter at each "From "
+    # line, and un-escaping any escaped "From " lines
+    with open(spool, "r", encoding="utf8", newline="\n") as santas_sack:
+        letter_lines, letters = None, 0
+        for line in santas_sack:
+            if line.startswith("From "):
+                if letter_lines is not None:
+                    yield str(letters), "".join(letter_lines[:-1])
+                letter_lines, letters = [], letters + 1
+            elif letter_lines is not None:
+                letter_lines.append(line[1:] if line.startswith(">") and
+                                    FROM_LINE.match(line[1:]) else line)
+        if letter_lines is not None:
+            yield str(letters), "".join(letter_lines[:-1])
+
+
+def replay_spool(santas_mailbox, spool, host="smtp.gmail.com", port=587,
+                 tls=True, pacer=None, journal=None, retries=2, backoff=0.5):
+    """Call the postman to send Santa's letters from a spool on disk
+
+    Stream each letter from a spool written by "spool_letters", and send it to
+    the recipient in its "To" header over a single connection, reconnecting,
+    and trying again like "post_letters". If there's a journal, letters it
+    says were already sent are skipped, so an interrupted replay can be run
+    again without resending them.
+
+    Args:
+        santas_mailbox (str): A valid email address corresponding to the Gmail
+            account.
+        spool (str): Path to an mbox file, or a Maildir folder.
+        host (str): Email server to connect to.
+        port (int): Port of the email server.
+        tls (bool): If True, upgrade the connection with STARTTLS before
+            logging in.
+        pacer (SantasPacer): If given, pace letters to the email server's
+            limits.
+        journal (str): If given, path to a journal of each letter's delivery,
+            by its name in the spool.
+        retries (int): Most times to try a letter again after a temporary
+            failure.
+        backoff (float): Seconds to wait before the first retry, on average.
+
+    Yields:
+        deliveries (dict): Dictionary with each letter's recipient, and name in
+            the spool as keys, and tuples of the delivery status, i.e. "sent"
+            or the error message, and the seconds taken to send it as items.
+    """
+    # Initialise a storage dictionary for the delivery of each letter, and
+    # only parse the headers of each letter
+    deliveries = {}
+    postbag = types.SimpleNamespace(santas_server=None)
+    letter_parser = email.parser.HeaderParser()
+
+    # Skip the letters already sent, and record each delivery, if there's a
+    # journal
+    santas_journal, delivered = None, set()
+    if journal:
+        delivered = SantasJournal.load_deliveries(journal)
+        if delivered:
+            print("Resuming! [" + str(len(delivered)) + " letter(s) " +
+                  "already sent]")
+        santas_journal = SantasJournal(journal)
+
+    print("Sending letters from " + spool + "...")
+
+    try:
+        for letter_key, santas_letter in read_spool(spool):
+            if letter_key in delivered:
+                continue
+            posted = time.perf_counter()
+            giver_mailbox = letter_parser.parsestr(santas_letter)["To"]
+            delivery = deliver_letter(postbag, santas_mailbox, giver_mailbox,
+                                      lambda: santas_letter, host, port, tls,
+                                      retries, backoff, pacer)
+            if santas_journal is not None:
+                santas_journal.record_delivery(letter_key, delivery)
+            deliveries[str(giver_mailbox) + " [" + letter_key + "]"] = (
+                delivery, time.perf_counter() - posted)
+    finally:
+        if santas_journal is not None:
+            santas_journal.close()
+
+    # Exit server, ignoring a connection that has already dropped
+    if postbag.santas_server is not None:
+        try:
+            postbag.santas_server.quit()
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            pass
+
+    # Return the delivery status of each letter
+    return deliveries
+
+
+async def fetch_url_async(url, redirects=3, timeout=30):
+    """Download a URL using asyncio streams
+
+    Minimal HTTP/1.1 client for GET requests, following redirects, and
+    supporting both "Content-Length", and chunked responses.
+
+    Args:
+        url (str): HTTP or HTTPS URL to download.
+        redirects (int): Maximum number of redirects to follow.
+        timeout (float): Seconds to wait for each response, like the
+            "GiphyClient", or None to wait for as long as it takes.
+
+    Yields:
+        Body of the response in bytes. If the response is an error, throws a
+        HTTPError, like "urllib.request.urlopen". If the response takes longer
+        than "timeout", throws a TimeoutError.
+    """
+    async def fetch_response():
+        """Send the request, and read the whole response"""
+        # Open a connection to the host, using TLS for HTTPS URLs
+        url_parts = urllib.parse.urlsplit(url)
+        https = url_parts.scheme == "https"
+        reader, writer = await asyncio.open_connection(
+            url_parts.hostname, url_parts.port or (443 if https else 80),
+            ssl=ssl.create_default_context() if https else None)
+
+        try:
+            # Send the request
+            target = (url_parts.path or "/") + ("?" + url_parts.query
+                                                if url_parts.query else "")
+            writer.write(("GET " + target + " HTTP/1.1\r\nHost: " +
+                          url_parts.netloc + "\r\nUser-Agent: " +
+                          "secret-santa-mailer\r\nConnection: close\r\n\r\n"
+                          ).encode("ascii"))
+            await writer.drain()
+
+            # Read the status line, and headers
+            _, status, reason = (await reader.readline()).decode(
+                "latin-1").rstrip("\r\n").split(" ", 2)
+            headers = {}
+            while True:
+                header = (await reader.readline()).decode("latin-1")
+                if header in ("\r\n", "\n", ""):
+                    break
+                name, _, value = header.partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            # Read the body, in chunks, by length, or until the connection
+            # closes
+            if headers.get("transfer-encoding", "").lower() == "chunked":
+                chunks = []
+                while True:
+                    chunk_size = int((await reader.readline()).split(
+                        b";")[0], 16)
+                    if chunk_size == 0:
+                        break
+                    chunks.append(await reader.readexactly(chunk_size))
+                    await reader.readline()
+                while (await reader.readline()) not in (b"\r\n", b"\n",
+                                                        b""):
+                    pass
+                body = b"".join(chunks)
+            elif "content-length" in headers:
+                body = await reader.readexactly(int(
+                    headers["content-length"]))
+            else:
+                body = await reader.read()
+        finally:
+            writer.close()
+
+        # Return the status, the headers, and the body of the response
+        return status, reason, headers, body
+
+    # Download the response, giving up if it stalls
+    status, reason, headers, body = await asyncio.wait_for(fetch_response(),
+                                                           timeout)
+
+    # Follow any redirects, and throw an error for any error responses
+    status = int(status)
+    if status in (301, 302, 303, 307, 308) and redirects > 0:
+        return await fetch_url_async(urllib.parse.urljoin(
+            url, headers["location"]), redirects - 1, timeout)
+    if status >= 400:
+        raise urllib.error.HTTPError(url, status, reason, headers, None)
+
+    # Return the body of the response
+    return body
+
+
+async def mime_giphy_async():
+    """Generate a MIME image from a random festive GIF from GIPHY, using
+    asyncio
+
+    Asyncio version of "mime_giphy", using "giphy_cache", "giphy_pool", and
+    "giphy_budget" in the same way. The GIF is downloaded straight into memory,
+    and only saved in "./images" if it's being added to the cache.
+
+    Yields:
+        A MIME image of the GIF, or None if it's only linked to, its GIPHY URL,
+        and its GIPHY ID.
+    """
+    # Share a GIF from the pool, if there is one
+    if giphy_pool is not None and giphy_pool.gifs:
+        if santas_stopwatch is not None:
+            santas_stopwatch.count("gifs_pooled")
+        return giphy_pool.pick()
+
+    # Wait for GIPHY, and its GIF hosts as long as the "giphy_client" would,
+    # and read, and write cached GIFs in threads, off the event loop
+    giphy_timeout = ({} if giphy_client is None else
+                     {"timeout": giphy_client.timeout})
+    loop = asyncio.get_running_loop()
+
+    # Invoke the GIPHY API to get JSON for a random festive GIF. If the cache
+    # has fallback turned on, don't wait too long, and use a cached GIF if
+    # GIPHY fails
+    fetched = time.perf_counter()
+    try:
+        giphy_data = json.loads(await asyncio.wait_for(fetch_url_async(
+            giphy_api_url + "?api_key=" + giphy_api_token +
+            "&tag=Merry+Christmas&rating=PG-13", **giphy_timeout), timeout=(
+            giphy_cache.timeout if giphy_cache and giphy_cache.fallback
+            else None)))
+        cached_gif = None
+    except (urllib.error.URLError, OSError, asyncio.TimeoutError) as e:
+        cached_gif = await loop.run_in_executor(
+            None, giphy_cache.random_gif) if (
+            giphy_cache and giphy_cache.serves_fallback(e)) else None
+        if cached_gif is None:
+            raise
+
+    if cached_gif is not None:
+        giphy_id, giphy_link, gif = cached_gif
+        giphy_sources = ["gifs_fallback"]
+        if giphy_budget is not None and giphy_budget.link_only:
+            if santas_stopwatch is not None:
+                santas_stopwatch.count("gifs_fallback")
+            return None, giphy_link, giphy_id
+    else:
+        # Get the GIPHY ID, and the GIF's renditions, best first
+        giphy_id = giphy_data["data"]["id"]
+        renditions = giphy_renditions(giphy_data)
+        full_size = (renditions[0][2] if renditions[0][0] ==
+                     GIPHY_RENDITIONS[0] else None)
+
+        # Only link to the GIF, without downloading it, if asked
+        if giphy_budget is not None and giphy_budget.link_only:
+            giphy_budget.record(full_size, 0)
+            if santas_stopwatch is not None:
+                santas_stopwatch.count("gifs_linked")
+                santas_stopwatch.observe("giphy",
+                                         time.perf_counter() - fetched)
+            return None, renditions[0][1], giphy_id
+
+        # Try each rendition that might fit in the budget, if there is one,
+        # otherwise only the best rendition
+        if giphy_budget is not None:
+            renditions = giphy_budget.shortlist(renditions)
+        else:
+            renditions = renditions[:1]
+        giphy_sources = []
+        for rendition, giphy_link, _ in renditions:
+
+            # Use the cached GIF if there is one, otherwise download the GIF
+            giphy_key = (giphy_id if rendition == GIPHY_RENDITIONS[0] else
+                         giphy_id + "_" + rendition)
+            gif = await loop.run_in_executor(
+                None, giphy_cache.get, giphy_key) if giphy_cache else None
+            giphy_sources.append("gifs_cached")
+            if gif is None:
+                gif = await fetch_url_async(giphy_link, **giphy_timeout)
+                giphy_sources[-1] = "gifs_downloaded"
+
+                # Add the GIF to the cache
+                if giphy_cache:
+                    await loop.run_in_executor(None, giphy_cache.keep,
+                                               giphy_key, giphy_link, gif)
+
+            # Stop at the first rendition that fits
+            if rendition == GIPHY_RENDITIONS[0] and full_size is None:
+                full_size = len(gif)
+            if giphy_budget is None or giphy_budget.fits(len(gif)):
+                break
+        if giphy_budget is not None:
+            giphy_budget.record(full_size, len(gif))
+    if santas_stopwatch is not None:
+        for giphy_source in giphy_sources:
+            santas_stopwatch.count(giphy_source)
+        santas_stopwatch.observe("giphy", time.perf_counter() - fetched)
+
+    # Create a MIME image, with a Content ID
+    santas_picture = SantasPicture(gif)
+    santas_picture.add_header("Content-ID", ("<" + giphy_id + ">"))
+
+    # Return the MIME image, the GIPHY URL, and the GIPHY ID
+    return santas_picture, giphy_link, giphy_id
+
+
+async def smtp_command_async(post_office, command, expected):
+    """Send a SMTP command, and check the reply, using asyncio streams
+
+    Args:
+        post_office (tuple): Stream reader, and writer connected to the email
+            server.
+        command (str): Command to send. If None, only read a reply, e.g. the
+            server's greeting.
+        expected (tuple): Reply codes that mean the command worked.
+
+    Yields:
+        Text of the server's reply. If the reply code isn't expected, throws a
+        SMTPResponseException, and if the server hangs up, throws a
+        SMTPServerDisconnected.
+    """
+    reader, writer = post_office
+
+    # Send the command
+    if command is not None:
+        writer.write(command.encode("utf8") + b"\r\n")
+        await writer.drain()
+
+    # Read all lines of the reply
+    reply_lines = []
+    while True:
+        reply_line = await reader.readline()
+        if not reply_line:
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly " +
+                                                 "closed")
+        reply_lines.append(reply_line[4:].strip())
+        if reply_line[3:4] != b"-":
+            break
+
+    # Check the reply code
+    reply_code = int(reply_line[:3])
+    if reply_code not in expected:
+        raise smtplib.SMTPResponseException(reply_code,
+                                            b"\n".join(reply_lines))
+
+    # Return the text of the reply
+    return b"\n".join(reply_lines)
+
+
+async def open_post_office_async(santas_mailbox, host="smtp.gmail.com",
+                                 port=587, tls=True):
+    """Open an authenticated connection to the email server, using asyncio
+
+    Asyncio version of "open_post_office".
+
+    Args:
+        santas_mailbox (str): A valid email address corresponding to the Gmail
+            account.
+        host (str): Email server to connect to.
+        port (int): Port of the email server.
+        tls (bool): If True, upgrade the connection with STARTTLS before
+            logging in.
+
+    Yields:
+        post_office (tuple): Stream reader, and writer of the logged-in
+            connection to the email server.
+    """
+    # Open a connection to the email server, and say hello
+    post_office = await asyncio.open_connection(host, port)
+    await smtp_command_async(post_office, None, (220,))
+    await smtp_command_async(post_office, "EHLO " + socket.getfqdn(), (250,))
+
+    # Upgrade the connection with STARTTLS, and say hello again
+    if tls:
+        await smtp_command_async(post_office, "STARTTLS", (220,))
+        await post_office[1].start_tls(ssl.create_default_context())
+        await smtp_command_async(post_office, "EHLO " + socket.getfqdn(),
+                                 (250,))
+
+    # Log in
+    await smtp_command_async(post_office, "AUTH PLAIN " + base64.b64encode(
+        ("\0" + santas_mailbox + "\0" + santas_key).encode("utf8")).decode(
+        "ascii"), (235,))
+
+    # Return the connection
+    return post_office
+
+
+async def sendmail_async(post_office, santas_mailbox, giver_mailbox,
+                         santas_letter):
+    """Send a letter over an open connection, using asyncio
+
+    Args:
+        post_office (tuple): Stream reader, and writer of a logged-in
+            connection to the email server.
+        santas_mailbox (str): Sender's email address.
+        giver_mailbox (str): Recipient's email address.
+        santas_letter (str): Letter to send, e.g. from "as_string".
+
+    Yields:
+        Nothing if the letter was sent. Otherwise, throws a SMTP error. If the
+        email server turned the letter away, the connection is reset for the
+        next letter, or closed if even that fails.
+    """
+    try:
+        await smtp_command_async(post_office, "MAIL FROM:<" + santas_mailbox +
+                                 ">", (250,))
+        await smtp_command_async(post_office, "RCPT TO:<" + giver_mailbox +
+                                 ">", (250, 251))
+        await smtp_command_async(post_office, "DATA", (354,))
+
+        # Use CRLF line endings, and double any full stops starting a line,
+        # like "smtplib.SMTP.sendmail"
+        santas_letter = re.sub(r"(?:\r\n|\n|\r(?!\n))", "\r\n",
+                               santas_letter)
+        santas_letter = re.sub(r"(?m)^\.", "..", santas_letter)
+        if not santas_letter.endswith("\r\n"):
+            santas_letter += "\r\n"
+        post_office[1].write(santas_letter.encode("ascii"))
+        await smtp_command_async(post_office, ".", (250,))
+    except smtplib.SMTPResponseException:
+        # Reset the connection, like "smtplib.SMTP.sendmail", so the email
+        # server doesn't refuse the next letter, and hang up if it won't
+        try:
+            await smtp_command_async(post_office, "RSET", (250,))
+        except (smtplib.SMTPException, ConnectionError):
+            post_office[1].close()
+        raise
+
+
+async def call_postman_async(santas_mailbox, sleighs, santa_pairings,
+                             postmen=4, fetchers=8, host="smtp.gmail.com",
+                             port=587, tls=True, journal=None, retries=2,
+                             backoff=0.5, pacer=None):
+    """Call the postman, and post Santa's instructions to all Secret Santas,
+    using asyncio
+
+    Asyncio version of "call_postmen". A pool of "postmen" plus "fetchers"
+    tasks take the letters in turn, so GIFs are downloaded, and letters sent
+    at the same time, while only that many letters are held in memory at
+    once, however many Secret Santas there are. A semaphore limits the number
+    of GIFs downloading at once to "fetchers", and a queue of "postmen"
+    connections limits the number of letters sending at once. If a connection
+    drops, it's reopened, and the letter is tried again once. Each letter is
+    only written once, so trying it again doesn't download another GIF.
+
+    Args:
+        santas_mailbox (str): A valid email address corresponding to the Gmail
+            account.
+        sleighs (dict): Dictionary with names as keys, and email addresses as
+            items.
+        santa_pairings (dict): Dictionary with giver names as keys, and
+            receiver names as items.
+        postmen (int): Number of connections to send letters over.
+        fetchers (int): Maximum number of GIFs to download at once.
+        host (str): Email server to connect to.
+        port (int): Port of the email server.
+        tls (bool): If True, upgrade each connection with STARTTLS before
+            logging in.
+        journal (SantasJournal): If given, record each letter's delivery here.
+        retries (int): Most times to try a letter again after a temporary
+            failure.
+        backoff (float): Seconds to wait before the first retry, on average.
+        pacer (SantasPacer): If given, pace letters to the email server's
+            limits.
+
+    Yields:
+        deliveries (dict): Dictionary with giver names as keys, and tuples of
+            the delivery status, i.e. "sent" or the error message, and the
+            seconds taken to write, and send their letter as items.
     """
     # Get the plain text, and HTML email templates
     plain_body = import_template(".txt", "./templates")
     html_body = import_template(".html", "./templates", "utf8")
 
-    # Open a connection to the email server, and send the email
-    santas_server = smtplib.SMTP("smtp.gmail.com", 587)
-    santas_server.ehlo()
-    santas_server.starttls()
-    santas_server.login(santas_mailbox, santas_key)
+    # Build the parts of the letters that are the same for everyone once
+    letter_skeleton = LetterSkeleton(santas_mailbox, plain_body, html_body)
 
-    # Iterate through each Secret Santa giver, and send them an email with
-    # their selected receiver
-    for giver in santa_pairings:
-        # Extract the giver's email address, and their receiver
+    # Limit the number of GIF downloads, and queue up the postmen, who only
+    # connect when they're first needed. Writing to the pacer's ledger, and
+    # the journal is done in threads, so other letters aren't held up
+    loop = asyncio.get_running_loop()
+    giphy_semaphore = asyncio.Semaphore(fetchers)
+    post_offices = asyncio.Queue()
+    for _ in range(postmen):
+        post_offices.put_nowait(None)
+
+    async def post_letter(giver):
+        """Write, and send a single giver's letter using the next free
+        connection, reconnecting once if the connection has dropped, and
+        trying again after any temporary failures"""
+        posted = time.perf_counter()
         giver_mailbox = sleighs[giver]
-        receiver = santa_pairings[giver]
+        santas_letter = None
+        for retry in range(retries + 1):
+            try:
+                # Download the GIF, and write the letter, unless it was
+                # already written for an earlier attempt
+                if santas_letter is None:
+                    async with giphy_semaphore:
+                        giphy = await mime_giphy_async()
+                    written = time.perf_counter()
+                    santas_letter = letter_skeleton.write(
+                        giver_mailbox, giver, santa_pairings[giver], giphy)
+                    if santas_stopwatch is not None:
+                        santas_stopwatch.observe("letter",
+                                                 time.perf_counter() - written)
+                post_office = await post_offices.get()
+                try:
+                    for attempt in range(2):
+                        try:
+                            if (post_office is not None and
+                                    post_office[1].is_closing()):
+                                post_office = None
+                            if post_office is None:
+                                post_office = await open_post_office_async(
+                                    santas_mailbox, host, port, tls)
+                            if pacer is not None:
+                                await asyncio.sleep(await loop.run_in_executor(
+                                    None, pacer.reserve))
+                            sent = time.perf_counter()
+                            try:
+                                await sendmail_async(
+                                    post_office, santas_mailbox,
+                                    giver_mailbox, santas_letter)
+                            except BaseException:
+                                # Give back the slot, even if cancelled
+                                if pacer is not None:
+                                    pacer.release()
+                                raise
+                            if pacer is not None:
+                                await loop.run_in_executor(None, pacer.stamp)
+                                pacer.speed_up()
+                            if santas_stopwatch is not None:
+                                santas_stopwatch.observe(
+                                    "smtp", time.perf_counter() - sent)
+                                santas_stopwatch.count("letters_sent")
+                                santas_stopwatch.count("bytes_sent",
+                                                       len(santas_letter))
+                            break
+                        except (smtplib.SMTPServerDisconnected,
+                                ConnectionError):
+                            if post_office is not None:
+                                post_office[1].close()
+                            post_office = None
+                            if attempt == 1:
+                                raise
+                finally:
+                    post_offices.put_nowait(post_office)
+                delivery = "sent"
+                break
+            except Exception as e:
+                delivery = repr(e)
+                if pacer is not None and throttle_reply(e):
+                    pacer.slow_down()
+                delay = retry_delay(e, retry, retries, backoff)
+                if delay is None:
+                    break
+                if santas_stopwatch is not None:
+                    santas_stopwatch.count("retries")
+                await asyncio.sleep(delay)
+        if santas_stopwatch is not None and delivery != "sent":
+            santas_stopwatch.count("letters_lost")
+        if journal is not None:
+            await loop.run_in_executor(None, journal.record_delivery, giver,
+                                       delivery)
+        return delivery, time.perf_counter() - posted
 
-        # Get a random festive GIF using the GIPHY API in a MIME image format
-        santas_picture, giphy_link, giphy_id = mime_giphy()
-
-        # To ensure the HTML version is preferential, first setup a mixed MIME
-        # message to contain the essentials, e.g. "From", "To", "Subject".
-        # Then generate an alternative MIME subpart to hold plain text, and HTML
-        # versions of the email. The plain text comes first to ensure HTML is
-        # preferential.
-        # As there is an embedded image in the HTML version, a related MIME
-        # section is added that is a subpart of the alternative MIME subpart.
-        # This ensures the HTML version is still preferential, and the embedded
-        # image is displayed.
-
-        # Initialise a mixed MIME message
-        santas_letter = MIMEMultipart("mixed")
-
-        # Attach required parts to the mixed part
-        santas_letter["From"] = santas_mailbox
-        santas_letter["To"] = giver_mailbox
-        santas_letter["Subject"] = "Secret Santa"
-
-        # Initialise an alternative subpart of the MIME message, and attach it
-        santas_letter_alt = MIMEMultipart("alternative")
-        santas_letter.attach(santas_letter_alt)
-
-        # Attach plain text body to the alternative part
-        santas_letter_alt.attach(MIMEText(plain_body.format(giver=giver,
-                                                            receiver=receiver,
-                                                            link=giphy_link),
-                                          "plain"))
-
-        # Initialise an related subpart of the alternative subpart of the MIME
-        # message, and attach it
-        santas_letter_rel = MIMEMultipart("related")
-        santas_letter_alt.attach(santas_letter_rel)
-
-        # Attach the HTML body, and santas_picture to the relative part
-        santas_letter_rel.attach(MIMEText(html_body.format(giver=giver,
-                                                           receiver=receiver,
-                                                           link=giphy_link,
-                                                           id=giphy_id),
-                                          "html"))
-        santas_letter_rel.attach(santas_picture)
+    async def postman_round(santas_sleigh):
+        """Post the next giver's letter, until there are none left"""
+        for giver in santas_sleigh:
+            deliveries[giver] = await post_letter(giver)
 
-        print("Sending letter to a Secret Santa...")
+    # Send the letters with a fixed pool of tasks sharing one iterator of
+    # givers, keeping the deliveries in the order of the pairings
+    print("Sending letters to " + str(len(santa_pairings)) + " Secret " +
+          "Santas with " + str(postmen) + " postmen...")
+    deliveries = dict.fromkeys(santa_pairings)
+    santas_sleigh = iter(santa_pairings)
+    await asyncio.gather(*[postman_round(santas_sleigh) for _ in
+                           range(min(postmen + fetchers,
+                                     len(santa_pairings)))])
+
+    # Exit all servers, ignoring any connections that have already dropped
+    while not post_offices.empty():
+        post_office = post_offices.get_nowait()
+        if post_office is not None and not post_office[1].is_closing():
+            try:
+                await smtp_command_async(post_office, "QUIT", (221,))
+            except (smtplib.SMTPException, ConnectionError):
+                pass
+            post_office[1].close()
+
+    # Return the delivery status of each letter
+    return deliveries
+
+
+def check_sleighs(santas, reindeers):
+    """Check everyone's ready
+
+    Args:
+        santas (list): List of Secret Santa names, or a "SantasRoster" of
+            Secret Santas, and their email addresses.
+        reindeers (list): List of email addresses. Ignored if "santas" is a
+            "SantasRoster".
+
+    Yields:
+        sleighs (dict): Dictionary with names as keys, and email addresses as
+            items, or the "SantasRoster". If any checks fail, exit the system,
+            and throw an error message.
+    """
+    # Create a dictionary of names and associated email addresses, unless
+    # they're already in a compact roster
+    if isinstance(santas, SantasRoster):
+        sleighs = santas
+        santas, reindeers = sleighs.santas, sleighs.reindeers
+    else:
+        sleighs = dict(zip(santas, reindeers))
+
+    # Run checks on the names and email addresses, inspecting them only once
+    sleighs_report = inspect_sleighs(santas, reindeers)
+    find_sleighs(santas, reindeers, sleighs, sleighs_report)
+    check_reindeers(sleighs, sleighs_report)
+
+    # Return the dictionary of names
+    return sleighs
+
+
+def draw_sleighs(santas, reindeers, exclusions=None, shards=None,
+                 workers=None, fair=True):
+    """Check everyone's ready, and randomly assign givers and receivers
+
+    Args:
+        santas (list): List of Secret Santa names, or a "SantasRoster" of
+            Secret Santas, and their email addresses.
+        reindeers (list): List of email addresses. Ignored if "santas" is a
+            "SantasRoster".
+        exclusions (dict): Dictionary with giver names as keys, and collections
+            of excluded receiver names as items. If given, Secret Santas are
+            paired avoiding these exclusions.
+        shards (int): If given, and there are no exclusions, draw in this many
+            shards over "workers" processes with "secret_santa_sharded".
+        workers (int): Number of processes to draw shards with. Defaults to
+            the number of CPUs.
+        fair (bool): If False, fall back to a draw where some pairings are
+            more likely than others, if the exclusions are too dense for a
+            fair one.
+
+    Yields:
+        sleighs (dict): Dictionary with names as keys, and email addresses as
+            items, or the "SantasRoster".
+        santa_pairings (dict): Dictionary with giver names as keys, and
+            receiver names as items.
+    """
+    # Run checks on the names and email addresses
+    drawn = time.perf_counter()
+    sleighs = check_sleighs(santas, reindeers)
+
+    # Pair Secret Santas with each other randomly, avoiding any exclusions
+    if exclusions:
+        santa_pairings = secret_santa_exclusions(sleighs, exclusions,
+                                                 fair=fair)
+    elif shards:
+        santa_pairings = secret_santa_sharded(sleighs, shards, workers)
+    else:
+        santa_pairings = secret_santa_derangement(sleighs)
+    if santas_stopwatch is not None:
+        santas_stopwatch.observe("draw", time.perf_counter() - drawn)
+
+    # Return the dictionary of names, and the pairings
+    return sleighs, santa_pairings
 
-        # Send email to sender
-        santas_server.sendmail(santas_mailbox, giver_mailbox,
-                               santas_letter.as_string())
 
-    # Exit server
-    santas_server.quit()
+def redraw_sleighs(santas, reindeers, journal, exclusions=None):
+    """Check everyone's ready, and repair the draw in a journal for the
+    Secret Santas who've joined, or left since
 
+    Args:
+        santas (list): List of Secret Santa names, or a "SantasRoster" of
+            Secret Santas, and their email addresses, including anyone joining,
+            and without anyone leaving.
+        reindeers (list): List of email addresses. Ignored if "santas" is a
+            "SantasRoster".
+        journal (str): Path to the journal of the earlier draw.
+        exclusions (dict): Dictionary with giver names as keys, and collections
+            of excluded receiver names as items.
+
+    Yields:
+        sleighs (dict): Dictionary with names as keys, and email addresses as
+            items, or the "SantasRoster".
+        santa_pairings (dict): Dictionary with giver names as keys, and
+            receiver names as items, for everyone.
+        delivered (set): Names of givers who were already sent the letter for
+            their receiver, at the same email address, so don't need another.
+    """
+    # Run checks on the names and email addresses, and load the earlier draw
+    drawn = time.perf_counter()
+    sleighs = check_sleighs(santas, reindeers)
+    old_sleighs, old_pairings, delivered = SantasJournal.load(journal)
+
+    # Repair the draw for everyone who's left, or joined
+    leavers = [santa for santa in old_pairings if santa not in sleighs]
+    joiners = [santa for santa in sleighs if santa not in old_pairings]
+    santa_pairings = repair_pairings(old_pairings, leavers, joiners,
+                                     exclusions)
+    if santas_stopwatch is not None:
+        santas_stopwatch.observe("draw", time.perf_counter() - drawn)
+
+    # Only keep letters already sent with the same receiver, to the same
+    # email address
+    delivered = {giver for giver in delivered if giver in sleighs and
+                 santa_pairings[giver] == old_pairings[giver] and
+                 sleighs[giver] == old_sleighs.get(giver)}
+    print("Redrawing! [" + str(len(joiners)) + " joined, " +
+          str(len(leavers)) + " left, " +
+          str(len(santa_pairings) - len(delivered)) + " letter(s) to send]")
+
+    # Return the dictionary of names, the pairings, and the letters that still
+    # hold
+    return sleighs, santa_pairings, delivered
+
+
+def sleighs_problems(sleighs_report):
+    """List the problems in a report that stop a draw
+
+    Args:
+        sleighs_report (dict): Report from "inspect_sleighs".
+
+    Yields:
+        problems (list): Messages for each problem that stops a draw, the same
+            as "find_sleighs", and "check_reindeers" exit with.
+    """
+    problems = []
+    if sleighs_report["impostors"]:
+        problems.append("There's an impostor! [All Secret Santas must be " +
+                        "unique]")
+    if sleighs_report["resting_santas"] > 0:
+        problems.append("Mrs Claus says some Secret Santas is resting by " +
+                        "the fireplace... [Missing " +
+                        str(sleighs_report["resting_santas"]) + " santa(s)]")
+    if sleighs_report["resting_reindeers"]:
+        problems.append("There are reindeer resting in the barn... [Missing " +
+                        str(len(sleighs_report["resting_reindeers"])) +
+                        " email address(es)]")
+    if sleighs_report["poorly_reindeers"]:
+        problems.append("There are poorly reindeer at the vet's... [" +
+                        str(len(sleighs_report["poorly_reindeers"])) +
+                        " invalid email address(es)]")
+    if not problems and sleighs_report["santas"] < 2:
+        problems.append("Not enough Secret Santas for the delivery! [Minimum " +
+                        "of two Secret Santas required]")
+    return problems
+
+
+def find_rosters(path):
+    """Find the groups of Secret Santas to draw for in a batch
+
+    Args:
+        path (str): Either a folder of roster CSV files, one per group, or a
+            manifest CSV file, with a header row, where the first column has
+            the path to each group's roster CSV file, and the optional second
+            column has the path to its exclusions CSV file. Paths in a manifest
+            are relative to the manifest's folder. In a folder, any
+            "<<<ROSTER>>>_exclusions.csv" file is used as the exclusions for
+            "<<<ROSTER>>>.csv".
+
+    Yields:
+        groups (list): List of tuples of each group's name, the path to its
+            roster, and the path to its exclusions, or None.
+    """
+    groups = []
+
+    if os.path.isdir(path):
+        # Use every roster in the folder, with its exclusions if there are any
+        rosters = sorted(roster for roster in os.listdir(path) if
+                         roster.endswith(".csv") and not
+                         roster.endswith("_exclusions.csv"))
+        for roster in rosters:
+            exclusions = os.path.join(path, roster[:-4] + "_exclusions.csv")
+            groups.append((roster[:-4], os.path.join(path, roster),
+                           exclusions if os.path.isfile(exclusions) else None))
+    elif os.path.isfile(path):
+        # Use every roster listed in the manifest, after the header row
+        manifest_folder = os.path.dirname(path)
+        with open(path, "r", newline="") as f:
+            chimneys = csv.reader(f, skipinitialspace=True)
+            next(chimneys, None)
+            for row in chimneys:
+                if not row or not row[0].strip():
+                    continue
+                roster = row[0].strip()
+                exclusions = row[1].strip() if len(row) > 1 else ""
+                groups.append((os.path.splitext(roster)[0],
+                               os.path.join(manifest_folder, roster),
+                               os.path.join(manifest_folder, exclusions) if
+                               exclusions else None))
+    else:
+        sys.exit("Santa can't find the rosters! [No folder, or manifest " +
+                 "called " + path + "]")
+
+    return groups
+
+
+def draw_group(group):
+    """Load, check, and draw a single group of Secret Santas in a batch
+
+    Run in a separate process by "draw_groups", so problems are reported,
+    rather than printed, or exiting the system.
+
+    Args:
+        group (tuple): The group's name, the path to its roster, and the path
+            to its exclusions, or None, as given by "find_rosters".
+
+    Yields:
+        drawn_group (dict): Dictionary with keys: "group" (str), the group's
+            name; "santas" (int), the number of Secret Santas; "twins" (int),
+            the number of duplicate email addresses; "sleighs" (dict), and
+            "pairings" (dict), as given by "draw_sleighs", or None if there
+            were problems; and "problems" (list), any messages for problems
+            that stopped the draw.
+    """
+    group_name, roster, exclusions = group
+    drawn_group = {"group": group_name, "santas": 0, "twins": 0,
+                   "sleighs": None, "pairings": None, "problems": []}
+    try:
+        # Load, and check the Secret Santas
+        santas, reindeers = [], []
+        for santa, reindeer in read_sleighs(roster):
+            santas.append(santa)
+            reindeers.append(reindeer)
+        sleighs_report = inspect_sleighs(santas, reindeers)
+        drawn_group["santas"] = len(santas)
+        drawn_group["twins"] = len(sleighs_report["twins"])
+        drawn_group["problems"] = sleighs_problems(sleighs_report)
+
+        # Draw, avoiding any exclusions, if there are no problems
+        if not drawn_group["problems"]:
+            sleighs = dict(zip(santas, reindeers))
+            if exclusions:
+                santa_pairings = secret_santa_exclusions(
+                    sleighs, load_exclusions(exclusions))
+            else:
+                santa_pairings = secret_santa_derangement(sleighs)
+            drawn_group["sleighs"] = sleighs
+            drawn_group["pairings"] = santa_pairings
+    except SystemExit as e:
+        drawn_group["problems"].append(str(e.code))
+    except OSError as e:
+        drawn_group["problems"].append("Santa can't open the roster! [" +
+                                       str(e) + "]")
+
+    # Return the group's draw, or its problems
+    return drawn_group
+
+
+def draw_groups(groups, workers=None):
+    """Load, check, and draw many groups of Secret Santas in parallel
+
+    Args:
+        groups (list): List of groups, as given by "find_rosters".
+        workers (int): Number of processes to draw with. Defaults to the
+            number of CPUs.
+
+    Yields:
+        drawn_groups (list): List of each group's draw, as given by
+            "draw_group", in the same order as "groups".
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(draw_group, groups))
+
+
+def check_deliveries(deliveries):
+    """Check every letter was delivered
+
+    Args:
+        deliveries (dict): Dictionary with giver names as keys, and tuples of
+            the delivery status, and seconds taken as items, as given by
+            "call_postmen".
+
+    Yields:
+        If any letters weren't sent, print the giver's name, and the error,
+        then exit the system, and throw an error message.
+    """
+    # Find, and print any letters that weren't sent
+    lost_letters = [giver for giver, (delivery, _) in deliveries.items()
+                    if delivery != "sent"]
+    for giver in lost_letters:
+        print("The postman couldn't reach " + giver + "... [" +
+              deliveries[giver][0] + "]")
+
+    # Throw an error message if any letters weren't sent
+    if len(lost_letters) != 0:
+        sys.exit("Some letters got lost in the snow... [" +
+                 str(len(lost_letters)) + " letter(s) not sent]")
+
+
+def ready_sleighs(santas, reindeers, exclusions=None, journal=None,
+                  resume=False, redraw=False, shards=None, workers=None,
+                  record=True, fair=True):
+    """Get the Secret Santas, and their pairings ready to send letters
+
+    Check the names and email addresses, and pair Secret Santas with each
+    other randomly, or pick up where an interrupted run left off, or repair an
+    earlier draw. Then check the user wants to send the letters, and open the
+    journal, recording the draw in it.
+
+    Args:
+        santas (list): List of Secret Santa names, or a "SantasRoster" of
+            Secret Santas, and their email addresses.
+        reindeers (list): List of email addresses. Ignored if "santas" is a
+            "SantasRoster".
+        exclusions (dict): Dictionary with giver names as keys, and collections
+            of excluded receiver names as items.
+        journal (str): If given, path to a journal of the draw, and every
+            letter's delivery.
+        resume (bool): If True, don't draw again, but get the letters in
+            "journal" that haven't been sent yet.
+        redraw (bool): If True, don't draw again, but repair the draw in
+            "journal" for the Secret Santas who've joined, or left, and only
+            get the letters that changed.
+        shards (int): If given, and there are no exclusions, draw in this many
+            shards over "workers" processes.
+        workers (int): Number of processes to draw shards with.
+        record (bool): If False, e.g. when spooling letters, don't open the
+            journal.
+        fair (bool): If False, fall back to a draw where some pairings are
+            more likely than others, if the exclusions are too dense for a
+            fair one.
+
+    Yields:
+        sleighs (dict): Dictionary with names as keys, and email addresses as
+            items.
+        secret_santa_pairings (dict): Dictionary with giver names as keys, and
+            receiver names as items, for the letters to send.
+        santas_journal (SantasJournal): Open journal to record each letter's
+            delivery in, or None if there's no journal.
+    """
+    # Pair Secret Santas with each other randomly, or pick up where an
+    # interrupted run left off, or repair an earlier draw, only sending the
+    # letters that changed
+    drawn_pairings, delivered = None, set()
+    if resume:
+        sleighs, secret_santa_pairings = resume_sleighs(journal)
+    elif redraw:
+        sleighs, drawn_pairings, delivered = redraw_sleighs(
+            santas, reindeers, journal, exclusions)
+        secret_santa_pairings = {giver: receiver for giver, receiver in
+                                 drawn_pairings.items()
+                                 if giver not in delivered}
+    else:
+        sleighs, secret_santa_pairings = draw_sleighs(santas, reindeers,
+                                                      exclusions, shards,
+                                                      workers, fair)
+
+    # Check that the user wants to send out the messages
+    continue_checker("Secret Santa randomisation complete! Time to call the " +
+                     "postman!", "OK, maybe next " + "time then!")
+
+    # Keep a journal of the draw, and each letter's delivery, if asked
+    santas_journal = SantasJournal(journal) if journal and record else None
+    if santas_journal is not None and not resume:
+        santas_journal.record_draw(sleighs, drawn_pairings if redraw else
+                                   secret_santa_pairings, delivered)
 
-def secret_santa_mailer(santas, reindeers, santas_mailbox):
+    # Return the Secret Santas, their pairings, and the journal
+    return sleighs, secret_santa_pairings, santas_journal
+
+
+def secret_santa_mailer(santas, reindeers, santas_mailbox, *, exclusions=None,
+                        postmen=1, host="smtp.gmail.com", port=587, tls=True,
+                        spool=None, spool_format="mbox", journal=None,
+                        resume=False, retries=2, pacer=None, pipeline=False,
+                        fetchers=8, writers=1, depth=64, redraw=False,
+                        shards=None, workers=None, fair=True):
     """Check everyone's ready, randomly assign givers and receivers, and send
     out letters
 
@@ -416,77 +4727,592 @@ def secret_santa_mailer(santas, reindeers, santas_mailbox):
     nested function to email and notify the Secret Santa.
 
     Args:
-        santas (list): List of Secret Santa names.
-        reindeers (list): List of email addresses.
+        santas (list): List of Secret Santa names, or a "SantasRoster" of
+            Secret Santas, and their email addresses.
+        reindeers (list): List of email addresses. Ignored if "santas" is a
+            "SantasRoster".
         santas_mailbox (str): A valid email address corresponding to the Gmail
             account.
+        exclusions (dict): Dictionary with giver names as keys, and collections
+            of excluded receiver names as items. If given, Secret Santas are
+            paired avoiding these exclusions.
+        postmen (int): Number of connections to send letters over in
+            parallel.
+        host (str): Email server to connect to.
+        port (int): Port of the email server.
+        tls (bool): If True, upgrade each connection with STARTTLS before
+            logging in.
+        spool (str): If given, write the letters to this mbox file, or Maildir
+            folder, to send later with "replay_spool", instead of sending them.
+        spool_format (str): Either "mbox", or "maildir".
+        journal (str): If given, path to a journal of the draw, and every
+            letter's delivery, so an interrupted run can be resumed.
+        resume (bool): If True, don't draw again, but send the letters in
+            "journal" that haven't been sent yet. "santas", and "reindeers"
+            are ignored.
+        retries (int): Most times to try a letter again after a temporary
+            failure.
+        pacer (SantasPacer): If given, pace letters to the email server's
+            limits.
+        pipeline (bool): If True, fetch GIFs for, write, and send letters in a
+            "LetterPipeline", with "fetchers", "writers", and "postmen"
+            threads, and queues of at most "depth" letters.
+        fetchers (int): Number of threads fetching GIFs in the pipeline.
+        writers (int): Number of threads writing letters in the pipeline.
+        depth (int): Most letters waiting in each of the pipeline's queues.
+        redraw (bool): If True, don't draw again, but repair the draw in
+            "journal" for the Secret Santas who've joined, or left, and only
+            send the letters that changed.
+        shards (int): If given, and there are no exclusions, draw in this many
+            shards over "workers" processes, for very large rosters.
+        workers (int): Number of processes to draw shards with. Defaults to
+            the number of CPUs.
+        fair (bool): If False, fall back to a draw where some pairings are
+            more likely than others, if the exclusions are too dense for a
+            fair one.
 
     Yields:
         A sent email message for each Secret Santa, notifying them of their
         randomly assigned gift receiver.
+        deliveries (dict): Dictionary with giver names as keys, and tuples of
+            the delivery status, and seconds taken as items, or None if the
+            letters were spooled.
     """
-    # Create a dictionary of names and associated email addresses
-    sleighs = dict(zip(secret_santas, secret_reindeers))
+    # Check the names and email addresses, and draw, resume, or redraw, only
+    # keeping a journal if the letters are being sent
+    sleighs, secret_santa_pairings, santas_journal = ready_sleighs(
+        santas, reindeers, exclusions=exclusions, journal=journal,
+        resume=resume, redraw=redraw, shards=shards, workers=workers,
+        record=not spool, fair=fair)
 
-    # Run checks on the names and email addresses
-    find_sleighs(santas, reindeers, sleighs)
-    check_reindeers(sleighs)
+    # Write the letters to a spool to send later, if asked
+    if spool:
+        spool_letters(santas_mailbox, sleighs, secret_santa_pairings, spool,
+                      spool_format)
+        print("All letters spooled to " + spool + " - Merry Christmas!")
+        return None
 
-    # Pair Secret Santas with each other randomly
-    secret_santa_pairings = secret_santa_randomiser(sleighs)
+    # Send emails out to the giver notifying them of their receiver, using
+    # several postmen in parallel, or a pipeline of stages if asked
+    posted = time.perf_counter()
+    try:
+        if pipeline:
+            deliveries = LetterPipeline(
+                santas_mailbox, {giver: (sleighs[giver], giver,
+                                         secret_santa_pairings[giver])
+                                 for giver in secret_santa_pairings},
+                fetchers, writers, postmen, depth, host, port, tls,
+                santas_journal, retries, pacer=pacer).run()
+            check_deliveries(deliveries)
+        elif postmen > 1:
+            deliveries = call_postmen(santas_mailbox, sleighs,
+                                      secret_santa_pairings, postmen, host,
+                                      port, tls, santas_journal, retries,
+                                      pacer=pacer)
+            check_deliveries(deliveries)
+        else:
+            deliveries = call_postman(santas_mailbox, sleighs,
+                                      secret_santa_pairings, host, port, tls,
+                                      santas_journal, retries, pacer=pacer)
+            check_deliveries(deliveries)
+    finally:
+        if santas_journal is not None:
+            santas_journal.close()
+        if santas_stopwatch is not None:
+            santas_stopwatch.observe("post", time.perf_counter() - posted)
 
-    # Check that the user wants to send out the messages
-    continue_checker("Secret Santa randomisation complete! Time to call the " +
-                     "postman!", "OK, maybe next " + "time then!")
+    print("All letters sent - Merry Christmas!")
+
+    # Return the delivery status of each letter
+    return deliveries
+
+
+def secret_santa_mailer_async(santas, reindeers, santas_mailbox, *,
+                              exclusions=None, postmen=4, fetchers=8,
+                              host="smtp.gmail.com", port=587, tls=True,
+                              journal=None, resume=False, retries=2,
+                              pacer=None, redraw=False, shards=None,
+                              workers=None, fair=True):
+    """Check everyone's ready, randomly assign givers and receivers, and send
+    out letters, using asyncio
+
+    Asyncio version of "secret_santa_mailer", where GIFs are downloaded, and
+    letters are sent at the same time by "call_postman_async", so the time
+    taken is closer to the slower of the two, rather than both added together.
+
+    Args:
+        santas (list): List of Secret Santa names, or a "SantasRoster" of
+            Secret Santas, and their email addresses.
+        reindeers (list): List of email addresses. Ignored if "santas" is a
+            "SantasRoster".
+        santas_mailbox (str): A valid email address corresponding to the Gmail
+            account.
+        exclusions (dict): Dictionary with giver names as keys, and collections
+            of excluded receiver names as items. If given, Secret Santas are
+            paired avoiding these exclusions.
+        postmen (int): Number of connections to send letters over.
+        fetchers (int): Maximum number of GIFs to download at once.
+        host (str): Email server to connect to.
+        port (int): Port of the email server.
+        tls (bool): If True, upgrade each connection with STARTTLS before
+            logging in.
+        journal (str): If given, path to a journal of the draw, and every
+            letter's delivery, so an interrupted run can be resumed.
+        resume (bool): If True, don't draw again, but send the letters in
+            "journal" that haven't been sent yet. "santas", and "reindeers"
+            are ignored.
+        retries (int): Most times to try a letter again after a temporary
+            failure.
+        pacer (SantasPacer): If given, pace letters to the email server's
+            limits.
+        redraw (bool): If True, don't draw again, but repair the draw in
+            "journal" for the Secret Santas who've joined, or left, and only
+            send the letters that changed.
+        shards (int): If given, and there are no exclusions, draw in this many
+            shards over "workers" processes, for very large rosters.
+        workers (int): Number of processes to draw shards with. Defaults to
+            the number of CPUs.
+        fair (bool): If False, fall back to a draw where some pairings are
+            more likely than others, if the exclusions are too dense for a
+            fair one.
+
+    Yields:
+        A sent email message for each Secret Santa, notifying them of their
+        randomly assigned gift receiver.
+        deliveries (dict): Dictionary with giver names as keys, and tuples of
+            the delivery status, and seconds taken as items.
+    """
+    # Check the names and email addresses, draw, resume, or redraw, and keep a
+    # journal if asked
+    sleighs, secret_santa_pairings, santas_journal = ready_sleighs(
+        santas, reindeers, exclusions=exclusions, journal=journal,
+        resume=resume, redraw=redraw, shards=shards, workers=workers,
+        fair=fair)
 
     # Send emails out to the giver notifying them of their receiver
-    call_postman(santas_mailbox, sleighs, secret_santa_pairings)
+    posted = time.perf_counter()
+    try:
+        deliveries = asyncio.run(call_postman_async(
+            santas_mailbox, sleighs, secret_santa_pairings, postmen, fetchers,
+            host, port, tls, santas_journal, retries, pacer=pacer))
+    finally:
+        if santas_journal is not None:
+            santas_journal.close()
+        if santas_stopwatch is not None:
+            santas_stopwatch.observe("post", time.perf_counter() - posted)
+    check_deliveries(deliveries)
 
     print("All letters sent - Merry Christmas!")
 
+    # Return the delivery status of each letter
+    return deliveries
+
+
+def secret_santa_batch(rosters, santas_mailbox, workers=None, postmen=4,
+                       host="smtp.gmail.com", port=587, tls=True, retries=2,
+                       pacer=None):
+    """Draw for many groups of Secret Santas at once, and send all the letters
+
+    Load, check, and draw each group in parallel over a pool of processes, then
+    send every group's letters over a shared pool of postmen, and summarise
+    each group at the end. Groups with problems are skipped, rather than
+    stopping the batch.
+
+    Args:
+        rosters (str): Folder of roster CSV files, or a manifest CSV file, as
+            used by "find_rosters".
+        santas_mailbox (str): A valid email address corresponding to the Gmail
+            account.
+        workers (int): Number of processes to draw with. Defaults to the number
+            of CPUs.
+        postmen (int): Number of connections to send letters over.
+        host (str): Email server to connect to.
+        port (int): Port of the email server.
+        tls (bool): If True, upgrade each connection with STARTTLS before
+            logging in.
+        retries (int): Most times to try a letter again after a temporary
+            failure.
+        pacer (SantasPacer): If given, pace letters to the email server's
+            limits.
+
+    Yields:
+        batch_summary (dict): Dictionary with group names as keys, and
+            dictionaries of the number of Secret Santas, letters "sent", and
+            "lost", and any "problems" as items.
+    """
+    # Load, check, and draw every group in parallel
+    groups = find_rosters(rosters)
+    print("Drawing " + str(len(groups)) + " groups of Secret Santas...")
+    drawn_groups = draw_groups(groups, workers)
+
+    # Print any problems, and check that the user wants to send out the
+    # messages
+    for drawn_group in drawn_groups:
+        for problem in drawn_group["problems"]:
+            print(drawn_group["group"] + ": " + problem)
+        if drawn_group["twins"]:
+            print(drawn_group["group"] + ": Some reindeers are twins! [" +
+                  str(drawn_group["twins"]) + " duplicate email address(es)]")
+    continue_checker("Secret Santa randomisation complete for " +
+                     str(sum(drawn_group["pairings"] is not None for
+                             drawn_group in drawn_groups)) + " of " +
+                     str(len(drawn_groups)) + " groups! Time to call the " +
+                     "postmen!", "OK, maybe next time then!")
+
+    # Address every group's letters, and send them all over the same postmen
+    santas_letters = {}
+    for drawn_group in drawn_groups:
+        if drawn_group["pairings"] is not None:
+            for giver, receiver in drawn_group["pairings"].items():
+                santas_letters[(drawn_group["group"], giver)] = (
+                    drawn_group["sleighs"][giver], giver, receiver)
+    posted = time.perf_counter()
+    deliveries = post_letters(santas_mailbox, santas_letters, postmen, host,
+                              port, tls, retries=retries, pacer=pacer)
+    if santas_stopwatch is not None:
+        santas_stopwatch.observe("post", time.perf_counter() - posted)
+
+    # Summarise each group, printing any letters that weren't sent
+    batch_summary = {drawn_group["group"]: {
+        "santas": drawn_group["santas"], "sent": 0, "lost": 0,
+        "problems": drawn_group["problems"]} for drawn_group in drawn_groups}
+    for (group_name, giver), (delivery, _) in deliveries.items():
+        if delivery == "sent":
+            batch_summary[group_name]["sent"] += 1
+        else:
+            batch_summary[group_name]["lost"] += 1
+            print("The postman couldn't reach " + giver + " in " + group_name +
+                  "... [" + delivery + "]")
+
+    print("\n{:<30} {:>10} {:>10} {:>10}".format("Group", "Santas", "Sent",
+                                                 "Lost"))
+    for group_name, group_summary in batch_summary.items():
+        print("{:<30} {:>10,} {:>10,} {:>10,}{}".format(
+            group_name, group_summary["santas"], group_summary["sent"],
+            group_summary["lost"], " (skipped)" if group_summary["problems"]
+            else ""))
+
+    # Return the summary of each group
+    return batch_summary
+
 
 # Standalone program execution
 if __name__ == '__main__':
 
-    # Gmail account for the Secret Santa mailbox, with validator
-    if re.search(r"(^[a-zA-Z0-9_.+-]+@gmail.com$)", sys.argv[1]) is None:
-        sys.exit("Nobody's home... [Invalid Gmail address]")
+    # Parse the command line arguments
+    santas_parser = argparse.ArgumentParser(description="Secret Santa " +
+                                            "double-blind mailer")
+    santas_parser.add_argument("mailbox", help="Outgoing Secret Santa Gmail " +
+                               "mailbox")
+    santas_parser.add_argument("csv", nargs="?", help="CSV file of Secret " +
+                               "Santa names, and their email addresses, or " +
+                               "with --batch, a folder, or manifest of them")
+    santas_parser.add_argument("keep_gifs", nargs="?", type=int, default=0,
+                               choices=[0, 1, 2],
+                               help="GIF cache policy: 0 to delete GIFs once " +
+                               "embedded, 1 to keep them in a cache, or 2 to " +
+                               "also use cached GIFs if GIPHY fails")
+    santas_parser.add_argument("--gif-cache-mb", type=float, default=50,
+                               help="Maximum size of the GIF cache in MB")
+    santas_parser.add_argument("--gif-pool", type=int,
+                               help="Fetch this many GIFs up front, and " +
+                               "share them between the letters")
+    santas_parser.add_argument("--gif-pool-order", default="random",
+                               choices=["random", "round-robin"],
+                               help="How pooled GIFs are given to letters")
+    santas_parser.add_argument("--gif-budget-kb", type=float,
+                               help="Most KB the GIF may add to each " +
+                               "letter, picking a smaller rendition, or a " +
+                               "still image if it's too big")
+    santas_parser.add_argument("--gif-link-only", action="store_true",
+                               help="Link to GIFs from the HTML, rather " +
+                               "than embedding them in letters")
+    santas_parser.add_argument("--gif-timeout", type=float, default=30,
+                               help="Seconds to wait for GIPHY, and its GIF " +
+                               "hosts, before trying again")
+    santas_parser.add_argument("--no-keep-alive", action="store_true",
+                               help="Open a new connection for every GIPHY " +
+                               "request, rather than keeping them alive")
+    santas_parser.add_argument("--exclusions", help="CSV file of givers, and " +
+                               "receivers they must not be paired with")
+    santas_parser.add_argument("--unfair-draw", action="store_true",
+                               help="With --exclusions, fall back to a draw " +
+                               "where some pairings are more likely than " +
+                               "others, if the exclusions are too dense " +
+                               "for a fair one")
+    santas_parser.add_argument("--postmen", type=int, default=1,
+                               help="Number of connections to send letters " +
+                               "over in parallel")
+    santas_parser.add_argument("--pipeline", action="store_true",
+                               help="Fetch GIFs, write letters, and send " +
+                               "them in separate stages at the same time")
+    santas_parser.add_argument("--fetchers", type=int, default=8,
+                               help="Number of threads fetching GIFs in the " +
+                               "pipeline, or with --asyncio, GIFs " +
+                               "downloading at once")
+    santas_parser.add_argument("--writers", type=int, default=1,
+                               help="Number of threads writing letters in " +
+                               "the pipeline")
+    santas_parser.add_argument("--queue-depth", type=int, default=64,
+                               help="Most letters waiting between each " +
+                               "stage of the pipeline")
+    santas_parser.add_argument("--asyncio", action="store_true",
+                               help="Download GIFs, and send letters at the " +
+                               "same time using asyncio")
+    santas_parser.add_argument("--host", default="smtp.gmail.com",
+                               help="Email server to send letters through, " +
+                               "e.g. localhost for a local SMTP sink")
+    santas_parser.add_argument("--port", type=int, default=587,
+                               help="Port of the email server")
+    santas_parser.add_argument("--no-tls", action="store_true",
+                               help="Don't upgrade connections with STARTTLS")
+    santas_parser.add_argument("--spool", help="mbox file, or Maildir folder " +
+                               "to write letters to, instead of sending them")
+    santas_parser.add_argument("--spool-format", default="mbox",
+                               choices=["mbox", "maildir"],
+                               help="Format of the spool")
+    santas_parser.add_argument("--replay", help="mbox file, or Maildir " +
+                               "folder of letters to send, instead of " +
+                               "drawing new ones")
+    santas_parser.add_argument("--journal", help="Journal file to record " +
+                               "the draw, and every letter's delivery in, so " +
+                               "an interrupted run can be resumed")
+    santas_parser.add_argument("--resume", action="store_true",
+                               help="Send the letters in the journal that " +
+                               "haven't been sent yet, instead of drawing " +
+                               "again")
+    santas_parser.add_argument("--redraw", action="store_true",
+                               help="Repair the draw in the journal for " +
+                               "Secret Santas who've joined, or left the " +
+                               "CSV, and only send the letters that changed")
+    santas_parser.add_argument("--batch", action="store_true",
+                               help="Treat CSV as a folder of roster CSV " +
+                               "files, or a manifest of them, and draw for " +
+                               "each group")
+    santas_parser.add_argument("--workers", type=int,
+                               help="Number of processes to draw groups " +
+                               "with in a batch, or shards with")
+    santas_parser.add_argument("--shards", type=int,
+                               help="Draw very large rosters in this many " +
+                               "shards over several processes")
+    santas_parser.add_argument("--retries", type=int, default=2,
+                               help="Most times to try a letter again after " +
+                               "a temporary failure")
+    santas_parser.add_argument("--per-minute", type=float,
+                               help="Most letters to send per minute, " +
+                               "slowing down further if the email server " +
+                               "asks")
+    santas_parser.add_argument("--per-day", type=int,
+                               help="Most letters to send in any 24 hours, " +
+                               "across runs")
+    santas_parser.add_argument("--ledger", default="santas_ledger.txt",
+                               help="File of the times letters were sent, " +
+                               "to keep to --per-day across runs")
+    santas_parser.add_argument("--metrics-json",
+                               help="JSON file to write timings, and counts " +
+                               "of each stage to at the end")
+    santas_parser.add_argument("--metrics-prometheus",
+                               help="File to write timings, and counts of " +
+                               "each stage to at the end, in Prometheus' " +
+                               "text format")
+    santas_args = santas_parser.parse_args()
+    if santas_args.resume and santas_args.journal is None:
+        santas_parser.error("--resume needs a --journal")
+    if santas_args.redraw and (santas_args.journal is None or
+                               santas_args.resume):
+        santas_parser.error("--redraw needs a --journal, and can't be used " +
+                            "with --resume")
+    if (santas_args.csv is None and santas_args.replay is None and
+            not santas_args.resume):
+        santas_parser.error("the following arguments are required: csv")
+    if santas_args.shards and santas_args.exclusions:
+        santas_parser.error("--shards can't be used with --exclusions")
+    if santas_args.unfair_draw and not santas_args.exclusions:
+        santas_parser.error("--unfair-draw needs --exclusions")
+    if santas_args.asyncio and santas_args.pipeline:
+        santas_parser.error("--asyncio can't be used with --pipeline")
+    if santas_args.batch and (santas_args.spool or santas_args.journal or
+                              santas_args.replay or santas_args.resume or
+                              santas_args.redraw or santas_args.asyncio or
+                              santas_args.pipeline):
+        santas_parser.error("--batch can't be used with --spool, --journal, " +
+                            "--replay, --resume, --redraw, --asyncio, or " +
+                            "--pipeline")
+
+    # Gmail account for the Secret Santa mailbox, with validator. Any valid
+    # email address will do for other email servers
+    if santas_args.host == "smtp.gmail.com":
+        if re.search(r"(^[a-zA-Z0-9_.+-]+@gmail.com$)",
+                     santas_args.mailbox) is None:
+            sys.exit("Nobody's home... [Invalid Gmail address]")
+    elif VET_CHECK.match(santas_args.mailbox) is None:
+        sys.exit("Nobody's home... [Invalid email address]")
+    secret_santas_mailbox = santas_args.mailbox
+
+    # Time, and count each stage if asked, writing them out however the run
+    # ends
+    if santas_args.metrics_json or santas_args.metrics_prometheus:
+        santas_stopwatch = SantasStopwatch()
+        if santas_args.metrics_json:
+            atexit.register(santas_stopwatch.write_json,
+                            santas_args.metrics_json)
+        if santas_args.metrics_prometheus:
+            atexit.register(santas_stopwatch.write_prometheus,
+                            santas_args.metrics_prometheus)
+
+    # Pace letters to the email server's limits, if asked
+    if santas_args.per_minute or santas_args.per_day:
+        santas_pacer = SantasPacer(santas_args.per_minute, santas_args.per_day,
+                                   ledger=(santas_args.ledger if
+                                           santas_args.per_day else None))
     else:
-        secret_santas_mailbox = sys.argv[1]
-
-    # Import Secret Santas names, and their corresponding email addresses. Note
-    # existing columns are forcibly renamed to "santas", and "reindeers", so
-    # first column should have Secret Santa names, and second column should have
-    # their email addresses
-    secret_santa_sleighs = pd.read_csv(sys.argv[2],
-                                       names=["santas", "reindeers"], header=0, 
-                                       skipinitialspace=True)
-    secret_santas = secret_santa_sleighs.santas.tolist()
-    secret_reindeers = secret_santa_sleighs.reindeers.tolist()
-
-    # Strip any whitespace in the name or email address columns
-    secret_santas = [santa.strip(' ') for santa in secret_santas]
-    secret_reindeers = [reindeer.strip(' ') for reindeer in secret_reindeers]
-    
-    # See if the user wants to keep the downloaded GIFs from GIPHY
-    try:
-        keep_gifs = True if int(sys.argv[3]) == 1 else False
-    except IndexError:
-        keep_gifs = False
+        santas_pacer = None
+
+    # Send letters from a spool, if asked, instead of drawing new ones
+    if santas_args.replay:
+        santas_key = getpass.getpass("Santa's secret key [Enter email " +
+                                     "password]: ")
+        check_deliveries(replay_spool(secret_santas_mailbox, santas_args.replay,
+                                      santas_args.host, santas_args.port,
+                                      not santas_args.no_tls, santas_pacer,
+                                      santas_args.journal,
+                                      santas_args.retries))
+        print("All letters sent - Merry Christmas!")
+        sys.exit()
+
+    # See if the user wants to keep the downloaded GIFs from GIPHY in a cache,
+    # and use them if GIPHY fails
+    if santas_args.keep_gifs > 0:
+        giphy_cache = GiphyCache(budget=int(santas_args.gif_cache_mb * 2 ** 20),
+                                 fallback=santas_args.keep_gifs == 2)
+        atexit.register(giphy_cache.flush)
+
+    # Keep GIFs within a byte budget, or only link to them, if asked, and say
+    # how much lighter the letters were at the end
+    if santas_args.gif_budget_kb is not None or santas_args.gif_link_only:
+        giphy_budget = GiphyBudget(
+            None if santas_args.gif_budget_kb is None else
+            int(santas_args.gif_budget_kb * 1024), santas_args.gif_link_only)
+        atexit.register(giphy_budget.report)
+
+    # Keep connections to GIPHY, and its GIF hosts alive between letters,
+    # unless asked not to
+    if not santas_args.no_keep_alive:
+        giphy_client = GiphyClient(timeout=santas_args.gif_timeout)
+        atexit.register(giphy_client.close)
+
+    # Draw for every group in a folder, or manifest, of rosters, if asked, and
+    # send all their letters together
+    if santas_args.batch:
+        santas_key = getpass.getpass("Santa's secret key [Enter email " +
+                                     "password]: ")
+        giphy_api_token = getpass.getpass(("Pick one of Santa's photo albums " +
+                                           "[Enter GIPHY API token]: "))
+
+        # Fetch the pool of GIFs to share between the letters, if asked
+        if santas_args.gif_pool:
+            giphy_pool = GiphyPool(santas_args.gif_pool,
+                                   santas_args.gif_pool_order)
+            print("Fetching " + str(santas_args.gif_pool) + " GIFs for " +
+                  "the pool...")
+            giphy_pool.fill()
+        secret_santa_batch(santas_args.csv, secret_santas_mailbox,
+                           santas_args.workers, santas_args.postmen,
+                           santas_args.host, santas_args.port,
+                           not santas_args.no_tls, santas_args.retries,
+                           santas_pacer)
+        print("All letters sent - Merry Christmas!")
+        sys.exit()
+
+    # Import Secret Santas names, and their corresponding email addresses in a
+    # single pass into a compact roster. Note the header row is skipped, so
+    # first column should have Secret Santa names, and second column should
+    # have their email addresses. When resuming, they come from the journal
+    # instead
+    if santas_args.resume:
+        secret_sleighs, _, _ = SantasJournal.load(santas_args.journal)
+        secret_roster = SantasRoster(secret_sleighs.items())
+    else:
+        secret_roster = SantasRoster.from_csv(santas_args.csv)
+
+    # Import any pairings that aren't allowed
+    if santas_args.exclusions:
+        secret_exclusions = load_exclusions(santas_args.exclusions)
+    else:
+        secret_exclusions = None
 
     # Obtain the password for the Secret Santa mailbox, and the GIPHY API token
     santas_key = getpass.getpass("Santa's secret key [Enter email password]: ")
     giphy_api_token = getpass.getpass(("Pick one of Santa's photo albums " +
                                        "[Enter GIPHY API token]: "))
 
-    # Print messages to list all the loaded data, and then check to proceed
+    # Fetch the pool of GIFs to share between the letters, if asked
+    if santas_args.gif_pool:
+        giphy_pool = GiphyPool(santas_args.gif_pool,
+                               santas_args.gif_pool_order)
+        print("Fetching " + str(santas_args.gif_pool) + " GIFs for " +
+              "the pool...")
+        giphy_pool.fill()
+
+    # Print messages to list all the loaded data, and then check to proceed.
+    # Only import pandas now, as it's slow to import, and only used here. Only
+    # the first, and last few Secret Santas of a long roster are shown, so
+    # they're the only ones copied
+    import pandas as pd
+    if len(secret_roster) > 60:
+        preview = list(range(5)) + list(range(len(secret_roster) - 5,
+                                              len(secret_roster)))
+    else:
+        preview = list(range(len(secret_roster)))
     print("Here's our Secret Santas:\n")
-    print(pd.DataFrame({"1. Secret Santas": secret_santas,
-                        "2. Email addresses": secret_reindeers}))
+    print(pd.DataFrame({"1. Secret Santas": [secret_roster.name(i) for i in
+                                             preview],
+                        "2. Email addresses": [secret_roster.email(i) for i in
+                                               preview]}, index=preview))
+    if len(preview) < len(secret_roster):
+        print("[" + str(len(secret_roster)) + " Secret Santas]")
     continue_checker("All data loaded, ready to check the sleighs!", "Ok, " +
                      "maybe next time then!")
 
-    # Execute function
-    secret_santa_mailer(secret_santas
-                        , secret_reindeers
-                        , secret_santas_mailbox)
+    # Execute function, spooling letters without asyncio, as nothing is sent
+    if santas_args.asyncio and not santas_args.spool:
+        secret_santa_mailer_async(secret_roster
+                                  , secret_roster.reindeers
+                                  , secret_santas_mailbox
+                                  , exclusions=secret_exclusions
+                                  , postmen=santas_args.postmen
+                                  , fetchers=santas_args.fetchers
+                                  , host=santas_args.host
+                                  , port=santas_args.port
+                                  , tls=not santas_args.no_tls
+                                  , journal=santas_args.journal
+                                  , resume=santas_args.resume
+                                  , retries=santas_args.retries
+                                  , pacer=santas_pacer
+                                  , redraw=santas_args.redraw
+                                  , shards=santas_args.shards
+                                  , workers=santas_args.workers
+                                  , fair=not santas_args.unfair_draw)
+    else:
+        secret_santa_mailer(secret_roster
+                            , secret_roster.reindeers
+                            , secret_santas_mailbox
+                            , exclusions=secret_exclusions
+                            , postmen=santas_args.postmen
+                            , host=santas_args.host
+                            , port=santas_args.port
+                            , tls=not santas_args.no_tls
+                            , spool=santas_args.spool
+                            , spool_format=santas_args.spool_format
+                            , journal=santas_args.journal
+                            , resume=santas_args.resume
+                            , retries=santas_args.retries
+                            , pacer=santas_pacer
+                            , pipeline=santas_args.pipeline
+                            , fetchers=santas_args.fetchers
+                            , writers=santas_args.writers
+                            , depth=santas_args.queue_depth
+                            , redraw=santas_args.redraw
+                            , shards=santas_args.shards
+                            , workers=santas_args.workers
+                            , fair=not santas_args.unfair_draw)
@@ -0,0 +1,520 @@
+"""Local stand-in servers for Secret Santa double-blind mailer.
+
+This module contains local stand-ins for the external services used in
+secret_santa_mailer.py, so that letters can be tested, and timed, without
+sending any real emails.
+
+The SMTP sink accepts every letter sent to it, and keeps it in memory instead
+of delivering it. It advertises, and accepts any login, but not STARTTLS, so
+connect to it with TLS turned off. To test how letters are sent against a real
+email server, it can wait before answering each command, limit the number of
+letters per second, turn away a share of letters at random, and refuse given
+recipients. Like a real email server, it refuses a new letter until the last
+one is finished, or reset.
+
+The GIPHY stub answers the GIPHY random GIF endpoint, "/v1/gifs/random", with
+a new random GIF ID each time, and serves a tiny GIF for every GIF URL it
+gives out. It can also offer several renditions of each GIF, padded out to
+given sizes, like GIPHY's "images" object. Like GIPHY, it keeps connections
+alive between requests, and to time the GIF path without the internet, it can
+wait before accepting each new connection, standing in for the TCP, and TLS
+handshakes, and before answering each request.
+
+Example:
+    To run a SMTP sink, and a GIPHY stub on localhost execute:
+
+        $ python stand_ins_secret_santa_mailer.py <<<SMTP PORT>>>
+            <<<GIPHY PORT>>> --latency <<<SECONDS>>> --throttle <<<LETTERS>>>
+            --failure-rate <<<RATE>>> --giphy-latency <<<SECONDS>>>
+            --giphy-connect-latency <<<SECONDS>>>
+
+    where <<<SMTP PORT>>>, and <<<GIPHY PORT>>> are optional, and are the ports
+    to listen on. They default to 1025, and 8025. <<<SECONDS>>> is optional,
+    and is how long the SMTP sink waits before answering each command,
+    <<<LETTERS>>> is optional, and is the most letters it accepts per second,
+    and <<<RATE>>> is optional, and is the share of letters it turns away at
+    random. The GIPHY stub latencies are optional, and are how long it waits
+    before answering each request, and accepting each new connection. Stop
+    both with Ctrl-C.
+
+Attributes:
+    tiny_gif (bytes): A single-pixel GIF, served by the GIPHY stub.
+
+"""
+import argparse
+import http.server
+import json
+import random
+import secrets
+import socketserver
+import sys
+import threading
+import time
+import urllib.parse
+
+tiny_gif = (b"GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff" +
+            b"!\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01" +
+            b"\x00\x00\x02\x02D\x01\x00;")
+
+
+class SmtpSinkHandler(socketserver.StreamRequestHandler):
+    """Handle a single connection to the SMTP sink"""
+
+    def reply(self, response):
+        """Send a reply line to the client
+
+        Args:
+            response (str): Reply, including the status code.
+        """
+        self.wfile.write((response + "\r\n").encode("ascii"))
+
+    def handle(self):
+        """Talk SMTP with the client until they quit, or the sink hangs up"""
+        self.reply("220 localhost Santa's sorting office ESMTP")
+        mailfrom, rcpttos, letters = None, [], 0
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            command = line.decode("utf8", "replace").strip()
+            verb = command[:4].upper()
+
+            # Take a while to answer, like a distant email server
+            if self.server.latency:
+                time.sleep(self.server.latency)
+
+            if verb == "EHLO":
+                self.wfile.write(b"250-localhost\r\n250-8BITMIME\r\n" +
+                                 b"250 AUTH PLAIN LOGIN\r\n")
+            elif verb == "HELO":
+                self.reply("250 localhost")
+            elif verb == "AUTH":
+                # Accept any credentials, asking for them if not given yet
+                challenges = {"PLAIN": ["334 "],
+                              "LOGIN": ["334 VXNlcm5hbWU6", "334 UGFzc3dvcmQ6"]}
+                words = command.split()
+                mechanism = words[1].upper() if len(words) > 1 else "PLAIN"
+                for challenge in challenges.get(mechanism, [])[len(words) - 2:]:
+                    self.reply(challenge)
+                    self.rfile.readline()
+                self.reply("235 2.7.0 Authentication successful")
+            elif verb == "MAIL":
+                # Refuse a new letter until the last one is finished, or
+                # reset, like a real email server
+                if mailfrom is not None:
+                    self.reply("503 5.5.1 Nested MAIL command")
+                    continue
+                mailfrom, rcpttos = command[10:].strip(" <>"), []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                rcptto = command[8:].strip(" <>")
+                if mailfrom is None:
+                    self.reply("503 5.5.1 Need MAIL before RCPT")
+                elif self.server.check_recipient(rcptto):
+                    self.reply("550 5.1.1 No such Secret Santa")
+                else:
+                    rcpttos.append(rcptto)
+                    self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                for data_line in self.rfile:
+                    if data_line == b".\r\n":
+                        break
+                    data.append(data_line[1:] if data_line.startswith(b"..")
+                                else data_line)
+                # Turn the letter away if the sink is throttled, or the
+                # letter is unlucky, otherwise keep it
+                refusal = self.server.check_letter()
+                if refusal:
+                    mailfrom, rcpttos = None, []
+                    self.reply(refusal)
+                    continue
+                self.server.keep_letter(mailfrom, rcpttos, b"".join(data))
+                mailfrom, rcpttos = None, []
+                self.reply("250 OK")
+                letters += 1
+
+                # Hang up if the connection has reached its letter limit
+                if letters == self.server.letters_per_connection:
+                    break
+            elif verb == "RSET":
+                mailfrom, rcpttos = None, []
+                self.reply("250 OK")
+            elif verb == "NOOP":
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                break
+            elif verb == "STAR":
+                self.reply("454 TLS not available")
+            else:
+                self.reply("502 Command not implemented")
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    """Local SMTP server that keeps every letter it receives in memory
+
+    Args:
+        server_address (tuple): Host, and port to listen on. Use port 0 to pick
+            any free port.
+        letters_per_connection (int): If given, hang up each connection after
+            this many letters, like servers that limit letters per connection.
+        latency (float): Seconds to wait before answering each command.
+        throttle (float): If given, the most letters accepted per second.
+            Letters over the limit are turned away with a temporary error.
+        failure_rate (float): Share of letters, between 0, and 1, turned away
+            at random with a temporary error.
+        refused_recipients (set): If given, email addresses refused at RCPT
+            with a permanent error, like unknown mailboxes.
+
+    Attributes:
+        letters (list): List of tuples of the sender, the list of recipients,
+            and the raw letter in bytes, for every letter received.
+        refusals (dict): Number of letters turned away for being "throttled",
+            and for "failed" at random, and recipients "refused".
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, letters_per_connection=None, latency=0,
+                 throttle=None, failure_rate=0, refused_recipients=None):
+        super().__init__(server_address, SmtpSinkHandler)
+        self.letters_per_connection = letters_per_connection
+        self.latency = latency
+        self.throttle = throttle
+        self.failure_rate = failure_rate
+        self.refused_recipients = refused_recipients or set()
+        self.letters = []
+        self.letters_lock = threading.Lock()
+        self.refusals = {"throttled": 0, "failed": 0, "refused": 0}
+
+        # Token bucket for the throttle, holding up to a second of letters
+        self.throttle_tokens = throttle or 0
+        self.throttle_time = time.monotonic()
+
+    def check_letter(self):
+        """Decide if the next letter is turned away
+
+        Yields:
+            refusal (str): Reply turning the letter away, or None to keep it.
+        """
+        with self.letters_lock:
+            # Top up the token bucket for the time passed, and turn the letter
+            # away if there are no tokens left
+            if self.throttle:
+                now = time.monotonic()
+                self.throttle_tokens = min(self.throttle, self.throttle_tokens +
+                                           (now - self.throttle_time) *
+                                           self.throttle)
+                self.throttle_time = now
+                if self.throttle_tokens < 1:
+                    self.refusals["throttled"] += 1
+                    return "451 4.7.0 Santa's sorting office is full, slow down"
+                self.throttle_tokens -= 1
+
+            # Turn away unlucky letters
+            if self.failure_rate and random.random() < self.failure_rate:
+                self.refusals["failed"] += 1
+                return "451 4.3.0 Lost in the snow, try again later"
+        return None
+
+    def check_recipient(self, rcptto):
+        """Decide if a recipient is refused
+
+        Args:
+            rcptto (str): Recipient's email address.
+
+        Yields:
+            True if the recipient is refused.
+        """
+        if rcptto not in self.refused_recipients:
+            return False
+        with self.letters_lock:
+            self.refusals["refused"] += 1
+        return True
+
+    def keep_letter(self, mailfrom, rcpttos, data):
+        """Keep a received letter
+
+        Args:
+            mailfrom (str): Sender's email address.
+            rcpttos (list): Recipients' email addresses.
+            data (bytes): Raw letter.
+        """
+        with self.letters_lock:
+            self.letters.append((mailfrom, list(rcpttos), data))
+
+
+def start_smtp_sink(host="localhost", port=0, **options):
+    """Start a SMTP sink in a background thread
+
+    Args:
+        host (str): Host to listen on.
+        port (int): Port to listen on. Use 0 to pick any free port.
+        **options: Any other SmtpSink options.
+
+    Yields:
+        smtp_sink (SmtpSink): Running SMTP sink. Its port is the second item of
+            "smtp_sink.server_address", and it stops with "smtp_sink.shutdown".
+    """
+    smtp_sink = SmtpSink((host, port), **options)
+    threading.Thread(target=smtp_sink.serve_forever, daemon=True).start()
+    return smtp_sink
+
+
+def padded_gif(size):
+    """Pad the tiny GIF out to about "size" bytes with a comment
+
+    Args:
+        size (int): Size to pad the GIF to, in bytes.
+
+    Yields:
+        A valid GIF of "size" bytes, give or take a byte, or the tiny GIF if
+        it's bigger.
+    """
+    padding = size - len(tiny_gif) - 3
+    if padding < 2:
+        return tiny_gif
+
+    # Split the padding into sub-blocks of up to 255 bytes, each after its
+    # length, and end the comment with an empty sub-block
+    blocks = []
+    while padding >= 2:
+        length = min(255, padding - 1)
+        blocks.append(bytes([length]) + b"\x00" * length)
+        padding -= length + 1
+    return tiny_gif[:-1] + b"!\xfe" + b"".join(blocks) + b"\x00;"
+
+
+class GiphyStubHandler(http.server.BaseHTTPRequestHandler):
+    """Handle a single connection to the GIPHY stub"""
+    protocol_version = "HTTP/1.1"
+
+    # Send each response straight away, rather than waiting for the client to
+    # acknowledge the headers, which stalls kept-alive connections
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        """Count the new connection, and wait as if shaking hands"""
+        super().setup()
+        self.server.count_connection()
+        if self.server.connect_latency:
+            time.sleep(self.server.connect_latency)
+
+    def log_message(self, format, *args):
+        """Don't log every request"""
+
+    def send_body(self, status, content_type, body):
+        """Send a complete response
+
+        Args:
+            status (int): HTTP status code.
+            content_type (str): Content type of the body.
+            body (bytes): Body of the response.
+        """
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """Answer the random GIF endpoint, and serve GIFs"""
+        url_parts = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url_parts.query)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if url_parts.path == "/v1/gifs/random":
+            # Reject the wrong API token, like GIPHY
+            if (self.server.api_key is not None and
+                    query.get("api_key", [""])[0] != self.server.api_key):
+                self.send_body(403, "application/json",
+                               b'{"message": "Invalid authentication"}')
+                return
+
+            # Pretend to be unavailable, if there are failures left
+            if self.server.take_failure():
+                self.send_body(503, "application/json",
+                               b'{"message": "Service unavailable"}')
+                return
+
+            # Reply with a new random GIF ID, and its URL, or the URLs, and
+            # sizes of each of its renditions
+            giphy_id = secrets.token_hex(8)
+            self.server.count_request("random")
+            giphy_data = {"id": giphy_id, "fixed_height_downsampled_url": (
+                self.server.media_url + giphy_id + ".gif")}
+            if self.server.renditions:
+                giphy_data["images"] = {}
+                for rendition, size in self.server.renditions.items():
+                    giphy_data["images"][rendition] = {
+                        "url": (self.server.media_url + giphy_id + "/" +
+                                rendition + ".gif")}
+                    giphy_data[rendition + "_url"] = \
+                        giphy_data["images"][rendition]["url"]
+                    if self.server.report_sizes:
+                        giphy_data["images"][rendition]["size"] = str(
+                            len(self.server.gifs[rendition]))
+            self.send_body(200, "application/json", json.dumps({
+                "data": giphy_data,
+                "meta": {"status": 200, "msg": "OK"}}).encode("utf8"))
+        elif (url_parts.path.startswith("/media/") and
+              url_parts.path.endswith(".gif")):
+            self.server.count_request("media")
+            rendition = url_parts.path.rsplit("/", 1)[-1][:-len(".gif")]
+            self.send_body(200, "image/gif", self.server.gifs.get(rendition,
+                                                                 tiny_gif))
+        else:
+            self.send_body(404, "text/plain", b"Not found")
+
+
+class GiphyStub(http.server.ThreadingHTTPServer):
+    """Local stand-in for the GIPHY random GIF API, and its GIF host
+
+    Args:
+        server_address (tuple): Host, and port to listen on. Use port 0 to pick
+            any free port.
+        api_key (str): If given, reject requests with any other API token.
+        renditions (dict): If given, dictionary with GIPHY rendition names as
+            keys, and sizes in bytes as items, to offer for each GIF.
+        report_sizes (bool): If True, give the size of each rendition, like
+            GIPHY's "images" object, otherwise only their URLs.
+        latency (float): Seconds to wait before answering each request.
+        connect_latency (float): Seconds to wait before accepting each new
+            connection, standing in for the TCP, and TLS handshakes.
+        failures (int): Number of requests to the "random" endpoint to answer
+            with 503 Service Unavailable, before answering as normal.
+
+    Attributes:
+        api_url (str): URL of the stub's random GIF endpoint, to use as
+            "secret_santa_mailer.giphy_api_url".
+        requests (dict): Number of requests made to the "random" endpoint,
+            and for "media", i.e. GIFs.
+        connections (int): Number of connections made to the stub.
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, api_key=None, renditions=None,
+                 report_sizes=True, latency=0, connect_latency=0, failures=0):
+        super().__init__(server_address, GiphyStubHandler)
+        self.api_key = api_key
+        self.renditions = renditions
+        self.report_sizes = report_sizes
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.failures = failures
+        self.gifs = {rendition: padded_gif(size) for rendition, size in
+                     (renditions or {}).items()}
+        base_url = "http://localhost:" + str(self.server_address[1])
+        self.api_url = base_url + "/v1/gifs/random"
+        self.media_url = base_url + "/media/"
+        self.requests = {"random": 0, "media": 0}
+        self.connections = 0
+        self.requests_lock = threading.Lock()
+
+    def count_request(self, endpoint):
+        """Count a request to an endpoint
+
+        Args:
+            endpoint (str): Either "random", or "media".
+        """
+        with self.requests_lock:
+            self.requests[endpoint] += 1
+
+    def handle_error(self, request, client_address):
+        """Don't report clients hanging up before they're answered"""
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def count_connection(self):
+        """Count a new connection"""
+        with self.requests_lock:
+            self.connections += 1
+
+    def take_failure(self):
+        """Use up one of the requests to fail, if there are any left
+
+        Yields:
+            True if the request should fail.
+        """
+        with self.requests_lock:
+            if self.failures <= 0:
+                return False
+            self.failures -= 1
+            return True
+
+
+def start_giphy_stub(host="localhost", port=0, **options):
+    """Start a GIPHY stub in a background thread
+
+    Args:
+        host (str): Host to listen on.
+        port (int): Port to listen on. Use 0 to pick any free port.
+        **options: Any other GiphyStub options.
+
+    Yields:
+        giphy_stub (GiphyStub): Running GIPHY stub. Its random GIF endpoint is
+            "giphy_stub.api_url", and it stops with "giphy_stub.shutdown".
+    """
+    giphy_stub = GiphyStub((host, port), **options)
+    threading.Thread(target=giphy_stub.serve_forever, daemon=True).start()
+    return giphy_stub
+
+
+# Standalone program execution
+if __name__ == '__main__':
+
+    # Parse the command line arguments
+    stand_ins_parser = argparse.ArgumentParser(description="Local stand-in " +
+                                               "servers for Secret Santa " +
+                                               "double-blind mailer")
+    stand_ins_parser.add_argument("sink_port", nargs="?", type=int,
+                                  default=1025, help="SMTP sink port")
+    stand_ins_parser.add_argument("stub_port", nargs="?", type=int,
+                                  default=8025, help="GIPHY stub port")
+    stand_ins_parser.add_argument("--latency", type=float, default=0,
+                                  help="Seconds the SMTP sink waits before " +
+                                  "answering each command")
+    stand_ins_parser.add_argument("--throttle", type=float,
+                                  help="Most letters the SMTP sink accepts " +
+                                  "per second")
+    stand_ins_parser.add_argument("--failure-rate", type=float, default=0,
+                                  help="Share of letters the SMTP sink turns " +
+                                  "away at random")
+    stand_ins_parser.add_argument("--letters-per-connection", type=int,
+                                  help="Letters the SMTP sink accepts before " +
+                                  "hanging up each connection")
+    stand_ins_parser.add_argument("--giphy-latency", type=float, default=0,
+                                  help="Seconds the GIPHY stub waits before " +
+                                  "answering each request")
+    stand_ins_parser.add_argument("--giphy-connect-latency", type=float,
+                                  default=0, help="Seconds the GIPHY stub " +
+                                  "waits before accepting each new connection")
+    stand_ins_args = stand_ins_parser.parse_args()
+    sink_port, stub_port = stand_ins_args.sink_port, stand_ins_args.stub_port
+
+    # Run the SMTP sink, and GIPHY stub until Ctrl-C
+    sink = start_smtp_sink(port=sink_port,
+                           letters_per_connection=(
+                               stand_ins_args.letters_per_connection),
+                           latency=stand_ins_args.latency,
+                           throttle=stand_ins_args.throttle,
+                           failure_rate=stand_ins_args.failure_rate)
+    stub = start_giphy_stub(port=stub_port,
+                            latency=stand_ins_args.giphy_latency,
+                            connect_latency=(
+                                stand_ins_args.giphy_connect_latency))
+    print("SMTP sink listening on localhost:" + str(sink_port) + "...")
+    print("GIPHY stub listening on " + stub.api_url + "...")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        print("Received " + str(len(sink.letters)) + " letter(s), and " +
+              "turned away " + str(sink.refusals["throttled"]) +
+              " throttled, " +
+              "and " + str(sink.refusals["failed"]) + " failed letter(s)")
+        print("Served " + str(stub.requests["media"]) + " GIF(s) over " +
+              str(stub.connections) + " connection(s)")
@@ -3,9 +3,9 @@
 This module contains a unit tests for the various functions used in
 secret_santa_mailer.py.
 
-As the secret_santa_randomiser function makes random selections, the unittest
-for this is deliberately run 10,000 times to ensure the function is operating
-correctly.
+As the pairing functions make random selections, their unittests tally
+thousands of draws with tally_draws, to ensure every draw is valid, and that
+the draws are fair.
 
 Example:
     To run this script execute:
@@ -15,10 +15,150 @@ Example:
 Attributes:
 
 """
+import asyncio
+import email
+import functools
+import json
+import mailbox
+import numpy
+import os
 import secret_santa_mailer
+import smtplib
+import socket
+import stand_ins_secret_santa_mailer
+import tempfile
+import threading
+import time
+import types
 import unittest
+from email.mime.image import MIMEImage
+from multiprocessing import shared_memory
 from unittest.mock import patch
-from urllib.error import HTTPError
+from urllib.error import HTTPError, URLError
+
+
+def fake_mime_giphy():
+    """Generate a MIME image from a tiny GIF, instead of calling GIPHY
+
+    Yields:
+        A MIME image, its fake GIPHY URL, and its fake GIPHY ID, like
+        "mime_giphy".
+    """
+    santas_picture = MIMEImage(stand_ins_secret_santa_mailer.tiny_gif, "gif")
+    santas_picture.add_header("Content-ID", "<tiny>")
+    return santas_picture, "https://giphy.test/tiny.gif", "tiny"
+
+
+class ReadSleighsTest(unittest.TestCase):
+    """Unit tests for the read_sleighs function"""
+
+    def test_Template(self):
+        """Check the Secret Santa template loads
+
+        Check the header row is skipped, and each name has its email
+        address."""
+        sleighs = list(secret_santa_mailer.read_sleighs(
+            "./templates/Secret_Santa_Template.csv"))
+        self.assertEqual(sleighs[0], ("Name 1", "Email 1"))
+        self.assertEqual(len(sleighs), len(set(sleighs)))
+
+    def test_Messy_Rows(self):
+        """Check messy rows are tidied up
+
+        Check whitespace is stripped, blank rows, and extra columns are
+        ignored, and quoted values are kept whole."""
+        with tempfile.TemporaryDirectory() as santas_workshop:
+            filename = os.path.join(santas_workshop, "sleighs.csv")
+            with open(filename, "w", encoding="utf8") as f:
+                f.write('Santa,Reindeer\n  Zoë , zoe@test.me \n\n' +
+                        '"Claus, Noël",noel@test.me,extra\n')
+            self.assertEqual(list(secret_santa_mailer.read_sleighs(filename)),
+                             [("Zoë", "zoe@test.me"),
+                              ("Claus, Noël", "noel@test.me")])
+
+    def test_Missing_Email(self):
+        """Check rows without an email address
+
+        Check a SystemExit and appropriate exit message are shown if a row only
+        has a name."""
+        with tempfile.TemporaryDirectory() as santas_workshop:
+            filename = os.path.join(santas_workshop, "sleighs.csv")
+            with open(filename, "w", encoding="utf8") as f:
+                f.write("Santa,Reindeer\nA,a@test.me\nB\n")
+            with self.assertRaises(SystemExit) as cm:
+                list(secret_santa_mailer.read_sleighs(filename))
+        self.assertEqual(cm.exception.code, ("Santa's lost a reindeer! [Row " +
+                                             "3 needs a name, and an email " +
+                                             "address]"))
+
+
+class SantasRosterTest(unittest.TestCase):
+    """Unit tests for the SantasRoster, RosterColumn, and SantasPairings
+    classes"""
+
+    def setUp(self):
+        """Set up a small roster, with a duplicate name"""
+        self.sleighs = [("Zoë", "zoe@test.me"), ("Noël", "noel@test.me"),
+                        ("Rudolph", "rudolph@test.me"),
+                        ("Zoë", "zoe2@test.me")]
+        self.santas_roster = secret_santa_mailer.SantasRoster(self.sleighs)
+
+    def test_Mapping(self):
+        """Check the roster works like the "sleighs" dictionary
+
+        Check names are kept in order, and each finds its email address, with
+        the first of any duplicate names found."""
+        self.assertEqual(len(self.santas_roster), 4)
+        self.assertEqual(list(self.santas_roster),
+                         [santa for santa, _ in self.sleighs])
+        self.assertEqual(list(self.santas_roster.items()), self.sleighs)
+        self.assertEqual(self.santas_roster["Noël"], "noel@test.me")
+        self.assertEqual(self.santas_roster["Zoë"], "zoe@test.me")
+        self.assertIn("Rudolph", self.santas_roster)
+        self.assertNotIn("Comet", self.santas_roster)
+        with self.assertRaises(KeyError):
+            self.santas_roster["Comet"]
+
+    def test_Columns(self):
+        """Check the names, and email addresses work like lists"""
+        self.assertEqual(self.santas_roster.santas[-1], "Zoë")
+        self.assertEqual(self.santas_roster.reindeers[1:3],
+                         ["noel@test.me", "rudolph@test.me"])
+        with self.assertRaises(IndexError):
+            self.santas_roster.santas[4]
+        self.assertEqual(secret_santa_mailer.inspect_sleighs(
+            self.santas_roster.santas, self.santas_roster.reindeers)[
+            "impostors"], ["Zoë"])
+
+    def test_From_CSV(self):
+        """Check a roster streams from the Secret Santa template"""
+        santas_roster = secret_santa_mailer.SantasRoster.from_csv(
+            "./templates/Secret_Santa_Template.csv")
+        self.assertEqual(list(santas_roster.items()),
+                         list(secret_santa_mailer.read_sleighs(
+                             "./templates/Secret_Santa_Template.csv")))
+
+    def test_Pairings(self):
+        """Check a roster's pairings are compact, and in a single cycle
+
+        Check drawing a roster gives "SantasPairings", where nobody gives to
+        themselves, and following the receivers visits everyone."""
+        santas_roster = secret_santa_mailer.SantasRoster(
+            ("Santa " + str(i), "santa" + str(i) + "@test.me") for i in
+            range(100))
+        santa_pairings = secret_santa_mailer.secret_santa_derangement(
+            santas_roster)
+        self.assertIsInstance(santa_pairings,
+                              secret_santa_mailer.SantasPairings)
+        self.assertEqual(dict(santa_pairings.items()),
+                         {giver: santa_pairings[giver] for giver in
+                          santa_pairings})
+        giver, visited = "Santa 0", set()
+        while giver not in visited:
+            visited.add(giver)
+            self.assertNotEqual(santa_pairings[giver], giver)
+            giver = santa_pairings[giver]
+        self.assertEqual(len(visited), 100)
 
 
 class ContinueCheckerTests(unittest.TestCase):
@@ -46,6 +186,34 @@ class ContinueCheckerTests(unittest.TestCase):
         self.assertEqual(cm.exception.code, "Exit Message")
 
 
+class InspectSleighsTest(unittest.TestCase):
+    """Unit tests for the inspect_sleighs function"""
+
+    def test_All_Problems(self):
+        """Check every problem is reported at once
+
+        Check duplicate names, duplicate email addresses, invalid email
+        addresses, and names missing email addresses are all reported."""
+        santas = ["A", "B", "A", "Cs", "D", "E"]
+        reindeers = ["a@test.me", "a@test.me", "b@test.me", "c.test.me"]
+        self.assertEqual(secret_santa_mailer.inspect_sleighs(santas, reindeers),
+                         {"santas": 6,
+                          "impostors": ["A"],
+                          "twins": ["a@test.me"],
+                          "resting_santas": 0,
+                          "resting_reindeers": ["D", "E"],
+                          "poorly_reindeers": ["Cs"]})
+
+    def test_Pass(self):
+        """Check nothing is reported for healthy reindeers
+
+        Check missing names are counted, and nothing else is reported."""
+        self.assertEqual(secret_santa_mailer.inspect_sleighs(
+            ["A", "B"], ["a@test.me", "b@test.me", "c@test.me"]),
+            {"santas": 2, "impostors": [], "twins": [], "resting_santas": 1,
+             "resting_reindeers": [], "poorly_reindeers": []})
+
+
 class FindSleighsTest(unittest.TestCase):
     """Unit tests for the find_sleighs function"""
 
@@ -174,50 +342,828 @@ class MimeGiphyTest(unittest.TestCase):
         self.assertEqual(cm.exception.code, 403)
 
 
+class GiphyCacheTest(unittest.TestCase):
+    """Unit tests for the GiphyCache class, and its use by mime_giphy"""
+
+    def setUp(self):
+        """Set up a temporary cache folder, a fake GIPHY API token, and a
+        local GIPHY stub"""
+        self.cache_folder = tempfile.TemporaryDirectory()
+        secret_santa_mailer.giphy_api_token = "Test"
+        self.giphy_stub = stand_ins_secret_santa_mailer.start_giphy_stub()
+        self.giphy_api_url = secret_santa_mailer.giphy_api_url
+        secret_santa_mailer.giphy_api_url = self.giphy_stub.api_url
+
+    def tearDown(self):
+        """Remove the cache, and stop the local GIPHY stub"""
+        secret_santa_mailer.giphy_api_url = self.giphy_api_url
+        secret_santa_mailer.giphy_cache = None
+        self.giphy_stub.shutdown()
+        self.giphy_stub.server_close()
+        self.cache_folder.cleanup()
+
+    def add_gif(self, giphy_cache, giphy_id, size):
+        """Add a tiny GIF, padded to a given size, to a cache"""
+        gif_filename = os.path.join(self.cache_folder.name, "new.gif")
+        with open(gif_filename, "wb") as f:
+            f.write(stand_ins_secret_santa_mailer.tiny_gif.ljust(size, b"\0"))
+        giphy_cache.add(giphy_id, "https://giphy.test/" + giphy_id,
+                        gif_filename)
+
+    def test_Evict(self):
+        """Check the least recently used GIFs are evicted
+
+        Check the cache stays within its budget, keeps recently used GIFs, and
+        its index is kept for the next run."""
+        giphy_cache = secret_santa_mailer.GiphyCache(self.cache_folder.name,
+                                                     budget=300)
+        for giphy_id in ["a", "b", "c"]:
+            self.add_gif(giphy_cache, giphy_id, 100)
+        self.assertEqual(len(giphy_cache.get("a")), 100)
+        self.add_gif(giphy_cache, "d", 100)
+        self.assertEqual(giphy_cache.get("b"), None)
+        self.assertEqual(os.path.exists(giphy_cache.gif_filename("b")), False)
+        giphy_cache.flush()
+        next_cache = secret_santa_mailer.GiphyCache(self.cache_folder.name,
+                                                    budget=300)
+        self.assertEqual(list(next_cache.gifs.keys()), ["c", "a", "d"])
+
+    def test_Batched_Index(self):
+        """Check the index is only saved in batches
+
+        Check adding GIFs doesn't save the index until a batch has built up,
+        or the cache is flushed."""
+        giphy_cache = secret_santa_mailer.GiphyCache(self.cache_folder.name,
+                                                     save_every=3)
+        for giphy_id in ["a", "b"]:
+            self.add_gif(giphy_cache, giphy_id, 100)
+        self.assertEqual(os.path.exists(giphy_cache.index_filename), False)
+        self.add_gif(giphy_cache, "c", 100)
+        self.add_gif(giphy_cache, "d", 100)
+        next_cache = secret_santa_mailer.GiphyCache(self.cache_folder.name)
+        self.assertEqual(list(next_cache.gifs.keys()), ["a", "b", "c"])
+        giphy_cache.flush()
+        next_cache = secret_santa_mailer.GiphyCache(self.cache_folder.name)
+        self.assertEqual(list(next_cache.gifs.keys()), ["a", "b", "c", "d"])
+
+    def test_Keep(self):
+        """Check downloaded GIFs are kept in the cache
+
+        Check mime_giphy adds every GIF it downloads to the cache."""
+        secret_santa_mailer.giphy_cache = secret_santa_mailer.GiphyCache(
+            self.cache_folder.name)
+        _, _, giphy_id = secret_santa_mailer.mime_giphy()
+        self.assertEqual(secret_santa_mailer.giphy_cache.get(giphy_id),
+                         stand_ins_secret_santa_mailer.tiny_gif)
+
+    def test_Fallback(self):
+        """Check cached GIFs are used when GIPHY is unavailable
+
+        Check mime_giphy uses a cached GIF with fallback turned on, and
+        throws an error without it."""
+        secret_santa_mailer.giphy_cache = secret_santa_mailer.GiphyCache(
+            self.cache_folder.name, fallback=True)
+        self.add_gif(secret_santa_mailer.giphy_cache, "a", 100)
+        self.giphy_stub.shutdown()
+        self.giphy_stub.server_close()
+        _, giphy_link, giphy_id = secret_santa_mailer.mime_giphy()
+        self.assertEqual((giphy_link, giphy_id), ("https://giphy.test/a", "a"))
+        secret_santa_mailer.giphy_cache.fallback = False
+        with self.assertRaises(URLError):
+            secret_santa_mailer.mime_giphy()
+
+
+class SantasPictureTest(unittest.TestCase):
+    """Unit tests for the SantasPicture class, and its use by mime_giphy"""
+
+    def setUp(self):
+        """Set up a fake GIPHY API token, and a local GIPHY stub"""
+        secret_santa_mailer.giphy_api_token = "Test"
+        self.giphy_stub = stand_ins_secret_santa_mailer.start_giphy_stub()
+        self.giphy_api_url = secret_santa_mailer.giphy_api_url
+        secret_santa_mailer.giphy_api_url = self.giphy_stub.api_url
+
+    def tearDown(self):
+        """Stop the local GIPHY stub"""
+        secret_santa_mailer.giphy_api_url = self.giphy_api_url
+        self.giphy_stub.shutdown()
+        self.giphy_stub.server_close()
+
+    def test_As_String(self):
+        """Check the picture is only turned into text once
+
+        Check the same text is returned every time, and it's the same as a
+        plain MIME image's."""
+        santas_picture = secret_santa_mailer.SantasPicture(
+            stand_ins_secret_santa_mailer.tiny_gif)
+        santas_picture.add_header("Content-ID", "<Test>")
+        mime_picture = MIMEImage(stand_ins_secret_santa_mailer.tiny_gif)
+        mime_picture.add_header("Content-ID", "<Test>")
+        self.assertIs(santas_picture.as_string(), santas_picture.as_string())
+        self.assertEqual(santas_picture.as_string(), mime_picture.as_string())
+
+    def test_No_Files(self):
+        """Check GIFs are downloaded into memory, without any files saved"""
+        images = set(os.listdir("./images"))
+        santas_picture, _, giphy_id = secret_santa_mailer.mime_giphy()
+        self.assertIsInstance(santas_picture, secret_santa_mailer.SantasPicture)
+        self.assertEqual(santas_picture.get_payload(decode=True),
+                         stand_ins_secret_santa_mailer.tiny_gif)
+        self.assertEqual(set(os.listdir("./images")), images)
+
+
+class GiphyBudgetTest(unittest.TestCase):
+    """Unit tests for the GiphyBudget class, and its use by mime_giphy"""
+
+    def setUp(self):
+        """Set up a fake GIPHY API token, and a local GIPHY stub with three
+        renditions of each GIF"""
+        secret_santa_mailer.giphy_api_token = "Test"
+        self.giphy_stub = stand_ins_secret_santa_mailer.start_giphy_stub(
+            renditions={"fixed_height_downsampled": 400000,
+                        "fixed_height_small": 60000,
+                        "fixed_height_small_still": 8000})
+        self.giphy_api_url = secret_santa_mailer.giphy_api_url
+        secret_santa_mailer.giphy_api_url = self.giphy_stub.api_url
+
+    def tearDown(self):
+        """Remove the budget, and stop the local GIPHY stub"""
+        secret_santa_mailer.giphy_api_url = self.giphy_api_url
+        secret_santa_mailer.giphy_budget = None
+        self.giphy_stub.shutdown()
+        self.giphy_stub.server_close()
+
+    def test_No_Budget(self):
+        """Check the "fixed_height_downsampled" rendition is used by default"""
+        santas_picture, giphy_link, _ = secret_santa_mailer.mime_giphy()
+        self.assertTrue(giphy_link.endswith("/fixed_height_downsampled.gif"))
+        self.assertEqual(len(santas_picture.get_payload(decode=True)), 400000)
+
+    def test_Budget(self):
+        """Check the best rendition that fits is used
+
+        Check renditions GIPHY says are too big aren't downloaded, a still
+        image is used if no GIF fits, and the bytes saved are tallied."""
+        giphy_budget = secret_santa_mailer.GiphyBudget(100 * 1024)
+        secret_santa_mailer.giphy_budget = giphy_budget
+        santas_picture, giphy_link, _ = secret_santa_mailer.mime_giphy()
+        self.assertTrue(giphy_link.endswith("/fixed_height_small.gif"))
+        self.assertEqual(self.giphy_stub.requests, {"random": 1, "media": 1})
+        giphy_budget.budget = 20 * 1024
+        santas_picture, giphy_link, _ = asyncio.run(
+            secret_santa_mailer.mime_giphy_async())
+        self.assertTrue(giphy_link.endswith("/fixed_height_small_still.gif"))
+        self.assertEqual(len(santas_picture.get_payload(decode=True)), 8000)
+        self.assertEqual(giphy_budget.gifs, 2)
+        self.assertEqual(giphy_budget.bytes_saved,
+                         2 * giphy_budget.letter_bytes(400000) -
+                         giphy_budget.letter_bytes(60000) -
+                         giphy_budget.letter_bytes(8000))
+
+    def test_Unknown_Sizes(self):
+        """Check renditions are downloaded until one fits, if GIPHY doesn't
+        give their sizes"""
+        self.giphy_stub.report_sizes = False
+        secret_santa_mailer.giphy_budget = secret_santa_mailer.GiphyBudget(
+            100 * 1024)
+        _, giphy_link, _ = secret_santa_mailer.mime_giphy()
+        self.assertTrue(giphy_link.endswith("/fixed_height_small.gif"))
+        self.assertEqual(self.giphy_stub.requests, {"random": 1, "media": 2})
+
+    def test_Link_Only(self):
+        """Check GIFs that are only linked to aren't downloaded
+
+        Check no MIME image is made, and the whole GIF counts as saved."""
+        giphy_budget = secret_santa_mailer.GiphyBudget(link_only=True)
+        secret_santa_mailer.giphy_budget = giphy_budget
+        santas_picture, giphy_link, _ = secret_santa_mailer.mime_giphy()
+        self.assertIsNone(santas_picture)
+        self.assertTrue(giphy_link.endswith("/fixed_height_downsampled.gif"))
+        self.assertEqual(self.giphy_stub.requests, {"random": 1, "media": 0})
+        self.assertEqual(giphy_budget.report(),
+                         giphy_budget.letter_bytes(400000))
+
+
+class GiphyClientTest(unittest.TestCase):
+    """Unit tests for the GiphyClient class, and its use by mime_giphy"""
+
+    def setUp(self):
+        """Set up a fake GIPHY API token, a local GIPHY stub, and a client"""
+        secret_santa_mailer.giphy_api_token = "Test"
+        self.giphy_stub = stand_ins_secret_santa_mailer.start_giphy_stub(
+            api_key="Test")
+        self.giphy_api_url = secret_santa_mailer.giphy_api_url
+        secret_santa_mailer.giphy_api_url = self.giphy_stub.api_url
+        self.giphy_client = secret_santa_mailer.GiphyClient(backoff=0)
+
+    def tearDown(self):
+        """Close the client, and stop the local GIPHY stub"""
+        secret_santa_mailer.giphy_api_url = self.giphy_api_url
+        secret_santa_mailer.giphy_client = None
+        self.giphy_client.close()
+        self.giphy_stub.shutdown()
+        self.giphy_stub.server_close()
+
+    def test_Keep_Alive(self):
+        """Check every GIPHY request, and GIF download share one connection"""
+        secret_santa_mailer.giphy_client = self.giphy_client
+        for _ in range(3):
+            santas_picture, _, _ = secret_santa_mailer.mime_giphy()
+            self.assertEqual(santas_picture.get_payload(decode=True),
+                             stand_ins_secret_santa_mailer.tiny_gif)
+        self.assertEqual(self.giphy_stub.requests, {"random": 3, "media": 3})
+        self.assertEqual(self.giphy_stub.connections, 1)
+        self.assertEqual(self.giphy_client.opened, 1)
+
+    def test_Stale_Connection(self):
+        """Check a kept-alive connection that has since closed is replaced"""
+        giphy_url = self.giphy_stub.api_url + "?api_key=Test"
+        self.giphy_client.get(giphy_url)
+        for santas_connections in self.giphy_client.idle.values():
+            for santas_connection in santas_connections:
+                santas_connection.sock.close()
+        self.giphy_client.get(giphy_url, retries=0)
+        self.assertEqual(self.giphy_stub.requests["random"], 2)
+        self.assertEqual(self.giphy_client.opened, 2)
+
+    def test_Retry(self):
+        """Check GIPHY being unavailable is tried again, until it gives up"""
+        giphy_url = self.giphy_stub.api_url + "?api_key=Test"
+        self.giphy_stub.failures = 2
+        giphy_data = json.loads(self.giphy_client.get(giphy_url))
+        self.assertIn("id", giphy_data["data"])
+        self.giphy_stub.failures = 2
+        with self.assertRaises(HTTPError) as e:
+            self.giphy_client.get(giphy_url, retries=1)
+        self.assertEqual(e.exception.code, 503)
+        self.assertEqual(self.giphy_stub.connections, 1)
+
+    def test_Errors(self):
+        """Check errors are thrown like "urllib.request.urlopen"
+
+        Check bad API tokens aren't tried again, and hosts that can't be
+        reached, or are too slow throw a URLError, and a TimeoutError."""
+        with self.assertRaises(HTTPError) as e:
+            self.giphy_client.get(self.giphy_stub.api_url + "?api_key=Bad")
+        self.assertEqual(e.exception.code, 403)
+        with socket.socket() as closed_socket:
+            closed_socket.bind(("localhost", 0))
+            closed_port = closed_socket.getsockname()[1]
+        with self.assertRaises(URLError):
+            self.giphy_client.get("http://localhost:" + str(closed_port) +
+                                  "/v1/gifs/random", retries=0)
+        self.giphy_stub.latency = 0.5
+        with self.assertRaises(TimeoutError):
+            self.giphy_client.get(self.giphy_stub.api_url + "?api_key=Test",
+                                  timeout=0.1, retries=0)
+
+
+class GiphyPoolTest(unittest.TestCase):
+    """Unit tests for the GiphyPool class, and its use by mime_giphy"""
+
+    def setUp(self):
+        """Set up a fake GIPHY API token, and a local GIPHY stub"""
+        secret_santa_mailer.giphy_api_token = "Test"
+        self.giphy_stub = stand_ins_secret_santa_mailer.start_giphy_stub()
+        self.giphy_api_url = secret_santa_mailer.giphy_api_url
+        secret_santa_mailer.giphy_api_url = self.giphy_stub.api_url
+
+    def tearDown(self):
+        """Remove the pool, and stop the local GIPHY stub"""
+        secret_santa_mailer.giphy_api_url = self.giphy_api_url
+        secret_santa_mailer.giphy_pool = None
+        self.giphy_stub.shutdown()
+        self.giphy_stub.server_close()
+
+    def test_Pool(self):
+        """Check GIFs are only fetched for the pool
+
+        Check the pool fetches each of its GIFs once, and letters are then
+        given GIFs from the pool, without asking GIPHY again."""
+        giphy_pool = secret_santa_mailer.GiphyPool(4)
+        secret_santa_mailer.giphy_pool = giphy_pool
+        self.assertEqual(giphy_pool.fill(), 4)
+        self.assertEqual(self.giphy_stub.requests, {"random": 4, "media": 4})
+        pooled_gifs = [secret_santa_mailer.mime_giphy() for _ in range(20)]
+        self.assertEqual(self.giphy_stub.requests, {"random": 4, "media": 4})
+        for giphy in pooled_gifs:
+            self.assertIn(giphy, giphy_pool.gifs)
+
+    def test_Round_Robin(self):
+        """Check every GIF in a round-robin pool is used equally"""
+        giphy_pool = secret_santa_mailer.GiphyPool(3, "round-robin")
+        secret_santa_mailer.giphy_pool = giphy_pool
+        giphy_pool.fill()
+        giphy_ids = [asyncio.run(secret_santa_mailer.mime_giphy_async())[2]
+                     for _ in range(6)]
+        self.assertEqual(giphy_ids, [giphy_id for _, _, giphy_id in
+                                     giphy_pool.gifs] * 2)
+
+    def test_Failures(self):
+        """Check GIFs that can't be fetched are skipped
+
+        Check an empty pool is left if GIPHY rejects every request, so each
+        letter tries GIPHY itself instead."""
+        secret_santa_mailer.giphy_api_token = "Bad"
+        self.giphy_stub.api_key = "Test"
+        giphy_pool = secret_santa_mailer.GiphyPool(2)
+        secret_santa_mailer.giphy_pool = giphy_pool
+        self.assertEqual(giphy_pool.fill(), 0)
+        with self.assertRaises(HTTPError):
+            secret_santa_mailer.mime_giphy()
+
+
+class MimeGiphyAsyncTest(unittest.TestCase):
+    """Unit tests for the mime_giphy_async function"""
+
+    def setUp(self):
+        """Set up a fake GIPHY API token, and a local GIPHY stub"""
+        secret_santa_mailer.giphy_api_token = "Test"
+        self.giphy_stub = stand_ins_secret_santa_mailer.start_giphy_stub(
+            api_key="Test")
+        self.giphy_api_url = secret_santa_mailer.giphy_api_url
+        secret_santa_mailer.giphy_api_url = self.giphy_stub.api_url
+
+    def tearDown(self):
+        """Stop the local GIPHY stub"""
+        secret_santa_mailer.giphy_api_url = self.giphy_api_url
+        self.giphy_stub.shutdown()
+        self.giphy_stub.server_close()
+
+    def test_Stub(self):
+        """Check a GIF is downloaded into a MIME image
+
+        Check the MIME image holds the GIF, and its Content ID matches the
+        GIPHY ID."""
+        santas_picture, giphy_link, giphy_id = asyncio.run(
+            secret_santa_mailer.mime_giphy_async())
+        self.assertEqual(santas_picture.get_payload(decode=True),
+                         stand_ins_secret_santa_mailer.tiny_gif)
+        self.assertEqual(santas_picture["Content-ID"], "<" + giphy_id + ">")
+        self.assertEqual(giphy_link.endswith(giphy_id + ".gif"), True)
+
+    def test_Bad_Key(self):
+        """Check the URL request
+
+        Check for a HTTP 403 error when a bad GIPHY API token is submitted."""
+        secret_santa_mailer.giphy_api_token = "Bad"
+        with self.assertRaises(HTTPError) as cm:
+            asyncio.run(secret_santa_mailer.mime_giphy_async())
+        self.assertEqual(cm.exception.code, 403)
+
+    def test_Keep(self):
+        """Check downloaded GIFs are kept in the cache
+
+        Check mime_giphy_async adds the GIF it downloads to the cache."""
+        with tempfile.TemporaryDirectory() as folder:
+            secret_santa_mailer.giphy_cache = secret_santa_mailer.GiphyCache(
+                folder)
+            try:
+                _, _, giphy_id = asyncio.run(
+                    secret_santa_mailer.mime_giphy_async())
+                self.assertEqual(
+                    secret_santa_mailer.giphy_cache.get(giphy_id),
+                    stand_ins_secret_santa_mailer.tiny_gif)
+            finally:
+                secret_santa_mailer.giphy_cache = None
+
+    def test_Stalled(self):
+        """Check a stalled GIPHY connection times out
+
+        Check the request gives up after the GIPHY client's timeout, rather
+        than waiting forever."""
+        self.giphy_stub.latency = 1
+        secret_santa_mailer.giphy_client = secret_santa_mailer.GiphyClient(
+            timeout=0.1)
+        try:
+            with self.assertRaises(TimeoutError):
+                asyncio.run(secret_santa_mailer.mime_giphy_async())
+        finally:
+            secret_santa_mailer.giphy_client = None
+
+
 class SecretSantaRandomiserTest(unittest.TestCase):
     """Unit tests for the secret_santa_randomiser function"""
 
     def test_Odd_Santas(self):
         """Check function runs with an odd number of Secret Santas
 
-        Test function with odd number of Secret Santas, looping over 10,000
-        times to ensure randomisation process operates correctly."""
-        santas = ["A", "B", "C", "D", "E", "F", "G", "H", "I", "J", "K", "L", 
-                  "M", "N", "O", "P", "Q", "R", "S", "T", "U", "V", "W", "X", 
-                  "Y"]
-        reindeers = ["a", "b", "c", "d", "e", "f", "g", "h", "i", "j", "k", 
-                     "l", "m", "n", "o", "p", "q", "r", "s", "t", "u", "v", 
-                     "w", "x", "y"]
-        sleighs = dict(zip(santas, reindeers))
-        for i in range(9999):
-            pairings = secret_santa_mailer.secret_santa_randomiser(sleighs)
-            self.assertEqual(len(pairings.keys()), 25)
-            self.assertEqual(len(pairings.values()), 25)
-            self.assertEqual(set(sleighs.keys()) == set(pairings.keys()), True)
-            self.assertEqual(set(sleighs.keys()) == set(pairings.values()),
-                             True)
-            self.assertEqual(pairings.keys() != pairings.values(), True)
+        Test function with odd number of Secret Santas, tallying 10,000 draws
+        to ensure randomisation process operates correctly."""
+        santas_tally = secret_santa_mailer.tally_draws(
+            secret_santa_mailer.secret_santa_randomiser, 25, 9999)
+        self.assertEqual(santas_tally.draws, 9999)
+        self.assertEqual(santas_tally.invalid, 0)
+        self.assertEqual(santas_tally.self_gifts, 0)
+        self.assertEqual(santas_tally.pairs.sum(axis=0).tolist(), [9999] * 25)
 
     def test_Even_Santas(self):
         """Check function runs with an even number of Secret Santas
 
-        Test function with even number of Secret Santas, looping over 10,000
-        times to ensure randomisation process operates correctly."""
-        santas = ["A", "B", "C", "D", "E", "F", "G", "H", "I", "J", "K", "L", 
-                  "M", "N", "O", "P", "Q", "R", "S", "T", "U", "V", "W", "X", 
-                  "Y", "Z"]
-        reindeers = ["a", "b", "c", "d", "e", "f", "g", "h", "i", "j", "k", 
-                     "l", "m", "n", "o", "p", "q", "r", "s", "t", "u", "v", 
-                     "w", "x", "y", "z"]
+        Test function with even number of Secret Santas, tallying 10,000 draws
+        to ensure randomisation process operates correctly."""
+        santas_tally = secret_santa_mailer.tally_draws(
+            secret_santa_mailer.secret_santa_randomiser, 26, 9999)
+        self.assertEqual(santas_tally.draws, 9999)
+        self.assertEqual(santas_tally.invalid, 0)
+        self.assertEqual(santas_tally.self_gifts, 0)
+        self.assertEqual(santas_tally.pairs.sum(axis=0).tolist(), [9999] * 26)
+
+
+class RandomSleighCycleTest(unittest.TestCase):
+    """Unit tests for the random_sleigh_cycle function"""
+
+    def test_Single_Cycle(self):
+        """Check the shuffle is one single cycle
+
+        Check that following receivers from the first Secret Santa visits
+        everyone exactly once before coming back round."""
+        for n in [2, 3, 10, 101]:
+            sleigh_cycle = secret_santa_mailer.random_sleigh_cycle(n)
+            self.assertEqual(sorted(sleigh_cycle), list(range(n)))
+            visited = [0]
+            while sleigh_cycle[visited[-1]] != 0:
+                visited.append(sleigh_cycle[visited[-1]])
+            self.assertEqual(len(visited), n)
+
+    def test_Empty(self):
+        """Check an empty roster
+
+        Check that no Secret Santas gives an empty cycle."""
+        self.assertEqual(secret_santa_mailer.random_sleigh_cycle(0), [])
+
+
+class SecretSantaDerangementTest(unittest.TestCase):
+    """Unit tests for the secret_santa_derangement function"""
+
+    def test_Pairings(self):
+        """Check the function gives a valid set of pairings
+
+        Check everyone gives once, receives once, and never to themselves."""
+        santas = ["Santa " + str(i) for i in range(1001)]
+        reindeers = ["santa" + str(i) + "@test.me" for i in range(1001)]
         sleighs = dict(zip(santas, reindeers))
-        for i in range(9999):
-            pairings = secret_santa_mailer.secret_santa_randomiser(sleighs)
-            self.assertEqual(len(pairings.keys()), 26)
-            self.assertEqual(len(pairings.values()), 26)
-            self.assertEqual(set(sleighs.keys()) == set(pairings.keys()), True)
-            self.assertEqual(set(sleighs.keys()) == set(pairings.values()),
-                             True)
-            self.assertEqual(pairings.keys() != pairings.values(), True)
+        for i in range(99):
+            pairings = secret_santa_mailer.secret_santa_derangement(sleighs)
+            self.assertEqual(set(pairings.keys()), set(santas))
+            self.assertEqual(set(pairings.values()), set(santas))
+            self.assertEqual(any(giver == receiver for giver, receiver in
+                                 pairings.items()), False)
+
+    def test_Two_Santas(self):
+        """Check the function with only two Secret Santas
+
+        Check that two Secret Santas always give to each other."""
+        sleighs = {"A": "a", "B": "b"}
+        self.assertEqual(secret_santa_mailer.secret_santa_derangement(sleighs),
+                         {"A": "B", "B": "A"})
+
+
+class BatchSleighCyclesTest(unittest.TestCase):
+    """Unit tests for the batch_sleigh_cycles function"""
+
+    def test_Batch(self):
+        """Check every draw in a batch is a valid set of pairings
+
+        Check each row is a permutation with no Secret Santa giving to
+        themselves."""
+        sleigh_cycles = secret_santa_mailer.batch_sleigh_cycles(25, 9999)
+        self.assertEqual(sleigh_cycles.shape, (9999, 25))
+        self.assertEqual((numpy.sort(sleigh_cycles, axis=1) ==
+                          numpy.arange(25)).all(), True)
+        self.assertEqual((sleigh_cycles == numpy.arange(25)).any(), False)
+
+    def test_Many_Sizes(self):
+        """Check a batch over several roster sizes
+
+        Check one array of draws is returned per roster size."""
+        sleigh_cycles = secret_santa_mailer.batch_sleigh_cycles([2, 3, 26], 10)
+        self.assertEqual([cycles.shape for cycles in sleigh_cycles],
+                         [(10, 2), (10, 3), (10, 26)])
+
+    def test_Pairings(self):
+        """Check draws map back to dictionaries of names
+
+        Check one dictionary of pairings is returned per draw."""
+        sleighs = {"A": "a", "B": "b"}
+        sleigh_cycles = secret_santa_mailer.batch_sleigh_cycles(2, 3)
+        self.assertEqual(secret_santa_mailer.sleigh_cycle_pairings(
+            sleighs, sleigh_cycles), [{"A": "B", "B": "A"}] * 3)
+
+
+def rotate_sleighs(sleighs):
+    """Pair each Secret Santa with the next one along, every time
+
+    Args:
+        sleighs (dict): Dictionary with names as keys, and email addresses as
+            items.
+
+    Yields:
+        Dictionary with giver names as keys, and receiver names as items, like
+        "secret_santa_derangement", but always the same.
+    """
+    santas = list(sleighs.keys())
+    return dict(zip(santas, santas[1:] + santas[:1]))
+
+
+class SantasTallyTest(unittest.TestCase):
+    """Unit tests for the SantasTally class, and the tally_draws function"""
+
+    def test_Fair_Engines(self):
+        """Check the single cycle engines pass both fairness tests
+
+        Check a million batch draws, and the dictionary based engine, have
+        unremarkable chi-square statistics, and are always single cycles."""
+        for engine, k in [(secret_santa_mailer.batch_sleigh_cycles, 10 ** 6),
+                          (secret_santa_mailer.secret_santa_derangement,
+                           20000)]:
+            santas_report = secret_santa_mailer.tally_draws(
+                engine, 25, k).report("cycle")
+            self.assertEqual(santas_report["draws"], k)
+            self.assertEqual(santas_report["pairs"]["dof"], 575)
+            self.assertGreater(santas_report["pairs"]["p"], 1e-6)
+            self.assertEqual(santas_report["cycles"]["p"], 1.0)
+
+    def test_Biased_Engine(self):
+        """Check an engine that always draws the same pairings fails
+
+        Check the pairs test spots the bias, even though every draw is a valid
+        single cycle."""
+        santas_tally = secret_santa_mailer.tally_draws(rotate_sleighs, 5, 1000)
+        self.assertEqual(santas_tally.cycles.tolist(), [0, 1000, 0, 0, 0, 0])
+        self.assertLess(santas_tally.pairs_test()[2], 1e-6)
+        self.assertLess(santas_tally.cycles_test("derangement")[2], 1e-6)
+
+    def test_Bad_Draws(self):
+        """Check invalid draws, and self gifts are caught
+
+        Check draws that aren't permutations aren't tallied, and that anyone
+        giving to themselves fails both tests."""
+        santas_tally = secret_santa_mailer.SantasTally(3)
+        santas_tally.add(numpy.array([[1, 2, 0], [0, 2, 1], [1, 1, 0]]))
+        self.assertEqual((santas_tally.draws, santas_tally.invalid,
+                          santas_tally.self_gifts), (2, 1, 1))
+        self.assertEqual(santas_tally.cycles.tolist(), [0, 1, 1, 0])
+        self.assertEqual(santas_tally.pairs_test()[2], 0.0)
+        self.assertEqual(santas_tally.cycles_test()[2], 0.0)
+
+    def test_Derangement_Cycles(self):
+        """Check the expected shares of cycles for derangements
+
+        Check 4 Secret Santas have 6 single cycle derangements, and 3 with two
+        pairs."""
+        self.assertEqual(secret_santa_mailer.derangement_cycles(4),
+                         [0, 6 / 9, 3 / 9, 0, 0])
+        self.assertEqual(secret_santa_mailer.derangement_cycles(0), [1.0])
+
+    def test_Workers(self):
+        """Check tallies from several processes are added together
+
+        Check the draws are shared between the processes."""
+        santas_tally = secret_santa_mailer.tally_draws(
+            secret_santa_mailer.random_sleigh_cycle, 7, 1001, batch=100,
+            workers=2)
+        self.assertEqual(santas_tally.draws, 1001)
+        self.assertEqual(santas_tally.pairs.sum(), 7 * 1001)
+        self.assertEqual(santas_tally.cycles[1], 1001)
+
+
+class SecretSantaShardedTest(unittest.TestCase):
+    """Unit tests for the sharded_sleigh_cycle, and secret_santa_sharded
+    functions"""
+
+    def test_Single_Cycle(self):
+        """Check the sharded draw is one single cycle
+
+        Check that following receivers from the first Secret Santa visits
+        everyone exactly once, in one process, and over several."""
+        for n, shards, workers in [(2, None, 1), (10, 3, 1), (101, 7, 2),
+                                   (1000, 16, 2)]:
+            sleigh_cycle = secret_santa_mailer.sharded_sleigh_cycle(
+                n, shards, workers)
+            self.assertEqual(sorted(sleigh_cycle), list(range(n)))
+            visited = [0]
+            while sleigh_cycle[visited[-1]] != 0:
+                visited.append(sleigh_cycle[visited[-1]])
+            self.assertEqual(len(visited), n)
+        self.assertEqual(list(secret_santa_mailer.sharded_sleigh_cycle(0)), [])
+
+    def test_Shared_Memory_Full(self):
+        """Check memory blocks already made are unlinked if the next fails
+
+        Check the order is unlinked, when making the receivers fails, e.g. as
+        shared memory is full."""
+        santas_memories = []
+        make_memory = shared_memory.SharedMemory
+
+        def fake_shared_memory(*args, **kwargs):
+            """Make the first block, and fail to make the second"""
+            if santas_memories:
+                raise OSError(28, "No space left on device")
+            santas_memories.append(make_memory(*args, **kwargs))
+            return santas_memories[-1]
+
+        with patch.object(shared_memory, "SharedMemory", fake_shared_memory):
+            with self.assertRaises(OSError):
+                secret_santa_mailer.sharded_sleigh_cycle(100, 2, 1)
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name=santas_memories[0].name)
+
+    def test_Fair(self):
+        """Check pairings between shards are as likely as within them
+
+        Check the sharded draw passes both fairness tests."""
+        santas_report = secret_santa_mailer.tally_draws(functools.partial(
+            secret_santa_mailer.secret_santa_sharded, shards=3, workers=1),
+            7, 2000).report("cycle")
+        self.assertEqual(santas_report["draws"], 2000)
+        self.assertGreater(santas_report["pairs"]["p"], 1e-6)
+        self.assertEqual(santas_report["cycles"]["p"], 1.0)
+
+    def test_Roster(self):
+        """Check a compact roster's pairings stay compact
+
+        Check pairings of a "SantasRoster" are "SantasPairings"."""
+        santas_roster = secret_santa_mailer.SantasRoster(
+            ("Santa " + str(i), "") for i in range(100))
+        santa_pairings = secret_santa_mailer.secret_santa_sharded(
+            santas_roster, 4, 1)
+        self.assertIsInstance(santa_pairings,
+                              secret_santa_mailer.SantasPairings)
+        self.assertEqual(sorted(santa_pairings.values()),
+                         sorted(santas_roster))
+
+
+class LoadExclusionsTest(unittest.TestCase):
+    """Unit tests for the load_exclusions function"""
+
+    def test_Template(self):
+        """Check the exclusions template loads
+
+        Check each giver has a set of their excluded receivers."""
+        exclusions = secret_santa_mailer.load_exclusions(
+            "./templates/Secret_Santa_Exclusions_Template.csv")
+        self.assertEqual(exclusions, {"Name 1": {"Name 2"},
+                                      "Name 2": {"Name 1"},
+                                      "Name 3": {"Name 4"}})
+
+
+class SecretSantaExclusionsTest(unittest.TestCase):
+    """Unit tests for the secret_santa_exclusions function"""
+
+    def test_Exclusions(self):
+        """Check excluded pairings are never drawn
+
+        Check everyone gives once, receives once, never to themselves, and
+        never to anyone they're excluded from, including when only a few valid
+        pairings exist."""
+        sleighs = dict(zip("ABCDE", "abcde"))
+        exclusions = {"A": {"B", "C"}, "B": {"A", "C"}, "C": {"D"}}
+        for i in range(999):
+            pairings = secret_santa_mailer.secret_santa_exclusions(sleighs,
+                                                                   exclusions)
+            self.assertEqual(set(pairings.values()), set(sleighs.keys()))
+            for giver, receiver in pairings.items():
+                self.assertNotEqual(giver, receiver)
+                self.assertEqual(receiver in exclusions.get(giver, set()),
+                                 False)
+
+    def test_Impossible(self):
+        """Check impossible exclusions
+
+        Check a SystemExit and appropriate exit message are shown if there are
+        no valid pairings."""
+        sleighs = dict(zip("ABC", "abc"))
+        exclusions = {"A": {"B"}, "B": {"A", "C"}}
+        with self.assertRaises(SystemExit) as cm:
+            secret_santa_mailer.secret_santa_exclusions(sleighs, exclusions)
+        self.assertEqual(cm.exception.code, ("The elves can't untangle the " +
+                                             "sleighs! [No valid pairing " +
+                                             "for 1 Secret Santa(s) with " +
+                                             "these exclusions: B]"))
+
+    def test_Impossible_First(self):
+        """Check impossible exclusions are found before any random draws
+
+        Check the matching throws the error straight away, rather than after
+        every random draw is given up on."""
+        sleighs = {"Santa " + str(i): "" for i in range(1000)}
+        exclusions = {"Santa " + str(i): set(sleighs) - {"Santa 0"} for i in
+                      range(1, 3)}
+        randrange = secret_santa_mailer.random.Random.randrange
+        with patch.object(secret_santa_mailer.random.Random, "randrange",
+                          autospec=True, side_effect=randrange) as dice:
+            with self.assertRaises(SystemExit):
+                secret_santa_mailer.secret_santa_exclusions(sleighs,
+                                                            exclusions)
+        self.assertLess(dice.call_count, 1000)
+
+    def test_Fair_Exclusions(self):
+        """Check every valid pairing is equally likely with dense exclusions
+
+        Check 6 Secret Santas with 2 exclusions each never break them, and the
+        14 valid pairings are drawn equally often, by a chi-square test."""
+        exclusions = {0: {4, 5}, 1: {0, 2}, 2: {0, 5}, 3: {1, 5}, 4: {1, 2},
+                      5: {2, 4}}
+        engine = functools.partial(secret_santa_mailer.secret_santa_exclusions,
+                                   exclusions=exclusions)
+        santas_tally = secret_santa_mailer.tally_draws(engine, 6, 14000)
+        self.assertEqual((santas_tally.invalid, santas_tally.self_gifts),
+                         (0, 0))
+        for giver, receivers in exclusions.items():
+            self.assertEqual(santas_tally.pairs[giver, list(receivers)].sum(),
+                             0)
+        sleigh_cycles = secret_santa_mailer.engine_sleigh_cycles(engine, 6,
+                                                                 14000)
+        _, counts = numpy.unique(sleigh_cycles, axis=0, return_counts=True)
+        self.assertEqual(len(counts), 14)
+        statistic = ((counts - 1000) ** 2 / 1000).sum()
+        self.assertGreater(secret_santa_mailer.chi_square_p(statistic, 13),
+                           1e-6)
+
+
+    def test_Unfair(self):
+        """Check draws are only unfair when allowed
+
+        Check a SystemExit and appropriate exit message are shown if no fair
+        draw is found, and otherwise the fallback still avoids the
+        exclusions."""
+        exclusions = {0: {4, 5}, 1: {0, 2}, 2: {0, 5}, 3: {1, 5}, 4: {1, 2},
+                      5: {2, 4}}
+        sleighs = dict.fromkeys(range(6), "")
+        with self.assertRaises(SystemExit) as cm:
+            secret_santa_mailer.secret_santa_exclusions(sleighs, exclusions,
+                                                        attempts=0)
+        self.assertEqual(cm.exception.code, ("The elves can't draw fairly " +
+                                             "with these exclusions! [No " +
+                                             "valid pairing in 0 random " +
+                                             "draws, allow an unfair draw, " +
+                                             "where some pairings are more " +
+                                             "likely than others, or remove " +
+                                             "some exclusions]"))
+        pairings = secret_santa_mailer.secret_santa_exclusions(
+            sleighs, exclusions, attempts=0, fair=False)
+        self.assertEqual(set(pairings.values()), set(sleighs.keys()))
+        for giver, receiver in pairings.items():
+            self.assertNotIn(receiver, exclusions[giver] | {giver})
+
+
+class RepairPairingsTest(unittest.TestCase):
+    """Unit tests for the repair_pairings function"""
+
+    def test_Leave_Join(self):
+        """Check one Secret Santa leaving, and one joining a big draw
+
+        Check only a handful of pairings change, and the draw is still a single
+        cycle through everyone."""
+        sleighs = {"Santa " + str(i): "" for i in range(10000)}
+        old_pairings = secret_santa_mailer.secret_santa_derangement(sleighs)
+        santa_pairings = secret_santa_mailer.repair_pairings(
+            old_pairings, ["Santa 5"], ["Rudolph"])
+        self.assertEqual(len(santa_pairings), 10000)
+        self.assertNotIn("Santa 5", santa_pairings)
+        self.assertLessEqual(sum(santa_pairings[giver] != old_pairings.get(
+            giver) for giver in santa_pairings), 3)
+        santa, visited = santa_pairings["Rudolph"], 1
+        while santa != "Rudolph":
+            santa, visited = santa_pairings[santa], visited + 1
+        self.assertEqual(visited, 10000)
+
+    def test_Cycle_Of_Two(self):
+        """Check the other Secret Santa in a cycle of two is moved
+
+        Check they're spliced into another cycle, rather than left giving to
+        themselves."""
+        self.assertEqual(secret_santa_mailer.repair_pairings(
+            {"A": "B", "B": "A", "C": "D", "D": "C"}, ["A"]) in [
+            {"B": "D", "D": "C", "C": "B"}, {"D": "B", "B": "C", "C": "D"}],
+            True)
+        self.assertEqual(secret_santa_mailer.repair_pairings(
+            {"A": "B", "B": "A"}, ["A"], ["C"]), {"B": "C", "C": "B"})
+
+    def test_Exclusions(self):
+        """Check pairings that are now excluded are repaired
+
+        Check a giver now excluded from their receiver is moved, and anyone
+        joining isn't paired against their exclusions."""
+        self.assertEqual(secret_santa_mailer.repair_pairings(
+            {"A": "B", "B": "C", "C": "A"}, exclusions={"B": {"C"}}),
+            {"A": "C", "C": "B", "B": "A"})
+        santa_pairings = secret_santa_mailer.repair_pairings(
+            {"A": "B", "B": "C", "C": "A"}, joiners=["D"],
+            exclusions={"D": {"A", "B"}})
+        self.assertEqual(santa_pairings["D"], "C")
+
+    def test_No_Room(self):
+        """Check nobody is left without a receiver
+
+        Check a SystemExit and appropriate exit message are shown if the only
+        Secret Santa left has nobody to give to."""
+        with self.assertRaises(SystemExit) as cm:
+            secret_santa_mailer.repair_pairings({"A": "B", "B": "A"}, ["A"])
+        self.assertEqual(cm.exception.code, ("Santa can't fit everyone in! " +
+                                             "[No room for B, draw again " +
+                                             "instead]"))
 
 
 class ImportTemplateTest(unittest.TestCase):
@@ -227,18 +1173,1086 @@ class ImportTemplateTest(unittest.TestCase):
         pass
 
 
+class LetterSkeletonTest(unittest.TestCase):
+    """Unit tests for the LetterSkeleton class"""
+
+    def test_Same_Letter(self):
+        """Test LetterSkeleton writes the same letter as write_letter
+
+        Check each part of a letter from the skeleton decodes to the filled-in
+        templates, and the GIF, including names needing encoding."""
+        plain_body = secret_santa_mailer.import_template(".txt", "./templates")
+        html_body = secret_santa_mailer.import_template(".html", "./templates",
+                                                        "utf8")
+        letter_skeleton = secret_santa_mailer.LetterSkeleton(
+            "santa@test.me", plain_body, html_body)
+        santas_letter = email.message_from_string(letter_skeleton.write(
+            "elf@test.me", "Zoë ", "Noël=Claus", fake_mime_giphy()))
+        fields = {"giver": "Zoë ", "receiver": "Noël=Claus",
+                  "link": "https://giphy.test/tiny.gif", "id": "tiny",
+                  "src": "cid:tiny"}
+
+        self.assertEqual(santas_letter["From"], "santa@test.me")
+        self.assertEqual(santas_letter["To"], "elf@test.me")
+        self.assertEqual([part.get_content_type() for part in
+                          santas_letter.walk()],
+                         ["multipart/mixed", "multipart/alternative",
+                          "text/plain", "multipart/related", "text/html",
+                          "image/gif"])
+        plain_part, html_part, image_part = [part for part in
+                                             santas_letter.walk() if not
+                                             part.is_multipart()]
+        self.assertEqual(plain_part.get_payload(decode=True).decode("utf8"),
+                         plain_body.format(**fields))
+        self.assertEqual(html_part.get_payload(decode=True).decode("utf8"),
+                         html_body.format(**fields))
+        self.assertEqual(image_part.get_payload(decode=True),
+                         stand_ins_secret_santa_mailer.tiny_gif)
+        self.assertEqual(image_part["Content-ID"], "<tiny>")
+
+    def test_Link_Only(self):
+        """Check a letter linking to its GIF has no image
+
+        Check the HTML shows the GIF straight from its URL, and both writers
+        write the same parts."""
+        plain_body = secret_santa_mailer.import_template(".txt", "./templates")
+        html_body = secret_santa_mailer.import_template(".html", "./templates",
+                                                        "utf8")
+        letter_skeleton = secret_santa_mailer.LetterSkeleton(
+            "santa@test.me", plain_body, html_body)
+        giphy = (None, "https://giphy.test/tiny.gif", "tiny")
+        for santas_letter in [
+                email.message_from_string(letter_skeleton.write(
+                    "elf@test.me", "Zoë", "Noël", giphy)),
+                secret_santa_mailer.write_letter(
+                    "santa@test.me", "elf@test.me", "Zoë", "Noël", plain_body,
+                    html_body, giphy)]:
+            self.assertEqual([part.get_content_type() for part in
+                              santas_letter.walk()],
+                             ["multipart/mixed", "multipart/alternative",
+                              "text/plain", "multipart/related",
+                              "text/html"])
+            html_part = [part for part in santas_letter.walk()][4]
+            self.assertIn('<img src="https://giphy.test/tiny.gif"',
+                          html_part.get_payload(decode=True).decode("utf8"))
+
+
 class CallPostmanTest(unittest.TestCase):
     """Unit tests for the call_postman function"""
 
-    def test_future(self):
-        pass
+    def setUp(self):
+        """Set up a fake email password, a fake GIF, and a local SMTP sink"""
+        secret_santa_mailer.santas_key = "Test"
+        self.giphy = patch.object(secret_santa_mailer, "mime_giphy",
+                                  side_effect=fake_mime_giphy)
+        self.giphy.start()
+        self.smtp_sink = stand_ins_secret_santa_mailer.start_smtp_sink()
+        self.sleighs = {"Santa " + str(i): "santa" + str(i) + "@test.me"
+                        for i in range(5)}
+
+    def tearDown(self):
+        """Stop the fake GIF, and the local SMTP sink"""
+        self.giphy.stop()
+        self.smtp_sink.shutdown()
+        self.smtp_sink.server_close()
+
+    def test_Postman(self):
+        """Check all letters are delivered to another email server
+
+        Check every giver is sent exactly one letter through the local SMTP
+        sink, and each delivery is reported."""
+        pairings = secret_santa_mailer.secret_santa_derangement(self.sleighs)
+        deliveries = secret_santa_mailer.call_postman(
+            "santa@test.me", self.sleighs, pairings, "localhost",
+            self.smtp_sink.server_address[1], False)
+        self.assertEqual(set(delivery for delivery, _ in deliveries.values()),
+                         {"sent"})
+        self.assertEqual(sorted(rcpttos[0] for _, rcpttos, _ in
+                                self.smtp_sink.letters),
+                         sorted(self.sleighs.values()))
+
+    def test_Refused(self):
+        """Check a refused letter is recorded, rather than stopping the rest
+
+        Check the letter the email server refuses is recorded in the
+        deliveries, and the journal, and every other letter is still sent."""
+        self.smtp_sink.refused_recipients = {"santa2@test.me"}
+        pairings = secret_santa_mailer.secret_santa_derangement(self.sleighs)
+        with tempfile.TemporaryDirectory() as folder:
+            journal = os.path.join(folder, "santas_journal.jsonl")
+            santas_journal = secret_santa_mailer.SantasJournal(journal)
+            deliveries = secret_santa_mailer.call_postman(
+                "santa@test.me", self.sleighs, pairings, "localhost",
+                self.smtp_sink.server_address[1], False, santas_journal)
+            santas_journal.close()
+            delivered = secret_santa_mailer.SantasJournal.load_deliveries(
+                journal)
+        self.assertEqual([giver for giver, (delivery, _) in deliveries.items()
+                          if delivery != "sent"], ["Santa 2"])
+        self.assertEqual(delivered, set(self.sleighs) - {"Santa 2"})
+        self.assertEqual(len(self.smtp_sink.letters), 4)
+
+    def test_Out_Of_Stamps(self):
+        """Check the postman stops at the daily limit
+
+        Check the letters up to the limit are sent, the first letter over it
+        is recorded, and the rest are left for another day."""
+        pairings = secret_santa_mailer.secret_santa_derangement(self.sleighs)
+        santas_pacer = secret_santa_mailer.SantasPacer(per_day=3, rate=1000)
+        deliveries = secret_santa_mailer.call_postman(
+            "santa@test.me", self.sleighs, pairings, "localhost",
+            self.smtp_sink.server_address[1], False, pacer=santas_pacer)
+        self.assertEqual([delivery == "sent" for delivery, _ in
+                          deliveries.values()], [True, True, True, False])
+        self.assertEqual(len(self.smtp_sink.letters), 3)
+
+
+class CallPostmenTest(unittest.TestCase):
+    """Unit tests for the call_postmen function"""
+
+    def setUp(self):
+        """Set up a fake email password, a fake GIF, and a local SMTP sink"""
+        secret_santa_mailer.santas_key = "Test"
+        self.giphy = patch.object(secret_santa_mailer, "mime_giphy",
+                                  side_effect=fake_mime_giphy)
+        self.giphy.start()
+        self.smtp_sink = stand_ins_secret_santa_mailer.start_smtp_sink(
+            letters_per_connection=3)
+        self.sleighs = {"Santa " + str(i): "santa" + str(i) + "@test.me"
+                        for i in range(20)}
+
+    def tearDown(self):
+        """Stop the fake GIF, and the local SMTP sink"""
+        self.giphy.stop()
+        self.smtp_sink.shutdown()
+        self.smtp_sink.server_close()
+
+    def test_Postmen(self):
+        """Check all letters are delivered over several connections
+
+        Check every giver is sent exactly one letter, even though the sink
+        hangs up after every three letters."""
+        pairings = secret_santa_mailer.secret_santa_derangement(self.sleighs)
+        deliveries = secret_santa_mailer.call_postmen(
+            "santa@test.me", self.sleighs, pairings, 4, "localhost",
+            self.smtp_sink.server_address[1], False)
+        self.assertEqual(set(deliveries.keys()), set(self.sleighs.keys()))
+        self.assertEqual(set(delivery for delivery, _ in deliveries.values()),
+                         {"sent"})
+        self.assertEqual(sorted(rcpttos[0] for _, rcpttos, _ in
+                                self.smtp_sink.letters),
+                         sorted(self.sleighs.values()))
+
+    def test_No_Server(self):
+        """Check letters that can't be sent are reported
+
+        Check every giver has an error message if nobody is listening."""
+        port = self.smtp_sink.server_address[1]
+        self.smtp_sink.shutdown()
+        self.smtp_sink.server_close()
+        pairings = secret_santa_mailer.secret_santa_derangement(self.sleighs)
+        deliveries = secret_santa_mailer.call_postmen(
+            "santa@test.me", self.sleighs, pairings, 2, "localhost", port,
+            False, retries=0)
+        self.assertEqual("sent" in [delivery for delivery, _ in
+                                    deliveries.values()], False)
+
+
+class LetterPipelineTest(unittest.TestCase):
+    """Unit tests for the LetterPipeline class"""
+
+    def setUp(self):
+        """Set up a fake email password, and a local SMTP sink"""
+        secret_santa_mailer.santas_key = "Test"
+        self.smtp_sink = stand_ins_secret_santa_mailer.start_smtp_sink(
+            letters_per_connection=3)
+        self.santas_letters = {"Santa " + str(i): (
+            "santa" + str(i) + "@test.me", "Santa " + str(i),
+            "Santa " + str((i + 1) % 30)) for i in range(30)}
+
+    def tearDown(self):
+        """Stop the local SMTP sink"""
+        self.smtp_sink.shutdown()
+        self.smtp_sink.server_close()
+
+    @patch.object(secret_santa_mailer, "mime_giphy",
+                  side_effect=fake_mime_giphy)
+    def test_Pipeline(self, mime_giphy):
+        """Check all letters are delivered through the pipeline
+
+        Check every giver is sent exactly one letter, in spite of the sink
+        hanging up after every three letters, and no queue holds more than its
+        depth."""
+        letter_pipeline = secret_santa_mailer.LetterPipeline(
+            "santa@test.me", self.santas_letters, fetchers=2, writers=1,
+            postmen=2, depth=2, host="localhost",
+            port=self.smtp_sink.server_address[1], tls=False)
+        deliveries = letter_pipeline.run()
+        self.assertEqual(list(deliveries.keys()),
+                         list(self.santas_letters.keys()))
+        self.assertEqual(set(delivery for delivery, _ in deliveries.values()),
+                         {"sent"})
+        self.assertEqual(sorted(rcpttos[0] for _, rcpttos, _ in
+                                self.smtp_sink.letters),
+                         sorted(giver_mailbox for giver_mailbox, _, _ in
+                                self.santas_letters.values()))
+        for stage in letter_pipeline.stages:
+            self.assertLessEqual(letter_pipeline.peaks[stage], 2)
+        self.assertEqual(letter_pipeline.depths(),
+                         {"fetch": 0, "write": 0, "send": 0})
+
+    @patch.object(secret_santa_mailer, "mime_giphy",
+                  side_effect=HTTPError("", 403, "Forbidden", None, None))
+    def test_Lost_GIFs(self, mime_giphy):
+        """Check letters without a GIF are reported, rather than stopping the
+        pipeline"""
+        deliveries = secret_santa_mailer.LetterPipeline(
+            "santa@test.me", self.santas_letters, depth=2, host="localhost",
+            port=self.smtp_sink.server_address[1], tls=False).run()
+        self.assertEqual(len(deliveries), 30)
+        self.assertNotIn("sent", [delivery for delivery, _ in
+                                  deliveries.values()])
+        self.assertEqual(self.smtp_sink.letters, [])
+
+    @patch.object(secret_santa_mailer, "mime_giphy",
+                  side_effect=fake_mime_giphy)
+    def test_Refused_Letters(self, mime_giphy):
+        """Check letters the email server refuses are reported, and counted
+        once each"""
+        self.smtp_sink.refused_recipients = {"santa3@test.me",
+                                             "santa7@test.me"}
+        secret_santa_mailer.santas_stopwatch = (
+            secret_santa_mailer.SantasStopwatch())
+        try:
+            deliveries = secret_santa_mailer.LetterPipeline(
+                "santa@test.me", self.santas_letters, postmen=2, depth=2,
+                host="localhost", port=self.smtp_sink.server_address[1],
+                tls=False).run()
+            counters = secret_santa_mailer.santas_stopwatch.counters
+        finally:
+            secret_santa_mailer.santas_stopwatch = None
+        self.assertEqual([letter_key for letter_key, (delivery, _) in
+                          deliveries.items() if delivery != "sent"],
+                         ["Santa 3", "Santa 7"])
+        self.assertEqual((counters["letters_sent"], counters["letters_lost"]),
+                         (28, 2))
+
+
+class SantasStopwatchTest(unittest.TestCase):
+    """Unit tests for the SantasStopwatch class"""
+
+    def setUp(self):
+        """Set up a fake email password, a fake GIF, a local SMTP sink, and a
+        stopwatch"""
+        secret_santa_mailer.santas_key = "Test"
+        self.giphy = patch.object(secret_santa_mailer, "mime_giphy",
+                                  side_effect=fake_mime_giphy)
+        self.giphy.start()
+        self.smtp_sink = stand_ins_secret_santa_mailer.start_smtp_sink()
+        secret_santa_mailer.santas_stopwatch = (
+            secret_santa_mailer.SantasStopwatch(buckets=(0.1, 1)))
+
+    def tearDown(self):
+        """Stop the fake GIF, the local SMTP sink, and the stopwatch"""
+        self.giphy.stop()
+        self.smtp_sink.shutdown()
+        self.smtp_sink.server_close()
+        secret_santa_mailer.santas_stopwatch = None
+
+    def test_Report(self):
+        """Check the counts, and cumulative histogram buckets are reported"""
+        santas_stopwatch = secret_santa_mailer.santas_stopwatch
+        santas_stopwatch.count("retries")
+        santas_stopwatch.count("retries", 2)
+        for seconds in [0.05, 0.5, 0.5, 5]:
+            santas_stopwatch.observe("smtp", seconds)
+        self.assertEqual(santas_stopwatch.report(), {
+            "counters": {"retries": 3}, "gauges": {},
+            "histograms": {"smtp": {"buckets": {"0.1": 1, "1": 3, "+Inf": 4},
+                                    "sum": 6.05, "count": 4}}})
+
+    def test_Prometheus(self):
+        """Check the report is written in Prometheus' text format"""
+        santas_stopwatch = secret_santa_mailer.santas_stopwatch
+        santas_stopwatch.count("letters_sent", 2)
+        santas_stopwatch.observe("smtp", 0.5)
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, "santa.prom")
+            santas_stopwatch.write_prometheus(filename)
+            with open(filename, "r") as f:
+                self.assertEqual(f.read().splitlines(), [
+                    "# TYPE secret_santa_letters_sent_total counter",
+                    "secret_santa_letters_sent_total 2",
+                    "# TYPE secret_santa_smtp_seconds histogram",
+                    "secret_santa_smtp_seconds_bucket{le=\"0.1\"} 0",
+                    "secret_santa_smtp_seconds_bucket{le=\"1\"} 1",
+                    "secret_santa_smtp_seconds_bucket{le=\"+Inf\"} 1",
+                    "secret_santa_smtp_seconds_sum 0.5",
+                    "secret_santa_smtp_seconds_count 1"])
+
+    def test_Postmen(self):
+        """Check sending letters is timed, and counted
+
+        Check every letter sent is counted, with its bytes before line endings
+        are converted, and each letter is timed being written, and sent."""
+        sleighs = {"Santa " + str(i): "santa" + str(i) + "@test.me"
+                   for i in range(10)}
+        pairings = secret_santa_mailer.secret_santa_derangement(sleighs)
+        secret_santa_mailer.call_postmen(
+            "santa@test.me", sleighs, pairings, 2, "localhost",
+            self.smtp_sink.server_address[1], False)
+        santas_report = secret_santa_mailer.santas_stopwatch.report()
+        self.assertEqual(santas_report["counters"]["letters_sent"], 10)
+        self.assertEqual(santas_report["counters"]["bytes_sent"],
+                         sum(len(data.replace(b"\r\n", b"\n")) for _, _,
+                             data in self.smtp_sink.letters))
+        self.assertEqual(santas_report["histograms"]["letter"]["count"], 10)
+        self.assertEqual(santas_report["histograms"]["smtp"]["count"], 10)
+
+
+class SantasPacerTest(unittest.TestCase):
+    """Unit tests for the SantasPacer class, and the throttle_reply
+    function"""
+
+    def setUp(self):
+        """Set up a fake email password, a fake GIF, and a throttled local
+        SMTP sink"""
+        secret_santa_mailer.santas_key = "Test"
+        self.giphy = patch.object(secret_santa_mailer, "mime_giphy",
+                                  side_effect=fake_mime_giphy)
+        self.giphy.start()
+        self.smtp_sink = stand_ins_secret_santa_mailer.start_smtp_sink(
+            throttle=40)
+
+    def tearDown(self):
+        """Stop the fake GIF, and the local SMTP sink"""
+        self.giphy.stop()
+        self.smtp_sink.shutdown()
+        self.smtp_sink.server_close()
+
+    def test_Pace(self):
+        """Check letters are spaced out at the rate per minute"""
+        santas_pacer = secret_santa_mailer.SantasPacer(per_minute=600)
+        waits = [santas_pacer.reserve() for _ in range(5)]
+        for wait, expected in zip(waits, [0, 0.1, 0.2, 0.3, 0.4]):
+            self.assertAlmostEqual(wait, expected, places=2)
+
+    def test_Per_Day(self):
+        """Check a RuntimeError is raised past the daily limit"""
+        santas_pacer = secret_santa_mailer.SantasPacer(per_day=2, rate=1000)
+        santas_pacer.reserve()
+        santas_pacer.reserve()
+        with self.assertRaises(RuntimeError):
+            santas_pacer.reserve()
+
+    def test_Ledger(self):
+        """Check the daily limit holds across runs, over a rolling 24 hours
+
+        Check letters paced in an earlier run count towards the limit, and
+        letters more than 24 hours old don't, and are dropped from the
+        ledger."""
+        with tempfile.TemporaryDirectory() as folder:
+            ledger = os.path.join(folder, "santas_ledger.txt")
+            with open(ledger, "w") as f:
+                f.write(repr(time.time() - 90000) + "\n")
+            santas_pacer = secret_santa_mailer.SantasPacer(per_day=3,
+                                                           rate=1000,
+                                                           ledger=ledger)
+            for _ in range(2):
+                santas_pacer.reserve()
+                santas_pacer.stamp()
+            santas_pacer = secret_santa_mailer.SantasPacer(per_day=3,
+                                                           rate=1000,
+                                                           ledger=ledger)
+            santas_pacer.reserve()
+            santas_pacer.stamp()
+            with self.assertRaises(RuntimeError):
+                santas_pacer.reserve()
+            self.assertEqual(santas_pacer.posted, 1)
+            with open(ledger, "r") as f:
+                self.assertEqual(len(f.readlines()), 3)
+
+    def test_Release(self):
+        """Check letters that couldn't be sent don't count towards the daily
+        limit
+
+        Check a released slot can be used again, and only letters stamped as
+        sent are kept in the ledger."""
+        with tempfile.TemporaryDirectory() as folder:
+            ledger = os.path.join(folder, "santas_ledger.txt")
+            santas_pacer = secret_santa_mailer.SantasPacer(per_day=2,
+                                                           rate=1000,
+                                                           ledger=ledger)
+            for _ in range(3):
+                santas_pacer.reserve()
+                santas_pacer.release()
+            santas_pacer.reserve()
+            santas_pacer.stamp()
+            santas_pacer.reserve()
+            santas_pacer.stamp()
+            with self.assertRaises(RuntimeError):
+                santas_pacer.reserve()
+            with open(ledger, "r") as f:
+                self.assertEqual(len(f.readlines()), 2)
+
+    def test_Failed_Letters(self):
+        """Check letters that couldn't be sent don't use up the daily limit
+
+        Check a letter the email server refuses leaves room for as many other
+        letters as the limit allows."""
+        self.smtp_sink.refused_recipients = {"santa0@test.me"}
+        santas_pacer = secret_santa_mailer.SantasPacer(per_day=2, rate=1000)
+        postbag = types.SimpleNamespace(santas_server=None)
+        delivery = secret_santa_mailer.deliver_letter(
+            postbag, "santa@test.me", "santa0@test.me", lambda: "Letter",
+            "localhost", self.smtp_sink.server_address[1], False,
+            pacer=santas_pacer)
+        self.assertNotEqual(delivery, "sent")
+        for i in range(1, 3):
+            self.assertEqual(secret_santa_mailer.deliver_letter(
+                postbag, "santa@test.me", "santa" + str(i) + "@test.me",
+                lambda: "Letter", "localhost",
+                self.smtp_sink.server_address[1], False, pacer=santas_pacer),
+                "sent")
+        postbag.santas_server.quit()
+        self.assertEqual(len(santas_pacer.stamps), 2)
+
+    def test_Slow_Down(self):
+        """Check the rate halves once per cooldown, and creeps back up to the
+        rate per minute"""
+        santas_pacer = secret_santa_mailer.SantasPacer(per_minute=600)
+        santas_pacer.slow_down()
+        santas_pacer.slow_down()
+        self.assertEqual(santas_pacer.rate, 5)
+        for _ in range(100):
+            santas_pacer.speed_up()
+        self.assertEqual(santas_pacer.rate, 10)
+
+    def test_Throttle_Reply(self):
+        """Check replies asking to slow down are told apart from other
+        failures"""
+        self.assertTrue(secret_santa_mailer.throttle_reply(
+            smtplib.SMTPDataError(451, b"4.7.0 Slow down")))
+        self.assertTrue(secret_santa_mailer.throttle_reply(
+            smtplib.SMTPRecipientsRefused({"a@test.me": (
+                450, b"4.2.1 Receiving mail too quickly")})))
+        self.assertTrue(secret_santa_mailer.throttle_reply(
+            smtplib.SMTPResponseException(421, b"Try again later")))
+        self.assertFalse(secret_santa_mailer.throttle_reply(
+            smtplib.SMTPDataError(451, b"4.3.0 Lost in the snow")))
+        self.assertFalse(secret_santa_mailer.throttle_reply(
+            smtplib.SMTPDataError(550, b"5.7.1 Go away")))
+        self.assertFalse(secret_santa_mailer.throttle_reply(
+            ConnectionError()))
+
+    def test_Throttled_Sink(self):
+        """Check letters are all sent to a throttled email server
+
+        Check the pacer slows down from a rate the sink won't accept, and
+        every letter is still sent."""
+        sleighs = {"Santa " + str(i): "santa" + str(i) + "@test.me"
+                   for i in range(60)}
+        pairings = secret_santa_mailer.secret_santa_derangement(sleighs)
+        santas_pacer = secret_santa_mailer.SantasPacer(rate=200)
+        deliveries = secret_santa_mailer.call_postmen(
+            "santa@test.me", sleighs, pairings, 4, "localhost",
+            self.smtp_sink.server_address[1], False, retries=5, backoff=0.05,
+            pacer=santas_pacer)
+        self.assertEqual(set(delivery for delivery, _ in deliveries.values()),
+                         {"sent"})
+        self.assertEqual(len(self.smtp_sink.letters), 60)
+        self.assertGreater(self.smtp_sink.refusals["throttled"], 0)
+        self.assertLess(santas_pacer.rate, 200)
+
+
+class SantasJournalTest(unittest.TestCase):
+    """Unit tests for the SantasJournal class"""
+
+    def setUp(self):
+        """Set up a fake email password, a fake GIF, a local SMTP sink, and a
+        temporary folder for the journal"""
+        secret_santa_mailer.santas_key = "Test"
+        self.giphy = patch.object(secret_santa_mailer, "mime_giphy",
+                                  side_effect=fake_mime_giphy)
+        self.giphy.start()
+        self.smtp_sink = stand_ins_secret_santa_mailer.start_smtp_sink()
+        self.santas_workshop = tempfile.TemporaryDirectory()
+        self.journal = os.path.join(self.santas_workshop.name, "journal.jsonl")
+
+    def tearDown(self):
+        """Stop the fake GIF, and the local SMTP sink, and remove the journal"""
+        self.giphy.stop()
+        self.smtp_sink.shutdown()
+        self.smtp_sink.server_close()
+        self.santas_workshop.cleanup()
+
+    def test_Load(self):
+        """Check the latest draw, and sent letters are loaded
+
+        Check letters that weren't sent, or were sent for an earlier draw, and
+        entries cut off by a crash are ignored."""
+        santas_journal = secret_santa_mailer.SantasJournal(self.journal)
+        santas_journal.record_draw({"A": "a@test.me"}, {"A": "A"})
+        santas_journal.record_delivery("A", "sent")
+        santas_journal.record_draw({"B": "b@test.me", "C": "c@test.me"},
+                                   {"B": "C", "C": "B"})
+        santas_journal.record_delivery("B", "sent")
+        santas_journal.record_delivery("C", "SMTPDataError()")
+        santas_journal.close()
+        with open(self.journal, "a") as f:
+            f.write('{"giver": "C", "deliv')
+        santas_journal = secret_santa_mailer.SantasJournal(self.journal)
+        santas_journal.record_delivery("A", "sent")
+        santas_journal.close()
+        self.assertEqual(secret_santa_mailer.SantasJournal.load(self.journal),
+                         ({"B": "b@test.me", "C": "c@test.me"},
+                          {"B": "C", "C": "B"}, {"A", "B"}))
+
+    @patch("builtins.input", return_value="Y")
+    def test_Resume(self, input):
+        """Check resuming only sends letters that weren't sent
+
+        Check a run where every letter is turned away can be resumed, sending
+        each letter once, to the same receiver."""
+        santas = ["Santa " + str(i) for i in range(8)]
+        reindeers = ["santa" + str(i) + "@test.me" for i in range(8)]
+        port = self.smtp_sink.server_address[1]
+        self.smtp_sink.failure_rate = 1
+        with self.assertRaises(SystemExit):
+            secret_santa_mailer.secret_santa_mailer(
+                santas, reindeers, "santa@test.me", postmen=2,
+                host="localhost", port=port, tls=False, journal=self.journal,
+                retries=0)
+        _, santa_pairings, _ = secret_santa_mailer.SantasJournal.load(
+            self.journal)
+
+        # Send half the letters, then resume
+        self.smtp_sink.failure_rate = 0
+        santas_journal = secret_santa_mailer.SantasJournal(self.journal)
+        for giver in santas[:4]:
+            santas_journal.record_delivery(giver, "sent")
+        santas_journal.close()
+        deliveries = secret_santa_mailer.secret_santa_mailer(
+            None, None, "santa@test.me", host="localhost", port=port,
+            tls=False, journal=self.journal, resume=True)
+        self.assertEqual(sorted(deliveries.keys()), santas[4:])
+        self.assertEqual(sorted(rcpttos[0] for _, rcpttos, _ in
+                                self.smtp_sink.letters), reindeers[4:])
+        self.assertEqual(secret_santa_mailer.SantasJournal.load(
+            self.journal)[1:], (santa_pairings, set(santas)))
+
+    def test_Retries(self):
+        """Check temporary failures are tried again
+
+        Check each letter is tried once, and then retried twice, when every
+        letter is turned away with a temporary error."""
+        sleighs = {"A": "a@test.me", "B": "b@test.me"}
+        self.smtp_sink.failure_rate = 1
+        deliveries = secret_santa_mailer.call_postmen(
+            "santa@test.me", sleighs, {"A": "B", "B": "A"}, 2, "localhost",
+            self.smtp_sink.server_address[1], False, retries=2, backoff=0.001)
+        self.assertEqual("sent" in [delivery for delivery, _ in
+                                    deliveries.values()], False)
+        self.assertEqual(self.smtp_sink.refusals["failed"], 6)
+
+    def test_Retry_Delay(self):
+        """Check only temporary failures are tried again
+
+        Check SMTP 4xx replies, dropped connections, and GIPHY rate limits are
+        tried again, with a growing wait, but not SMTP 5xx replies, bad GIPHY
+        tokens, or once out of retries."""
+        retry_delay = secret_santa_mailer.retry_delay
+        self.assertEqual(retry_delay(smtplib.SMTPDataError(451, "Later"), 0,
+                                     2, 1) >= 0.5, True)
+        self.assertEqual(retry_delay(ConnectionResetError(), 1, 2, 1) >= 1,
+                         True)
+        self.assertEqual(retry_delay(HTTPError("url", 429, "Slow down", {},
+                                               None), 0) is None, False)
+        self.assertEqual(retry_delay(smtplib.SMTPDataError(554, "No"), 0),
+                         None)
+        self.assertEqual(retry_delay(HTTPError("url", 403, "Bad key", {},
+                                               None), 0), None)
+        self.assertEqual(retry_delay(ConnectionResetError(), 2, 2), None)
+
+
+class SpoolLettersTest(unittest.TestCase):
+    """Unit tests for the spool_letters, and replay_spool functions"""
+
+    def setUp(self):
+        """Set up a fake email password, a fake GIF, and a local SMTP sink"""
+        secret_santa_mailer.santas_key = "Test"
+        self.giphy = patch.object(secret_santa_mailer, "mime_giphy",
+                                  side_effect=fake_mime_giphy)
+        self.giphy.start()
+        self.smtp_sink = stand_ins_secret_santa_mailer.start_smtp_sink(
+            letters_per_connection=4)
+        self.sleighs = {"Santa " + str(i): "santa" + str(i) + "@test.me"
+                        for i in range(9)}
+        self.sleighs["From Claus"] = "claus@test.me"
+
+    def tearDown(self):
+        """Stop the fake GIF, and the local SMTP sink"""
+        self.giphy.stop()
+        self.smtp_sink.shutdown()
+        self.smtp_sink.server_close()
+
+    def check_replay(self, spool, spool_format):
+        """Spool letters, replay them, and check they're unchanged
+
+        Args:
+            spool (str): Path to the spool.
+            spool_format (str): Either "mbox", or "maildir".
+        """
+        pairings = secret_santa_mailer.secret_santa_derangement(self.sleighs)
+        secret_santa_mailer.spool_letters("santa@test.me", self.sleighs,
+                                          pairings, spool, spool_format)
+        spooled = sorted(santas_letter for _, santas_letter in
+                         secret_santa_mailer.read_spool(spool))
+        deliveries = secret_santa_mailer.replay_spool(
+            "santa@test.me", spool, "localhost",
+            self.smtp_sink.server_address[1], False)
+        self.assertEqual(set(delivery for delivery, _ in deliveries.values()),
+                         {"sent"})
+        self.assertEqual(sorted(rcpttos[0] for _, rcpttos, _ in
+                                self.smtp_sink.letters),
+                         sorted(self.sleighs.values()))
+        self.assertEqual(sorted(data.decode("utf8").replace("\r\n", "\n")
+                                for _, _, data in self.smtp_sink.letters),
+                         spooled)
+        return spooled
+
+    def test_Mbox(self):
+        """Check letters spooled to an mbox file are replayed unchanged
+
+        Check every giver is sent their spooled letter, including "From "
+        lines, and the spool can be read as a standard mbox file."""
+        with tempfile.TemporaryDirectory() as santas_workshop:
+            spool = os.path.join(santas_workshop, "letters.mbox")
+            spooled = self.check_replay(spool, "mbox")
+            santas_sack = mailbox.mbox(spool)
+            self.assertEqual(len(santas_sack), 10)
+            santas_sack.close()
+        self.assertEqual(len([santas_letter for santas_letter in spooled
+                              if "\nFrom Claus" in santas_letter]), 2)
+
+    def test_Maildir(self):
+        """Check letters spooled to a Maildir folder are replayed unchanged
+
+        Check every giver is sent their spooled letter."""
+        with tempfile.TemporaryDirectory() as santas_workshop:
+            self.check_replay(os.path.join(santas_workshop, "letters"),
+                              "maildir")
+
+    def test_Replay_Journal(self):
+        """Check an interrupted replay doesn't resend letters
+
+        Check letters refused the first time are tried again on the next
+        replay, and letters already sent aren't."""
+        with tempfile.TemporaryDirectory() as santas_workshop:
+            spool = os.path.join(santas_workshop, "letters.mbox")
+            journal = os.path.join(santas_workshop, "journal.jsonl")
+            pairings = secret_santa_mailer.secret_santa_derangement(
+                self.sleighs)
+            secret_santa_mailer.spool_letters("santa@test.me", self.sleighs,
+                                              pairings, spool)
+            self.smtp_sink.refused_recipients = {"santa3@test.me"}
+            deliveries = secret_santa_mailer.replay_spool(
+                "santa@test.me", spool, "localhost",
+                self.smtp_sink.server_address[1], False, journal=journal,
+                backoff=0)
+            self.assertEqual(sum(delivery == "sent" for delivery, _ in
+                                 deliveries.values()), 9)
+            self.smtp_sink.refused_recipients = set()
+            deliveries = secret_santa_mailer.replay_spool(
+                "santa@test.me", spool, "localhost",
+                self.smtp_sink.server_address[1], False, journal=journal)
+            self.assertEqual([(giver_key.split()[0], delivery) for
+                              giver_key, (delivery, _) in deliveries.items()],
+                             [("santa3@test.me", "sent")])
+        self.assertEqual(sorted(rcpttos[0] for _, rcpttos, _ in
+                                self.smtp_sink.letters),
+                         sorted(self.sleighs.values()))
+
+    def test_Bad_Format(self):
+        """Check for unknown spool formats
+
+        Check a SystemExit and appropriate exit message are shown if the spool
+        format isn't known."""
+        with self.assertRaises(SystemExit) as cm:
+            secret_santa_mailer.spool_letters("santa@test.me", self.sleighs,
+                                              {}, "letters", "sack")
+        self.assertEqual(cm.exception.code, ("Santa doesn't know that sack! " +
+                                             "[Spool format must be mbox, " +
+                                             "or maildir]"))
 
 
 class SecretSantaMailerTest(unittest.TestCase):
     """Unit tests for the secret_santa_mailer function"""
 
-    def test_future(self):
-        pass
+    def setUp(self):
+        """Set up a fake email password, a fake GIF, and a local SMTP sink"""
+        secret_santa_mailer.santas_key = "Test"
+        self.giphy = patch.object(secret_santa_mailer, "mime_giphy",
+                                  side_effect=fake_mime_giphy)
+        self.giphy.start()
+        self.smtp_sink = stand_ins_secret_santa_mailer.start_smtp_sink(
+            latency=0.001)
+
+    def tearDown(self):
+        """Stop the fake GIF, and the local SMTP sink"""
+        self.giphy.stop()
+        self.smtp_sink.shutdown()
+        self.smtp_sink.server_close()
+
+    @patch("builtins.input", return_value="Y")
+    def test_Letters(self, input):
+        """Check every Secret Santa gets a letter with their receiver
+
+        Check each giver is sent one letter, naming a receiver who isn't
+        them."""
+        santas = ["Santa " + str(i) for i in range(10)]
+        reindeers = ["santa" + str(i) + "@test.me" for i in range(10)]
+        deliveries = secret_santa_mailer.secret_santa_mailer(
+            santas, reindeers, "santa@test.me", host="localhost",
+            port=self.smtp_sink.server_address[1], tls=False)
+        self.assertEqual(set(deliveries.keys()), set(santas))
+        self.assertEqual(sorted(rcpttos[0] for _, rcpttos, _ in
+                                self.smtp_sink.letters), sorted(reindeers))
+        for _, rcpttos, data in self.smtp_sink.letters:
+            santas_letter = email.message_from_bytes(data)
+            giver = santas[reindeers.index(rcpttos[0])]
+            plain_text = [part for part in santas_letter.walk()][2]
+            self.assertIn(giver, plain_text.get_payload(decode=True).decode(
+                "utf8"))
+
+    @patch("builtins.input", return_value="Y")
+    def test_Roster(self, input):
+        """Check every Secret Santa in a compact roster gets a letter, and the
+        draw is journalled"""
+        santas_roster = secret_santa_mailer.SantasRoster(
+            ("Santa " + str(i), "santa" + str(i) + "@test.me") for i in
+            range(10))
+        with tempfile.TemporaryDirectory() as santas_workshop:
+            journal = os.path.join(santas_workshop, "journal.jsonl")
+            deliveries = secret_santa_mailer.secret_santa_mailer(
+                santas_roster, None, "santa@test.me", host="localhost",
+                port=self.smtp_sink.server_address[1], tls=False,
+                journal=journal)
+            sleighs, _, delivered = secret_santa_mailer.SantasJournal.load(
+                journal)
+        self.assertEqual(set(deliveries.keys()), set(santas_roster))
+        self.assertEqual(sleighs, dict(santas_roster.items()))
+        self.assertEqual(delivered, set(santas_roster))
+        self.assertEqual(sorted(rcpttos[0] for _, rcpttos, _ in
+                                self.smtp_sink.letters),
+                         sorted(santas_roster.reindeers))
+
+    @patch("builtins.input", return_value="Y")
+    def test_Redraw(self, input):
+        """Check a redraw only sends the letters that changed
+
+        Check that after one Secret Santa leaves, and another joins, only the
+        givers with a new receiver, and the Secret Santa joining, are sent
+        letters, and the journal has the whole draw."""
+        santas = ["Santa " + str(i) for i in range(100)]
+        reindeers = ["santa" + str(i) + "@test.me" for i in range(100)]
+        with tempfile.TemporaryDirectory() as santas_workshop:
+            journal = os.path.join(santas_workshop, "journal.jsonl")
+            secret_santa_mailer.secret_santa_mailer(
+                santas, reindeers, "santa@test.me", host="localhost",
+                port=self.smtp_sink.server_address[1], tls=False,
+                journal=journal)
+            _, old_pairings, _ = secret_santa_mailer.SantasJournal.load(
+                journal)
+            self.smtp_sink.letters.clear()
+            deliveries = secret_santa_mailer.secret_santa_mailer(
+                santas[1:] + ["Rudolph"], reindeers[1:] + ["rudolph@test.me"],
+                "santa@test.me", host="localhost",
+                port=self.smtp_sink.server_address[1], tls=False,
+                journal=journal, redraw=True)
+            sleighs, santa_pairings, delivered = \
+                secret_santa_mailer.SantasJournal.load(journal)
+        self.assertEqual(set(santa_pairings), set(santas[1:] + ["Rudolph"]))
+        self.assertEqual(delivered, set(santa_pairings))
+        self.assertEqual(set(deliveries), {giver for giver in santa_pairings
+                                           if santa_pairings[giver] !=
+                                           old_pairings.get(giver)})
+        self.assertIn("Rudolph", deliveries)
+        self.assertLessEqual(len(self.smtp_sink.letters), 3)
+
+    @patch("builtins.input", return_value="Y")
+    def test_Pipeline(self, input):
+        """Check every Secret Santa gets a letter through the pipeline"""
+        santas = ["Santa " + str(i) for i in range(10)]
+        reindeers = ["santa" + str(i) + "@test.me" for i in range(10)]
+        deliveries = secret_santa_mailer.secret_santa_mailer(
+            santas, reindeers, "santa@test.me", postmen=2, host="localhost",
+            port=self.smtp_sink.server_address[1], tls=False, pipeline=True,
+            fetchers=2, depth=4)
+        self.assertEqual(set(deliveries.keys()), set(santas))
+        self.assertEqual(sorted(rcpttos[0] for _, rcpttos, _ in
+                                self.smtp_sink.letters), sorted(reindeers))
+
+    @patch("builtins.input", return_value="Y")
+    def test_Lost_Letters(self, input):
+        """Check letters turned away by the email server
+
+        Check a SystemExit and appropriate exit message are shown if the email
+        server turns every letter away."""
+        self.smtp_sink.failure_rate = 1
+        with self.assertRaises(SystemExit) as cm:
+            secret_santa_mailer.secret_santa_mailer(
+                ["A", "B", "C"], ["a@test.me", "b@test.me", "c@test.me"],
+                "santa@test.me", postmen=2, host="localhost",
+                port=self.smtp_sink.server_address[1], tls=False, retries=0)
+        self.assertEqual(cm.exception.code, ("Some letters got lost in the " +
+                                             "snow... [3 letter(s) not sent]"))
+        self.assertEqual(self.smtp_sink.refusals, {"throttled": 0,
+                                                   "failed": 3,
+                                                   "refused": 0})
+
+
+class SecretSantaMailerAsyncTest(unittest.TestCase):
+    """Unit tests for the secret_santa_mailer_async function"""
+
+    def setUp(self):
+        """Set up fake credentials, a local SMTP sink, and a GIPHY stub"""
+        secret_santa_mailer.santas_key = "Test"
+        secret_santa_mailer.giphy_api_token = "Test"
+        self.smtp_sink = stand_ins_secret_santa_mailer.start_smtp_sink(
+            letters_per_connection=5)
+        self.giphy_stub = stand_ins_secret_santa_mailer.start_giphy_stub()
+        self.giphy_api_url = secret_santa_mailer.giphy_api_url
+        secret_santa_mailer.giphy_api_url = self.giphy_stub.api_url
+
+    def tearDown(self):
+        """Stop the local SMTP sink, and GIPHY stub"""
+        secret_santa_mailer.giphy_api_url = self.giphy_api_url
+        for server in [self.smtp_sink, self.giphy_stub]:
+            server.shutdown()
+            server.server_close()
+
+    @patch("builtins.input", return_value="Y")
+    def test_Letters(self, input):
+        """Check every Secret Santa gets a letter with a GIF
+
+        Check each giver is sent one letter, with their receiver, and an
+        embedded GIF, even though the sink hangs up after every five
+        letters."""
+        santas = ["Santa " + str(i) for i in range(30)]
+        reindeers = ["santa" + str(i) + "@test.me" for i in range(30)]
+        secret_santa_mailer.secret_santa_mailer_async(
+            santas, reindeers, "santa@test.me", postmen=3, fetchers=4,
+            host="localhost", port=self.smtp_sink.server_address[1],
+            tls=False)
+        self.assertEqual(sorted(rcpttos[0] for _, rcpttos, _ in
+                                self.smtp_sink.letters), sorted(reindeers))
+        for _, rcpttos, data in self.smtp_sink.letters:
+            santas_letter = email.message_from_bytes(data)
+            self.assertEqual(santas_letter["To"], rcpttos[0])
+            self.assertEqual([part.get_content_type() for part in
+                              santas_letter.walk()][-1], "image/gif")
+        self.assertEqual(self.giphy_stub.requests, {"random": 30,
+                                                    "media": 30})
+
+    def test_Refused_Recipient(self):
+        """Check a refused recipient doesn't lose the next letter
+
+        Check the connection is reset after the email server refuses a
+        recipient, so every other letter sent over it is still delivered."""
+        self.smtp_sink.refused_recipients = {"santa4@test.me"}
+        sleighs = {"Santa " + str(i): "santa" + str(i) + "@test.me" for i in
+                   range(10)}
+        santa_pairings = secret_santa_mailer.secret_santa_derangement(sleighs)
+        deliveries = asyncio.run(secret_santa_mailer.call_postman_async(
+            "santa@test.me", sleighs, santa_pairings, postmen=1,
+            host="localhost", port=self.smtp_sink.server_address[1],
+            tls=False, retries=0))
+        self.assertIn("550", deliveries["Santa 4"][0])
+        self.assertEqual([giver for giver, (delivery, _) in deliveries.items()
+                          if delivery != "sent"], ["Santa 4"])
+        self.assertEqual(len(self.smtp_sink.letters), 9)
+        self.assertEqual(self.smtp_sink.refusals["refused"], 1)
+
+    def test_Bounded_Letters(self):
+        """Check only a pool of letters is in flight, and each is written once
+
+        Check no more than "postmen" plus "fetchers" letter tasks run at once,
+        and trying letters again doesn't download another GIF."""
+        self.smtp_sink.failure_rate = 1
+        sleighs = {"Santa " + str(i): "santa" + str(i) + "@test.me" for i in
+                   range(50)}
+        santa_pairings = secret_santa_mailer.secret_santa_derangement(sleighs)
+        running_tasks = []
+
+        async def fake_mime_giphy_async():
+            """Count the running tasks, and use a tiny GIF"""
+            running_tasks.append(len(asyncio.all_tasks()))
+            return fake_mime_giphy()
+
+        with patch.object(secret_santa_mailer, "mime_giphy_async",
+                          fake_mime_giphy_async):
+            deliveries = asyncio.run(secret_santa_mailer.call_postman_async(
+                "santa@test.me", sleighs, santa_pairings, postmen=2,
+                fetchers=3, host="localhost",
+                port=self.smtp_sink.server_address[1], tls=False, retries=2,
+                backoff=0))
+        self.assertEqual(list(deliveries), list(santa_pairings))
+        self.assertEqual(len(running_tasks), 50)
+        self.assertLessEqual(max(running_tasks), 2 + 3 + 1)
+        self.assertEqual(self.smtp_sink.refusals["failed"], 3 * 50)
+
+    def test_Off_Loop(self):
+        """Check the journal, and the pacer's ledger are written off the event
+        loop
+
+        Check every delivery is recorded, and every letter paced, in a thread
+        other than the event loop's, so they don't hold up other letters."""
+        sleighs = {"Santa " + str(i): "santa" + str(i) + "@test.me" for i in
+                   range(10)}
+        santa_pairings = secret_santa_mailer.secret_santa_derangement(sleighs)
+        santas_pacer = secret_santa_mailer.SantasPacer(rate=1000)
+        threads = []
+        with tempfile.TemporaryDirectory() as folder:
+            santas_journal = secret_santa_mailer.SantasJournal(
+                os.path.join(folder, "santas_journal.jsonl"))
+            record_delivery = santas_journal.record_delivery
+            reserve = santas_pacer.reserve
+
+            def record(*args):
+                """Note the thread, and record the delivery"""
+                threads.append(threading.current_thread())
+                return record_delivery(*args)
+
+            def pace():
+                """Note the thread, and reserve the letter's slot"""
+                threads.append(threading.current_thread())
+                return reserve()
+
+            santas_journal.record_delivery = record
+            santas_pacer.reserve = pace
+            deliveries = asyncio.run(secret_santa_mailer.call_postman_async(
+                "santa@test.me", sleighs, santa_pairings, postmen=2,
+                host="localhost", port=self.smtp_sink.server_address[1],
+                tls=False, journal=santas_journal, pacer=santas_pacer))
+            santas_journal.close()
+        self.assertEqual({delivery for delivery, _ in deliveries.values()},
+                         {"sent"})
+        self.assertEqual(len(threads), 20)
+        self.assertNotIn(threading.main_thread(), threads)
+
+
+class FindRostersTest(unittest.TestCase):
+    """Unit tests for the find_rosters function"""
+
+    def setUp(self):
+        """Set up a temporary folder of rosters"""
+        self.folder = tempfile.TemporaryDirectory()
+        for roster in ["elves.csv", "reindeers.csv",
+                       "reindeers_exclusions.csv", "notes.txt"]:
+            with open(os.path.join(self.folder.name, roster), "w") as f:
+                f.write("Name, Email\n")
+
+    def tearDown(self):
+        """Remove the temporary folder of rosters"""
+        self.folder.cleanup()
+
+    def test_Folder(self):
+        """Check a folder of rosters
+
+        Check each CSV file in a folder is a group, sorted by name, with its
+        exclusions if there are any."""
+        self.assertEqual(secret_santa_mailer.find_rosters(self.folder.name), [
+            ("elves", os.path.join(self.folder.name, "elves.csv"), None),
+            ("reindeers", os.path.join(self.folder.name, "reindeers.csv"),
+             os.path.join(self.folder.name, "reindeers_exclusions.csv"))])
+
+    def test_Manifest(self):
+        """Check a manifest of rosters
+
+        Check each row of a manifest is a group, with paths relative to the
+        manifest, and blank rows are skipped."""
+        manifest = os.path.join(self.folder.name, "manifest.csv")
+        with open(manifest, "w") as f:
+            f.write("Roster, Exclusions\nreindeers.csv, " +
+                    "reindeers_exclusions.csv\n\nelves.csv\n")
+        self.assertEqual(secret_santa_mailer.find_rosters(manifest), [
+            ("reindeers", os.path.join(self.folder.name, "reindeers.csv"),
+             os.path.join(self.folder.name, "reindeers_exclusions.csv")),
+            ("elves", os.path.join(self.folder.name, "elves.csv"), None)])
+
+    def test_Missing(self):
+        """Check a missing folder, or manifest
+
+        Check a SystemExit and appropriate exit message are shown if there's
+        no such folder, or manifest."""
+        missing = os.path.join(self.folder.name, "missing")
+        with self.assertRaises(SystemExit) as cm:
+            secret_santa_mailer.find_rosters(missing)
+        self.assertEqual(cm.exception.code, ("Santa can't find the rosters! " +
+                                             "[No folder, or manifest called " +
+                                             missing + "]"))
+
+
+class SecretSantaBatchTest(unittest.TestCase):
+    """Unit tests for the secret_santa_batch function"""
+
+    def setUp(self):
+        """Set up a fake email password, a fake GIF, a local SMTP sink, and a
+        temporary folder of rosters"""
+        secret_santa_mailer.santas_key = "Test"
+        self.giphy = patch.object(secret_santa_mailer, "mime_giphy",
+                                  side_effect=fake_mime_giphy)
+        self.giphy.start()
+        self.smtp_sink = stand_ins_secret_santa_mailer.start_smtp_sink()
+        self.folder = tempfile.TemporaryDirectory()
+        rosters = {"elves": ["Elf " + str(i) for i in range(5)],
+                   "reindeers": ["Dasher", "Dancer", "Prancer", "Vixen"],
+                   "snowmen": ["Frosty", "Frosty"]}
+        for group_name, santas in rosters.items():
+            with open(os.path.join(self.folder.name, group_name + ".csv"),
+                      "w") as f:
+                f.write("Name, Email\n")
+                for santa in santas:
+                    f.write(santa + ", " + santa.replace(" ", "").lower() +
+                            "@" + group_name + ".me\n")
+        with open(os.path.join(self.folder.name,
+                               "reindeers_exclusions.csv"), "w") as f:
+            f.write("Giver, Receiver\nDasher, Dancer\nDancer, Dasher\n")
+
+    def tearDown(self):
+        """Stop the fake GIF, and the local SMTP sink, and remove the rosters"""
+        self.giphy.stop()
+        self.smtp_sink.shutdown()
+        self.smtp_sink.server_close()
+        self.folder.cleanup()
+
+    @patch("builtins.input", return_value="Y")
+    def test_Batch(self, input):
+        """Check every group in a batch
+
+        Check every Secret Santa in each valid group gets a letter, exclusions
+        are followed, and groups with problems are skipped, and summarised."""
+        batch_summary = secret_santa_mailer.secret_santa_batch(
+            self.folder.name, "santa@test.me", workers=2, postmen=2,
+            host="localhost", port=self.smtp_sink.server_address[1], tls=False)
+        self.assertEqual(batch_summary["elves"], {"santas": 5, "sent": 5,
+                                                  "lost": 0, "problems": []})
+        self.assertEqual(batch_summary["reindeers"],
+                         {"santas": 4, "sent": 4, "lost": 0, "problems": []})
+        self.assertEqual(batch_summary["snowmen"]["sent"], 0)
+        self.assertEqual(batch_summary["snowmen"]["problems"],
+                         ["There's an impostor! [All Secret Santas must be " +
+                          "unique]"])
+        self.assertEqual(len(self.smtp_sink.letters), 9)
+        for _, rcpttos, data in self.smtp_sink.letters:
+            santas_letter = email.message_from_bytes(data)
+            plain_text = [part for part in santas_letter.walk()][2]
+            letter_text = plain_text.get_payload(decode=True).decode("utf8")
+            self.assertTrue(rcpttos[0].endswith(("@elves.me", "@reindeers.me")))
+            if rcpttos[0] == "dasher@reindeers.me":
+                self.assertNotIn("Dancer", letter_text)
+
 
 
 def gen_tests_suite():
@@ -250,14 +2264,41 @@ def gen_tests_suite():
     tests_suite = unittest.TestSuite()
 
     # Create a list of all unit test classes
-    test_classes = [ContinueCheckerTests,
+    test_classes = [ReadSleighsTest,
+                    SantasRosterTest,
+                    ContinueCheckerTests,
+                    InspectSleighsTest,
                     FindSleighsTest,
                     CheckReindeersTest,
                     MimeGiphyTest,
+                    GiphyCacheTest,
+                    SantasPictureTest,
+                    GiphyBudgetTest,
+                    GiphyClientTest,
+                    GiphyPoolTest,
+                    MimeGiphyAsyncTest,
                     SecretSantaRandomiserTest,
+                    RandomSleighCycleTest,
+                    SecretSantaDerangementTest,
+                    BatchSleighCyclesTest,
+                    SantasTallyTest,
+                    SecretSantaShardedTest,
+                    LoadExclusionsTest,
+                    SecretSantaExclusionsTest,
+                    RepairPairingsTest,
                     ImportTemplateTest,
+                    LetterSkeletonTest,
                     CallPostmanTest,
-                    SecretSantaMailerTest]
+                    CallPostmenTest,
+                    LetterPipelineTest,
+                    SantasStopwatchTest,
+                    SantasPacerTest,
+                    SantasJournalTest,
+                    SpoolLettersTest,
+                    SecretSantaMailerTest,
+                    SecretSantaMailerAsyncTest,
+                    FindRostersTest,
+                    SecretSantaBatchTest]
 
     # Iterate through each unit test class, and load it into the unit test suite
     for test_class in test_classes: